@@ -0,0 +1,279 @@
+"""
+Soak the passkey flows on a device, to qualify an authenticator: run every flow a number of times and report how long
+each of its steps takes (p50/p95/p99) and how many flows per minute succeed.
+
+Run it with `python -m benchmarks.flow_soak`, against the first device of --devices, or with --offline against the
+offline Appium server. The results can be stored with --json and compared with the results of an earlier run with
+--baseline, the exit code is 1 if a step got slower than --threshold allows.
+Registering the same user again is only possible against the local relying party (--local-rp), against webauthn.io
+every registration uses a new username.
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+import traceback
+from contextlib import ExitStack
+from typing import Callable
+
+from appium import webdriver
+from appium.options.android import UiAutomator2Options
+from selenium.common import WebDriverException
+
+from shared.appium_util import DriverController
+from shared.device_registry import DeviceRegistry
+from shared.passkey_util import HardwarePasskeyUtil, LocalPasskeyUtil, DEFAULT_USERNAME
+from shared.presence import PresenceCalibration, PresenceController
+from shared.relay import AsyncRelayBoard
+from shared.tracing import tracer
+from shared.wait_statistics import percentile
+from webauthn.webauthn_util import WebauthnUtil
+
+capabilities = dict(
+    platformName='Android',
+    automationName='uiautomator2',
+    deviceName='Android',
+    nativeWebScreenshot=True,
+    browserName='Chrome',
+)
+
+# The users the passkeys are registered for, one per authenticator so the sheets don't offer a choice
+HARDWARE_USERNAME = DEFAULT_USERNAME
+DEVICE_USERNAME = f'{DEFAULT_USERNAME}-device'
+
+PERCENTILES = dict(p50_ms=0.5, p95_ms=0.95, p99_ms=0.99)
+# Steps that are shorter than this in both runs are never reported as a regression, their variation is noise
+MIN_REGRESSION_MS = 50.0
+# The soaked flows don't resume after a failed step, a step that only works the second time is a failure when
+# qualifying an authenticator
+SOAK_RESUMES = 0
+
+
+class SoakContext:
+    """ The utilities a flow needs, and the number of the iteration, to vary the username if needed """
+
+    def __init__(self, wa: WebauthnUtil, local: LocalPasskeyUtil, pk: HardwarePasskeyUtil):
+        self.wa = wa
+        self.local = local
+        self.pk = pk
+        self.iteration = 0
+
+    def username(self, base: str) -> str:
+        """ Get a username that can be registered, the same one if the relying party can forget it """
+        return base if self.wa.reset_credentials(base) else f'{base}{self.iteration}'
+
+
+def hardware_registration(context: SoakContext) -> None:
+    username = context.username(HARDWARE_USERNAME)
+    context.wa.registration_flow(context.pk.registration_steps(), username, SOAK_RESUMES).run()
+
+
+def hardware_authentication(context: SoakContext) -> None:
+    context.wa.authentication_flow(context.pk.authentication_steps(), HARDWARE_USERNAME, SOAK_RESUMES).run()
+
+
+def hardware_discoverable(context: SoakContext) -> None:
+    context.wa.authentication_flow(context.pk.discoverable_steps(HARDWARE_USERNAME), None, SOAK_RESUMES).run()
+
+
+def local_registration(context: SoakContext) -> None:
+    username = context.username(DEVICE_USERNAME)
+    context.wa.registration_flow(context.local.registration_steps(), username, SOAK_RESUMES).run()
+
+
+def local_authentication(context: SoakContext) -> None:
+    context.wa.authentication_flow(context.local.pin_steps(), DEVICE_USERNAME, SOAK_RESUMES).run()
+
+
+def _register(context: SoakContext, username: str, do_flow: Callable[[], None]) -> None:
+    """ Make sure a user has a passkey before its authentication is soaked, it may already have one """
+    context.wa.open_page()
+    context.wa.register(username)
+    do_flow()
+    context.wa.verify_registered()
+
+
+def register_hardware(context: SoakContext) -> None:
+    _register(context, HARDWARE_USERNAME, context.pk.do_registration_flow)
+
+
+def register_device(context: SoakContext) -> None:
+    _register(context, DEVICE_USERNAME, context.local.do_local_passkey_registration_flow)
+
+
+# Flow -> what has to be done once before it can be repeated
+FLOWS: dict[Callable[[SoakContext], None], Callable[[SoakContext], None] | None] = {
+    hardware_registration: None,
+    hardware_authentication: register_hardware,
+    hardware_discoverable: register_hardware,
+    local_registration: None,
+    local_authentication: register_device,
+}
+# The offline scenario can't authenticate with a device passkey
+OFFLINE_FLOWS = [hardware_registration, hardware_authentication, hardware_discoverable, local_registration]
+
+
+def soak(context: SoakContext, function: Callable[[SoakContext], None], iterations: int) -> dict:
+    """ Run a flow a number of times and get the statistics of its steps """
+    steps: dict[str, list[float]] = {}
+    failures = []
+    start = time.perf_counter()
+    for iteration in range(iterations):
+        context.iteration = iteration
+        tracer.start_trace()
+        iteration_start = time.perf_counter()
+        try:
+            function(context)
+        except (AssertionError, WebDriverException, TimeoutError) as e:
+            message = str(e).strip().splitlines()
+            failures.append(f"{iteration}: {type(e).__name__}{': ' + message[0] if message else ''}")
+            traceback.print_exc(file=sys.stderr)
+            # Close whatever sheet the failure left open, so the next iteration starts from the page
+            try:
+                context.wa.controller.press_back_button()
+            except WebDriverException:
+                pass
+            continue
+
+        durations = tracer.durations('step')
+        durations['total'] = (time.perf_counter() - iteration_start) * 1000
+        if 'user_presence' in durations:
+            durations['presence_to_success'] = durations['user_presence'] + durations['result']
+        for name, duration in durations.items():
+            steps.setdefault(name, []).append(duration)
+    elapsed = time.perf_counter() - start
+
+    successes = iterations - len(failures)
+    return dict(
+        iterations=iterations, failures=len(failures), failure_messages=failures,
+        throughput_per_minute=successes / elapsed * 60 if elapsed else 0.0,
+        steps={name: dict(count=len(samples), mean_ms=statistics.fmean(samples),
+                          **{key: percentile(samples, fraction) for key, fraction in PERCENTILES.items()})
+               for name, samples in steps.items()},
+    )
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare results with those of an earlier run.
+
+    :param threshold: How much slower, as a fraction, the p95 of a step or how much lower the throughput may be.
+    :return: A description of every regression.
+    """
+    regressions = []
+    for name, flow in results['flows'].items():
+        before = baseline.get('flows', {}).get(name)
+        if before is None:
+            continue
+        if flow['throughput_per_minute'] < before['throughput_per_minute'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {flow['throughput_per_minute']:.2f}/min, "
+                               f"was {before['throughput_per_minute']:.2f}/min")
+        for step, stats in flow['steps'].items():
+            old = before['steps'].get(step)
+            if old is None:
+                continue
+            if stats['p95_ms'] > old['p95_ms'] * (1 + threshold) and stats['p95_ms'] - old['p95_ms'] > MIN_REGRESSION_MS:
+                regressions.append(f"{name}.{step}: p95 {stats['p95_ms']:.0f} ms, was {old['p95_ms']:.0f} ms")
+    return regressions
+
+
+def run(iterations: int, flow_names: list[str] | None, devices: str | None, offline: bool, latency: float,
+        local_rp: bool) -> dict:
+    """ Set up the device, or the offline server, and soak the flows """
+    with ExitStack() as stack:
+        if offline:
+            from offline.relay_board import SimulatedRelayBoard
+            from offline.server import OfflineAppiumServer
+            from offline.webauthn_io import webauthn_io_scenario
+            scenario = webauthn_io_scenario()
+            server = stack.enter_context(OfflineAppiumServer(scenario, latency))
+            server_url, target, backend, channel = server.url, 'offline', SimulatedRelayBoard(scenario), 1
+            presence_calibration = PresenceCalibration()
+            available = OFFLINE_FLOWS
+        else:
+            from shared.relay import create_backend
+            device = DeviceRegistry.load(devices).for_worker('master')
+            server_url, target = device.appium_server_url, device.name
+            backend, channel = create_backend(device.relay_backend, device.relay_serial), device.relay_channel
+            presence_calibration = PresenceCalibration(os.path.join('calibration', f'presence_{device.name}.json'))
+            available = list(FLOWS)
+
+        base_url = None
+        if local_rp and not offline:
+            from webauthn.relying_party import LocalRelyingParty, reverse_port
+            relying_party = stack.enter_context(LocalRelyingParty(port=0))
+            reverse_port(device.udid, relying_party.port)
+            stack.callback(reverse_port, device.udid, relying_party.port, remove=True)
+            base_url = relying_party.url
+
+        options = UiAutomator2Options().load_capabilities(capabilities | ({} if offline else device.capabilities))
+        driver = webdriver.Remote(server_url, options=options)
+        stack.callback(driver.quit)
+        relay_board = AsyncRelayBoard(backend)
+        stack.callback(relay_board.close)
+
+        controller = DriverController(driver)
+        # Javascript can't run against the recorded pages of the offline server
+        wa = WebauthnUtil(controller, use_scripts=not offline, **({'base_url': base_url} if base_url else {}))
+        presence = PresenceController(controller, relay_board, channel, presence_calibration)
+        context = SoakContext(wa, LocalPasskeyUtil(controller),
+                              HardwarePasskeyUtil(controller, relay_board, channel, presence))
+
+        functions = [function for function in available if flow_names is None or function.__name__ in flow_names]
+        results = dict(target=target, relying_party=wa.base_url, iterations=iterations,
+                       started=datetime.datetime.now().isoformat(timespec='seconds'), flows={})
+        tracer.enabled = True
+        try:
+            for function in functions:
+                if (setup := FLOWS[function]) is not None:
+                    setup(context)
+                print(f"Soaking {function.__name__}...", file=sys.stderr)
+                results['flows'][function.__name__] = soak(context, function, iterations)
+        finally:
+            tracer.enabled = False
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--iterations', type=int, default=20, help="How many times to run every flow")
+    parser.add_argument('--flows', nargs='+', choices=[function.__name__ for function in FLOWS],
+                        help="The flows to run, all of them by default")
+    parser.add_argument('--devices', default=os.environ.get('DEVICE_REGISTRY'),
+                        help="JSON file with the devices, the first one is used")
+    parser.add_argument('--local-rp', action='store_true', help="Use the local relying party instead of webauthn.io")
+    parser.add_argument('--offline', action='store_true', help="Run against the offline Appium server")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Simulated round trip time per command of the offline server, in seconds")
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file with the results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="How much slower than the baseline a step may get, as a fraction, 0.2 by default")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.flows, args.devices, args.offline, args.latency, args.local_rp)
+
+    print(f"{'flow':<26}{'step':<22}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for name, flow in results['flows'].items():
+        print(f"{name:<26}{'':<22}{flow['throughput_per_minute']:>24.2f} flows/min, "
+              f"{flow['failures']}/{flow['iterations']} failed")
+        for step, stats in flow['steps'].items():
+            print(f"{'':<26}{step:<22}{stats['p50_ms']:>10.0f}{stats['p95_ms']:>10.0f}{stats['p99_ms']:>10.0f}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
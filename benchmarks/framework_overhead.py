@@ -0,0 +1,134 @@
+"""
+Measure the overhead of the framework itself, by running the passkey flows against the offline Appium server.
+
+Run it with `python -m benchmarks.framework_overhead`, use --latency to simulate the round trip time of a real device.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from appium import webdriver
+from appium.options.android import UiAutomator2Options
+
+from offline.relay_board import SimulatedRelayBoard
+from offline.server import OfflineAppiumServer
+from offline.webauthn_io import webauthn_io_scenario
+from shared.appium_util import DriverController
+from shared.passkey_util import HardwarePasskeyUtil, LocalPasskeyUtil
+from shared.relay import AsyncRelayBoard
+from shared.tracing import tracer
+from shared.transport import PooledConnection
+from shared.wait_statistics import WaitStatistics
+from webauthn.webauthn_util import WebauthnUtil
+
+capabilities = dict(
+    platformName='Android',
+    automationName='uiautomator2',
+    deviceName='Android',
+    browserName='Chrome',
+)
+
+
+def local_registration(wa: WebauthnUtil, local: LocalPasskeyUtil, pk: HardwarePasskeyUtil) -> None:
+    wa.open_page()
+    wa.fill_username()
+    wa.click_register_button()
+    local.do_local_passkey_registration_flow()
+    wa.verify_registered_success()
+
+
+def hardware_registration(wa: WebauthnUtil, local: LocalPasskeyUtil, pk: HardwarePasskeyUtil) -> None:
+    wa.open_page()
+    wa.fill_username()
+    wa.click_register_button()
+    pk.do_registration_flow()
+    wa.verify_registered_success()
+
+
+def hardware_authentication(wa: WebauthnUtil, local: LocalPasskeyUtil, pk: HardwarePasskeyUtil) -> None:
+    wa.open_page()
+    wa.fill_username()
+    wa.click_authenticate_button()
+    pk.do_authentication_flow()
+    wa.verify_logged_in()
+    wa.delete_credentials()
+
+
+def discoverable_authentication(wa: WebauthnUtil, local: LocalPasskeyUtil, pk: HardwarePasskeyUtil) -> None:
+    wa.open_page()
+    wa.click_authenticate_button()
+    pk.do_discoverable_flow()
+    wa.verify_logged_in()
+
+
+FLOWS = [local_registration, hardware_registration, hardware_authentication, discoverable_authentication]
+
+
+def run(iterations: int, latency: float) -> list[dict]:
+    """ Run every flow a number of times and measure where the time goes """
+    results = []
+    scenario = webauthn_io_scenario()
+    with OfflineAppiumServer(scenario, latency) as server:
+        connection = PooledConnection(server.url)
+        driver = webdriver.Remote(connection, options=UiAutomator2Options().load_capabilities(capabilities))
+        controller = DriverController(driver, wait_statistics=WaitStatistics())
+        # Relay presses run on the relay board's own thread, only the time the flow waits for them is traced
+        relay_board = AsyncRelayBoard(SimulatedRelayBoard(scenario))
+        # Javascript can't run against the recorded pages, so the locator based interactions are measured
+        wa = WebauthnUtil(controller, use_scripts=False)
+        local = LocalPasskeyUtil(controller)
+        pk = HardwarePasskeyUtil(controller, relay_board)
+
+        tracer.enabled = True
+        for flow in FLOWS:
+            durations, overheads, commands, cache_hits, received = [], [], [], [], []
+            for _ in range(iterations):
+                tracer.start_trace()
+                server.command_count = 0
+                controller.cache_hits = 0
+                connection.statistics.reset()
+                start = time.perf_counter()
+                flow(wa, local, pk)
+                duration = time.perf_counter() - start
+
+                # Everything that isn't a fixed sleep or waiting for the (simulated) device is framework overhead
+                overhead = duration - tracer.time_in('sleep', 'relay') - server.command_count * latency
+                durations.append(duration * 1000)
+                overheads.append(overhead * 1000)
+                commands.append(server.command_count)
+                cache_hits.append(controller.cache_hits)
+                received.append(connection.statistics.bytes_received)
+
+            results.append(dict(
+                flow=flow.__name__, iterations=iterations, commands=statistics.median(commands),
+                duration_ms=statistics.median(durations), overhead_ms=statistics.median(overheads),
+                overhead_per_command_ms=statistics.median(overheads) / statistics.median(commands),
+                cache_hits=statistics.median(cache_hits), kb_received=statistics.median(received) / 1024,
+            ))
+        tracer.enabled = False
+        relay_board.close()
+        driver.quit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--iterations', type=int, default=5, help="How many times to run every flow")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated round trip time per command, in seconds")
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.latency)
+    print(f"{'flow':<30}{'commands':>10}{'duration (ms)':>16}{'overhead (ms)':>16}{'per command (ms)':>18}"
+          f"{'cache hits':>12}{'received (kB)':>15}")
+    for row in results:
+        print(f"{row['flow']:<30}{row['commands']:>10.0f}{row['duration_ms']:>16.1f}{row['overhead_ms']:>16.1f}"
+              f"{row['overhead_per_command_ms']:>18.2f}{row['cache_hits']:>12.0f}{row['kb_received']:>15.1f}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Measure what locators cost the framework: building them, looking them up in the caches of the controller, and
+evaluating them against a snapshot. Every operation is timed with the memoized, precompiled locators and with the
+work they save redone on every call, like before locators were value types.
+
+Run it with `python -m benchmarks.locator_overhead`.
+"""
+import argparse
+import json
+import os
+import timeit
+
+from shared.locator import Locator, Context
+from shared.passkey_data import PasskeyLocators
+from shared.passkey_util import DEFAULT_USERNAME
+from shared.snapshot import HierarchySnapshot
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), '..', 'offline', 'recordings')
+
+
+def _measure(statement, number: int) -> float:
+    """ Get the time per call of a function, in nanoseconds, as the best of a few repeats """
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e9
+
+
+def run(number: int) -> list[dict]:
+    with open(os.path.join(RECORDINGS_DIR, 'select_credential.xml')) as file:
+        snapshot = HierarchySnapshot(Context.NATIVE, file.read())
+    locators = [value for value in vars(PasskeyLocators).values() if isinstance(value, Locator)]
+    tuple_cache = {(locator.context, locator.by, locator.value): None for locator in locators}
+    locator_cache = dict.fromkeys(locators)
+    composite = PasskeyLocators.CREATE_PASSKEY_TEXT
+    by_text = Locator.by_text.__wrapped__
+
+    def find_all_uncompiled(locator: Locator) -> list:
+        # What HierarchySnapshot.find_all did before: generate and parse the XPath of every alternative every time
+        elements = []
+        for alternative in locator.alternatives:
+            xpath = alternative._compile_xpath()
+            elements.extend(element for element in snapshot._root.xpath(xpath) if element not in elements)
+        return elements
+
+    operations = [
+        ('build by_text', lambda: Locator.by_text(Context.NATIVE, DEFAULT_USERNAME),
+         lambda: by_text(Context.NATIVE, DEFAULT_USERNAME)),
+        ('build composite', lambda: Locator.any_of(*composite.alternatives),
+         lambda: Locator.any_of.__wrapped__(*composite.alternatives)),
+        ('element cache lookup', lambda: locator_cache.get(composite),
+         lambda: tuple_cache.get((composite.context, composite.by, composite.value))),
+        ('to_xpath', composite.to_xpath, composite._compile_xpath),
+        ('snapshot find_all', lambda: snapshot.find_all(PasskeyLocators.CHOOSE_PASSKEY_TEXT),
+         lambda: find_all_uncompiled(PasskeyLocators.CHOOSE_PASSKEY_TEXT)),
+    ]
+    results = []
+    for name, memoized, uncached in operations:
+        results.append(dict(operation=name, memoized_ns=_measure(memoized, number),
+                            uncached_ns=_measure(uncached, number)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=20000, help="How many times to run every operation")
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.number)
+    print(f"{'operation':<24}{'memoized (ns)':>16}{'uncached (ns)':>16}{'speedup':>10}")
+    for row in results:
+        print(f"{row['operation']:<24}{row['memoized_ns']:>16.0f}{row['uncached_ns']:>16.0f}"
+              f"{row['uncached_ns'] / row['memoized_ns']:>9.1f}x")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
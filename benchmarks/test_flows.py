@@ -0,0 +1,52 @@
+"""
+The passkey flows against the offline Appium server: they must end on the right page, and take no more commands
+than they took when the budgets below were set. A flow that needs more commands got slower on every real device.
+"""
+import time
+
+import pytest
+
+from benchmarks.framework_overhead import FLOWS
+from shared.passkey_util import HardwarePasskeyUtil, LocalPasskeyUtil
+from shared.tracing import tracer
+from webauthn.webauthn_util import WebauthnUtil
+
+# The most commands every flow may take on a fresh controller. The hardware flows poll while the simulated key isn't
+# ready for user presence yet, how often depends on timing, which the margin of 2 commands allows for.
+COMMAND_BUDGETS = dict(
+    local_registration=16,
+    hardware_registration=28 + 2,
+    hardware_authentication=30 + 2,
+    discoverable_authentication=27 + 2,
+)
+# Where every flow leaves the simulated phone, as (native screen, web page)
+END_STATES = dict(
+    local_registration=('chrome', 'registered'),
+    hardware_registration=('chrome', 'registered'),
+    hardware_authentication=('chrome', 'logged_in_empty'),
+    discoverable_authentication=('chrome', 'logged_in'),
+)
+
+
+@pytest.mark.parametrize('flow', FLOWS, ids=[flow.__name__ for flow in FLOWS])
+def test_flow_commands(flow, offline_server, offline_scenario, offline_controller, offline_relay_board,
+                       record_property):
+    wa = WebauthnUtil(offline_controller, use_scripts=False)
+    local = LocalPasskeyUtil(offline_controller)
+    pk = HardwarePasskeyUtil(offline_controller, offline_relay_board)
+    offline_server.command_count = 0
+
+    tracer.enabled = True
+    tracer.start_trace()
+    try:
+        start = time.perf_counter()
+        flow(wa, local, pk)
+        duration = time.perf_counter() - start
+        overhead = duration - tracer.time_in('sleep', 'relay')
+    finally:
+        tracer.enabled = False
+
+    record_property('commands', offline_server.command_count)
+    record_property('overhead_ms', round(overhead * 1000, 1))
+    assert (offline_scenario.screen, offline_scenario.page) == END_STATES[flow.__name__]
+    assert offline_server.command_count <= COMMAND_BUDGETS[flow.__name__]
@@ -1,14 +1,27 @@
 import os
+import time
+from typing import TYPE_CHECKING
 
 import pytest
-from appium import webdriver
-from appium.options.android import UiAutomator2Options
 from pytest import StashKey, CollectReport
 
-import RelayBoard
-from shared.appium_util import DriverController
-from shared.passkey_util import HardwarePasskeyUtil, LocalPasskeyUtil
-from webauthn.webauthn_util import WebauthnUtil
+from shared.credential_state import CredentialState, HARDWARE_KEY, DEVICE_PASSKEY
+from shared.device_registry import DeviceRegistry, DeviceConfig, current_worker_id, current_worker_count
+from shared.scheduling import DurationHistory, order_items, assign_work_units, strip_group, keep_unit_order
+
+# Appium, lxml and the FTDI libraries are only imported by the fixtures that need them, so collecting tests or running
+# tests that don't use a device never loads them, let alone opens a session or the USB relay board
+if TYPE_CHECKING:
+    from shared.appium_util import DriverController
+    from shared.artifacts import FailureArtifacts
+    from shared.device_profile import DeviceProfile
+    from shared.passkey_util import HardwarePasskeyUtil, LocalPasskeyUtil
+    from shared.presence import PresenceCalibration
+    from shared.screen_recording import ScreenRecorder
+    from shared.relay import AsyncRelayBoard
+    from shared.session_pool import SessionPool, PooledSession
+    from shared.wait_statistics import WaitStatistics
+    from webauthn.webauthn_util import WebauthnUtil
 
 base_capabilities = dict(
     platformName='Android',
@@ -21,56 +34,334 @@ browser_capabilities = dict(
     browserName='Chrome',
 )
 
-appium_server_url = 'http://localhost:4723'
+# Directory where what is learned about the devices is stored between runs
+calibration_dir = 'calibration'
+# Directory where the screenshots, page sources, logcat and screen recordings of failed tests are stored
+artifacts_dir = 'fail_artifacts'
+
+# The fixtures that run the framework against the offline Appium server, for the tests in tests/ and benchmarks/
+pytest_plugins = ['offline.fixtures']
+
+# Key used to store the device registry in the config stash
+device_registry_key = StashKey[DeviceRegistry]()
+# Key used to store which passkeys are registered in the config stash
+credential_state_key = StashKey[CredentialState]()
+# Key used to store how long tests took in earlier runs in the config stash
+duration_history_key = StashKey[DurationHistory]()
+
+
+def pytest_addoption(parser):
+    parser.addoption('--devices', default=os.environ.get('DEVICE_REGISTRY'),
+                     help="JSON file with the devices to run on, tests are spread over them when running with -n. "
+                          "Defaults to the DEVICE_REGISTRY environment variable, or a single local device.")
+    parser.addoption('--trace-dir', default=None,
+                     help="Directory to write a Chrome trace per test and a latency summary to, tracing is off if omitted")
+    parser.addoption('--local-rp', action='store_true',
+                     help="Run the webauthn tests against a local relying party instead of webauthn.io, the device "
+                          "reaches it through adb reverse")
+    parser.addoption('--keep-order', action='store_true',
+                     help="Run the tests in the order they are collected, instead of grouped by session, authenticator "
+                          "and context with the slow tests last")
+    parser.addoption('--max-artifacts-mb', type=int, default=200,
+                     help="Limit on the size of the artifacts of failed tests stored during the run, in MB")
+    parser.addoption('--no-screen-recording', action='store_true',
+                     help="Don't record the screen of the devices, by default the recording of a failed test is stored "
+                          "with its other artifacts")
+
+
+def pytest_configure(config):
+    config.stash[device_registry_key] = DeviceRegistry.load(config.getoption('devices'))
+    config.stash[credential_state_key] = CredentialState()
+    config.stash[duration_history_key] = DurationHistory(config.cache if hasattr(config, 'cache') else None)
+    config.pluginmanager.register(config.stash[duration_history_key], 'duration_history')
+    # With pytest-xdist, hand out the work units made by pytest_collection_modifyitems in the order they are made,
+    # unless a way to distribute the tests was asked for. -n alone makes pytest-xdist pick load, which is replaced.
+    dist_asked = getattr(config.known_args_namespace, 'dist', 'no') != 'no' or getattr(config.option, 'distload', False)
+    if not config.getoption('keep_order') and not dist_asked and getattr(config.option, 'dist', 'no') == 'load':
+        config.option.dist = 'loadgroup'
+    if not config.getoption('keep_order') and getattr(config.option, 'dist', 'no') == 'loadgroup':
+        keep_unit_order(config.option)
+    if hasattr(config, 'workerinput') and config.workerinput.get('work_units'):
+        # Makes pytest-xdist add the work unit to the node ids, which is what the controller schedules by
+        config.option.loadgroup = True
+    if config.getoption('trace_dir') is not None:
+        from shared.tracing import tracer
+        tracer.enabled = True
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    """ Tell the pytest-xdist workers to split the tests into work units """
+    node.workerinput['work_units'] = node.config.option.dist == 'loadgroup' and not node.config.getoption('keep_order')
+
+
+# Runs before pytest-xdist adds the work unit to the node ids
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    """
+    Order the tests to need the fewest new sessions, context switches and passkey registrations, with the slow tests
+    last. With pytest-xdist, the tests are split into work units that balance the devices, based on earlier durations.
+    """
+    if config.getoption('keep_order'):
+        return
+    if hasattr(config, 'workerinput') and config.workerinput.get('work_units'):
+        items[:] = assign_work_units(items, config.stash[duration_history_key], config.workerinput['workercount'])
+    else:
+        items[:] = order_items(items)
+
+
+def node_file_name(node, extension: str) -> str:
+    """ Get a file name for the artifacts of a test, based on its node id without the work unit pytest-xdist adds """
+    return strip_group(node.nodeid).replace("/", "_").replace(":", "_").replace(".py", "") + extension
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    """ Trace every test, including the setup and teardown of its fixtures """
+    trace_dir = item.config.getoption('trace_dir')
+    if trace_dir is None:
+        return (yield)
+
+    from shared.tracing import tracer
+    tracer.start_trace()
+    result = yield
+    tracer.write_trace(os.path.join(trace_dir, node_file_name(item, '.json')))
+    return result
+
+
+def pytest_sessionfinish(session):
+    trace_dir = session.config.getoption('trace_dir')
+    if trace_dir is not None:
+        from shared.tracing import tracer
+        tracer.write_summary(os.path.join(trace_dir, f'summary_{current_worker_id()}.json'))
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_auto_num_workers(config):
+    """ With '-n auto', start one worker per registered device """
+    return len(config.stash[device_registry_key])
+
+
+@pytest.fixture(scope='session')
+def device(request) -> DeviceConfig:
+    """ Get the device this worker runs its tests on """
+    return request.config.stash[device_registry_key].for_worker(current_worker_id(), current_worker_count())
+
+
+@pytest.fixture(scope='session')
+def wait_statistics(request, device) -> 'WaitStatistics':
+    """ Get how long locators took to appear on this worker's device, learned over previous runs """
+    from shared.wait_statistics import WaitStatistics
+    statistics = WaitStatistics(os.path.join(calibration_dir, f'waits_{device.name}.json'))
+    yield statistics
+    statistics.save()
+
+
+@pytest.fixture(scope='session')
+def device_profile(request, device) -> 'DeviceProfile':
+    """ Get what is known about this worker's device from previous runs, like which variant of a screen it shows """
+    from shared.device_profile import DeviceProfile
+    profile = DeviceProfile(os.path.join(calibration_dir, f'profile_{device.name}.json'))
+    yield profile
+    profile.save()
+
+
+@pytest.fixture(scope='session')
+def session_pool(request, device, wait_statistics, device_profile) -> 'SessionPool':
+    """ Keeps the Appium session of this worker's device alive between tests """
+    from shared.session_pool import SessionPool
+    pool = SessionPool(device.appium_server_url, wait_statistics, device_profile)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(scope='session')
+def screen_recorder(request, device) -> 'ScreenRecorder | None':
+    """ Record the screen of this worker's device during the whole run, None if it is turned off """
+    if request.config.getoption('no_screen_recording'):
+        yield None
+        return
+
+    from shared.screen_recording import ScreenRecorder
+    recorder = ScreenRecorder(device.udid)
+    recorder.start()
+    yield recorder
+    recorder.stop()
+
+
+@pytest.fixture(scope='session')
+def failure_artifacts(request, screen_recorder) -> 'FailureArtifacts':
+    """ Background writer for the screenshots, page sources, logcat and screen recordings of failed tests """
+    # Requesting the screen recorder makes it stop only after the last recording was pulled
+    from shared.artifacts import FailureArtifacts
+    artifacts = FailureArtifacts(artifacts_dir, request.config.getoption('max_artifacts_mb') * 1024 * 1024)
+    yield artifacts
+    artifacts.close()
 
 
 @pytest.fixture(scope='function')
-def driver(request):
-    """ Create a driver to interact with the Android device """
-    capabilities = base_capabilities.copy()
+def appium_session(request, session_pool, failure_artifacts, screen_recorder, device) -> 'PooledSession':
+    """ Get an Appium session from the pool, and give it back when the test is done """
+    started = time.time()
+    capabilities = base_capabilities | device.capabilities
     # If a test is marked with @pytest.mark.browser, we will add the browser capabilities to the requested capabilities
     if request.node.get_closest_marker('browser'):
         capabilities |= browser_capabilities
 
-    driver = webdriver.Remote(appium_server_url, options=UiAutomator2Options().load_capabilities(capabilities))
-    yield driver
-    driver.quit()
+    session = session_pool.acquire(capabilities)
+    yield session
+
+    failed = [phase for phase in request.node.stash.get(phase_report_key, {}).values() if phase.failed]
+    if not failed:
+        session_pool.release(session)
+        return
+
+    # A failed test can leave a prompt open or the device in an unknown state, so its session isn't reused,
+    # it is ended once the artifacts are captured. The teardown doesn't wait for that, but the next test only gets
+    # the device afterwards, so the screenshot shows the failure and not the next test.
+    release_device = session_pool.hold()
+
+    def done():
+        session.quit()
+        release_device()
+
+    failure_artifacts.capture(node_file_name(request.node, ''), failure_signature(failed[0]), session,
+                              done=done, recorder=screen_recorder, started=started)
+
+
+@pytest.fixture(scope='function')
+def driver(request, appium_session):
+    """ Get a driver to interact with the Android device """
+    return appium_session.driver
 
 
 @pytest.fixture(scope='session')
-def relay_board(request) -> RelayBoard:
-    """ Connect to a relay board """
-    board = RelayBoard.create_board()
+def relay_board(request, device) -> 'AsyncRelayBoard':
+    """ Connect to the relay board of this worker's device """
+    from shared.relay import AsyncRelayBoard, create_backend
+    from shared.tracing import tracer
+    backend = create_backend(device.relay_backend, device.relay_serial)
+    tracer.instrument(backend, 'switch_relay', 'relay')
+    board = AsyncRelayBoard(backend)
     yield board
     board.close()
 
 
 @pytest.fixture(scope='function')
-def controller(request, driver) -> DriverController:
-    """ Create a driver controller object """
-    return DriverController(driver)
+def controller(request, appium_session) -> 'DriverController':
+    """ Get the driver controller object of the session """
+    return appium_session.controller
+
+
+@pytest.fixture(scope='session')
+def presence_calibration(request, device) -> 'PresenceCalibration':
+    """ Get how long the security key of this worker's device needs before it accepts user presence """
+    from shared.presence import PresenceCalibration
+    return PresenceCalibration(os.path.join(calibration_dir, f'presence_{device.name}.json'))
 
 
 @pytest.fixture(scope='function')
-def pk_util(request, controller, relay_board) -> HardwarePasskeyUtil:
+def pk_util(request, controller, relay_board, device, presence_calibration) -> 'HardwarePasskeyUtil':
     """ Create a HardwarePasskeyUtil object """
-    return HardwarePasskeyUtil(controller, relay_board)
+    from shared.passkey_util import HardwarePasskeyUtil
+    from shared.presence import PresenceController
+    presence = PresenceController(controller, relay_board, device.relay_channel, presence_calibration)
+    return HardwarePasskeyUtil(controller, relay_board, device.relay_channel, presence)
 
 
 @pytest.fixture(scope='function')
-def local_pk_util(request, controller) -> LocalPasskeyUtil:
+def local_pk_util(request, controller) -> 'LocalPasskeyUtil':
     """ Create a LocalPasskeyUtil object """
+    from shared.passkey_util import LocalPasskeyUtil
     return LocalPasskeyUtil(controller)
 
 
+@pytest.fixture(scope='session')
+def relying_party_url(request, device) -> str:
+    """ Get the url of the relying party the webauthn tests run against, webauthn.io unless --local-rp is given """
+    from webauthn.webauthn_util import WEBAUTHN_IO_URL
+    if not request.config.getoption('local_rp'):
+        yield WEBAUTHN_IO_URL
+        return
+
+    from webauthn.relying_party import LocalRelyingParty, reverse_port
+    # A free port per worker, every worker has its own device and its own relying party
+    with LocalRelyingParty(port=0) as relying_party:
+        reverse_port(device.udid, relying_party.port)
+        yield relying_party.url
+        reverse_port(device.udid, relying_party.port, remove=True)
+
+
 @pytest.fixture(scope='function')
-def wa_util(request, controller, relay_board) -> WebauthnUtil:
+def wa_util(request, controller, relying_party_url) -> 'WebauthnUtil':
     """ Create a Webauthn Utility object and open the page """
-    util = WebauthnUtil(controller)
+    from webauthn.webauthn_util import WebauthnUtil
+    util = WebauthnUtil(controller, base_url=relying_party_url)
     util.open_page()
     return util
 
 
+@pytest.fixture(scope='session')
+def credential_state(request) -> CredentialState:
+    """ Get which passkeys are registered during this test run """
+    return request.config.stash[credential_state_key]
+
+
+def node_failed(node) -> bool:
+    """ Check if a test failed during setup or during the test itself """
+    return any(phase.failed for phase in node.stash.get(phase_report_key, {}).values())
+
+
+@pytest.fixture(scope='function')
+def registered_key(request, credential_state, wa_util, pk_util) -> str:
+    """
+    Make sure the hardware security key has a passkey for the default user, it is only registered if it doesn't
+    have one yet. The page is open and ready to authenticate.
+
+    :return: The username the passkey is registered for.
+    """
+    from shared.passkey_util import DEFAULT_USERNAME
+    if not credential_state.is_registered(HARDWARE_KEY, DEFAULT_USERNAME):
+        wa_util.register(DEFAULT_USERNAME)
+        pk_util.do_registration_flow()
+        # The authenticator may still have the passkey of an earlier run, which is just as good
+        wa_util.verify_registered()
+        credential_state.registered(HARDWARE_KEY, DEFAULT_USERNAME)
+        wa_util.open_page()
+    yield DEFAULT_USERNAME
+    # A failed test might have left the passkey in any state
+    if node_failed(request.node):
+        credential_state.invalidate(HARDWARE_KEY)
+
+
+@pytest.fixture(scope='function')
+def registered_device_passkey(request, credential_state, wa_util, local_pk_util) -> str:
+    """
+    Make sure the device has a passkey for the default user in its passkey manager, it is only registered if it
+    doesn't have one yet. The page is open and ready to authenticate.
+
+    :return: The username the passkey is registered for.
+    """
+    from shared.passkey_util import DEFAULT_USERNAME
+    if not credential_state.is_registered(DEVICE_PASSKEY, DEFAULT_USERNAME):
+        wa_util.register(DEFAULT_USERNAME)
+        local_pk_util.do_local_passkey_registration_flow()
+        # The authenticator may still have the passkey of an earlier run, which is just as good
+        wa_util.verify_registered()
+        credential_state.registered(DEVICE_PASSKEY, DEFAULT_USERNAME)
+        wa_util.open_page()
+    yield DEFAULT_USERNAME
+    if node_failed(request.node):
+        credential_state.invalidate(DEVICE_PASSKEY)
+
+
+def pytest_runtest_teardown(item):
+    """ Forget the registered passkeys a test changed, so the next test that needs one registers it again """
+    marker = item.get_closest_marker('mutates_credentials')
+    if marker is not None:
+        item.config.stash[credential_state_key].invalidate(*marker.args)
+
+
 # Key used to store the result of a test in the stash
 phase_report_key = StashKey[dict[str, CollectReport]]()
 
@@ -87,16 +378,9 @@ def pytest_runtest_makereport(item):
     return report
 
 
-@pytest.fixture(scope='function', autouse=True)
-def make_screenshot_on_fail(request, driver):
-    """ Check if the test failed, and if so create a screenshot of the device """
-    # Wait until the test is done
-    yield
-
-    report = request.node.stash[phase_report_key]
-    if ("setup" in report and report["setup"].failed) or ("call" in report and report["call"].failed):
-        # Test failed during setup or during the test itself, make a screenshot
-        file_name = request.node.nodeid.replace("/", "_").replace(":", "_").replace(".py", "") + ".png"
-        if not os.path.exists('fail_screenshots'):
-            os.mkdir('fail_screenshots')
-        driver.save_screenshot(f'fail_screenshots/{file_name}')
+def failure_signature(report: CollectReport) -> str:
+    """ Get what identifies a failure: where it happened and its message, failures with the same signature are alike """
+    crash = getattr(report.longrepr, 'reprcrash', None)
+    if crash is None:
+        return str(report.longrepr).strip().splitlines()[-1] if report.longrepr else report.nodeid
+    return f'{crash.path}:{crash.lineno}: {crash.message.splitlines()[0] if crash.message else ""}'
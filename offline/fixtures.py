@@ -0,0 +1,71 @@
+"""
+Fixtures that run the framework against the offline Appium server, for the tests of the framework and the benchmarks.
+They never touch the device fixtures, so they need no phone, Appium or relay board. The root conftest loads them as
+a plugin, Appium and lxml are only imported by the fixtures, like the device fixtures do.
+"""
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from offline.scenario import Scenario
+    from offline.server import OfflineAppiumServer
+    from shared.appium_util import DriverController
+    from shared.relay import AsyncRelayBoard
+    from shared.session_pool import SessionPool
+
+# The capabilities of the sessions on the offline server, the scenario starts in Chrome
+offline_capabilities = dict(
+    platformName='Android',
+    automationName='uiautomator2',
+    deviceName='Android',
+    browserName='Chrome',
+)
+
+
+@pytest.fixture(scope='function')
+def offline_scenario() -> 'Scenario':
+    """ A fresh simulated phone on about:blank, every test starts from the same screen """
+    from offline.webauthn_io import webauthn_io_scenario
+    return webauthn_io_scenario()
+
+
+@pytest.fixture(scope='function')
+def offline_server(offline_scenario) -> 'OfflineAppiumServer':
+    """ The offline Appium server, without latency so the command counts and overhead aren't hidden by it """
+    from offline.server import OfflineAppiumServer
+    with OfflineAppiumServer(offline_scenario) as server:
+        yield server
+
+
+@pytest.fixture(scope='function')
+def offline_controller(offline_server) -> 'DriverController':
+    """ A controller of a browser session on the offline server, with nothing learned or cached yet """
+    from appium import webdriver
+    from appium.options.android import UiAutomator2Options
+    from shared.appium_util import DriverController
+    from shared.transport import PooledConnection
+    from shared.wait_statistics import WaitStatistics
+    driver = webdriver.Remote(PooledConnection(offline_server.url),
+                              options=UiAutomator2Options().load_capabilities(offline_capabilities))
+    yield DriverController(driver, wait_statistics=WaitStatistics())
+    driver.quit()
+
+
+@pytest.fixture(scope='function')
+def offline_relay_board(offline_scenario) -> 'AsyncRelayBoard':
+    """ A relay board that presses the button of the simulated security key """
+    from offline.relay_board import SimulatedRelayBoard
+    from shared.relay import AsyncRelayBoard
+    relay_board = AsyncRelayBoard(SimulatedRelayBoard(offline_scenario))
+    yield relay_board
+    relay_board.close()
+
+
+@pytest.fixture(scope='function')
+def offline_session_pool(offline_server) -> 'SessionPool':
+    """ A session pool on the offline server, which ends its idle session after the test """
+    from shared.session_pool import SessionPool
+    session_pool = SessionPool(offline_server.url)
+    yield session_pool
+    session_pool.close()
@@ -0,0 +1,10 @@
+from offline.scenario import Scenario
+from shared.relay import SimulatedRelayBackend
+
+
+class SimulatedRelayBoard(SimulatedRelayBackend):
+    """ Relay board that presses the button of the simulated security key of a scenario, instead of a real one """
+
+    def __init__(self, scenario: Scenario):
+        super().__init__(on_press=scenario.press_relay)
+        self.scenario = scenario
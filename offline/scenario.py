@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+
+from shared.locator import Locator, Context
+from shared.snapshot import HierarchySnapshot
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), 'recordings')
+
+
+def load_recording(name: str, **substitutions: str) -> str:
+    """
+    Load a recorded UI hierarchy or web page.
+
+    :param name: The file name of the recording, in the recordings directory.
+    :param substitutions: Content to fill in for the '<!--KEY-->' placeholders of the recording.
+    """
+    with open(os.path.join(RECORDINGS_DIR, name)) as file:
+        source = file.read()
+    for key, value in substitutions.items():
+        source = source.replace(f'<!--{key.upper()}-->', value)
+    return source
+
+
+class Transition:
+    """ A change of screen and/or web page, triggered by an action on the device """
+
+    def __init__(self, source: str | None, trigger: str, screen: str | None = None, page: str | None = None,
+                 locator: Locator | None = None, typed: str | None = None, keycode: int | None = None,
+                 channel: int | None = None, ready_after: float = 0.0, seconds: float | None = None,
+                 url: str | None = None):
+        self.source = source
+        self.trigger = trigger
+        self.screen = screen
+        self.page = page
+        self.locator = locator
+        self.typed = typed
+        self.keycode = keycode
+        self.channel = channel
+        self.ready_after = ready_after
+        self.seconds = seconds
+        self.url = url
+
+
+class Scenario:
+    """
+    The state of a simulated device: the native screen that is shown, the web page that is loaded in Chrome
+    and the transitions between screens that actions on the device trigger.
+
+    Screens and pages are registered by name with their recorded hierarchy or DOM. Transitions are checked in the order
+    they were added, the first one that matches an action is applied.
+    """
+
+    def __init__(self, screen: str, page: str | None = None):
+        self.screens: dict[str, str] = {}
+        self.pages: dict[str, str] = {}
+        self.transitions: list[Transition] = []
+        self.screen = screen
+        self.page = page
+        self.typed = ''
+        self.relay_presses: list[tuple[float, int]] = []
+        self._entered_at = time.monotonic()
+        self._lock = threading.RLock()
+
+    def add_screen(self, name: str, source: str) -> None:
+        """ Register a native screen by the XML of its UI hierarchy """
+        self.screens[name] = source
+
+    def add_page(self, name: str, source: str) -> None:
+        """ Register a web page by its HTML """
+        self.pages[name] = source
+
+    def on_click(self, source: str, locator: Locator, screen: str | None = None, page: str | None = None,
+                 typed: str | None = None) -> None:
+        """
+        Change screen when an element matching the locator is clicked.
+
+        :param typed: Only apply the transition if this text was typed on the screen, e.g. to check a PIN.
+        """
+        self.transitions.append(Transition(source, 'click', screen, page, locator=locator, typed=typed))
+
+    def on_keycode(self, source: str, keycode: int, screen: str | None = None, page: str | None = None,
+                   typed: str | None = None) -> None:
+        """ Change screen when a key is pressed, optionally only if the given text was typed """
+        self.transitions.append(Transition(source, 'keycode', screen, page, keycode=keycode, typed=typed))
+
+    def on_relay(self, source: str, screen: str | None = None, page: str | None = None, channel: int | None = None,
+                 ready_after: float = 0.0) -> None:
+        """
+        Change screen when the button of the security key is pressed by the relay.
+
+        :param channel: The relay channel that has to be switched, None for any channel.
+        :param ready_after: Presses within this many seconds after the screen appeared are ignored,
+                            like a real authenticator that isn't ready to receive user presence yet.
+        """
+        self.transitions.append(Transition(source, 'relay', screen, page, channel=channel, ready_after=ready_after))
+
+    def on_url(self, url: str, screen: str | None = None, page: str | None = None) -> None:
+        """ Change screen when a url starting with the given url is opened, on any screen """
+        self.transitions.append(Transition(None, 'url', screen, page, url=url))
+
+    def after(self, source: str, seconds: float, screen: str | None = None, page: str | None = None) -> None:
+        """ Change screen when a screen has been shown for some time, e.g. to time out a prompt """
+        self.transitions.append(Transition(source, 'timeout', screen, page, seconds=seconds))
+
+    def _apply(self, transition: Transition) -> None:
+        """ Go to the screen and page of a transition """
+        if transition.screen is not None:
+            self.screen = transition.screen
+            self._entered_at = time.monotonic()
+            self.typed = ''
+        if transition.page is not None:
+            self.page = transition.page
+
+    def _find(self, trigger: str, **conditions) -> Transition | None:
+        """ Find the first transition from the current screen for a trigger """
+        for transition in self.transitions:
+            if transition.trigger != trigger or transition.source not in (None, self.screen):
+                continue
+            if any(getattr(transition, key) not in (None, value) for key, value in conditions.items()):
+                continue
+            if transition.typed is not None and transition.typed != self.typed:
+                continue
+            return transition
+        return None
+
+    def update(self) -> None:
+        """ Apply timed transitions whose time has passed """
+        with self._lock:
+            for transition in self.transitions:
+                if (transition.trigger == 'timeout' and transition.source == self.screen
+                        and time.monotonic() - self._entered_at >= transition.seconds):
+                    self._apply(transition)
+                    return
+
+    def source(self, context: Context) -> str:
+        """ Get the hierarchy of the current screen, or the DOM of the current page """
+        with self._lock:
+            self.update()
+            if context == Context.NATIVE:
+                return self.screens[self.screen]
+            if self.page is None:
+                return '<html><head></head><body></body></html>'
+            return self.pages[self.page]
+
+    def snapshot(self, context: Context) -> HierarchySnapshot:
+        """ Get a snapshot of the current screen or page """
+        return HierarchySnapshot(context, self.source(context))
+
+    def click(self, context: Context, path: str) -> None:
+        """ Click the element at an XPath position of the current screen or page """
+        with self._lock:
+            snapshot = self.snapshot(context)
+            clicked = snapshot.find_by_path(path)
+            for transition in self.transitions:
+                if (transition.trigger != 'click' or transition.source not in (None, self.screen, self.page)
+                        or transition.locator.context != context):
+                    continue
+                if transition.typed is not None and transition.typed != self.typed:
+                    continue
+                if clicked in snapshot.find_all(transition.locator):
+                    self._apply(transition)
+                    return
+
+    def type(self, text: str) -> None:
+        """ Type text into the focused field """
+        with self._lock:
+            self.typed += text
+
+    def press_keycode(self, keycode: int) -> None:
+        """ Press a key on the device """
+        with self._lock:
+            transition = self._find('keycode', keycode=keycode)
+            if transition is not None:
+                self._apply(transition)
+
+    def open_url(self, url: str) -> None:
+        """ Open a url in Chrome """
+        with self._lock:
+            for transition in self.transitions:
+                if transition.trigger == 'url' and url.startswith(transition.url):
+                    self._apply(transition)
+                    return
+
+    def press_relay(self, channel: int) -> None:
+        """ Press the button of the security key, by switching a relay """
+        with self._lock:
+            self.update()
+            self.relay_presses.append((time.monotonic(), channel))
+            transition = self._find('relay', channel=channel)
+            if transition is not None and time.monotonic() - self._entered_at >= transition.ready_after:
+                self._apply(transition)
@@ -0,0 +1,333 @@
+import base64
+import gzip
+import json
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from shared.locator import Locator, Context
+from offline.scenario import Scenario
+
+# The key W3C WebDriver uses for element references
+ELEMENT_KEY = 'element-6066-11e4-a52e-4f735466cecf'
+
+SCREEN_SIZE = dict(width=1080, height=2400)
+# Responses larger than this are gzipped if the client accepts it, like page sources and screenshots
+GZIP_MIN_SIZE = 1024
+
+
+def _blank_png(width: int = 1, height: int = 1) -> bytes:
+    """ Create a white PNG image, used as screenshot """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b''.join(b'\x00' + b'\xff\xff\xff' * width for _ in range(height))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+
+class WebDriverError(Exception):
+    """ Error that is returned to the client as a W3C WebDriver error """
+
+    def __init__(self, status: int, error: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.error = error
+
+
+class OfflineSession:
+    """ An Appium session on the offline server, it keeps track of its context and the elements it found """
+
+    def __init__(self, capabilities: dict):
+        self.id = str(uuid.uuid4())
+        self.capabilities = capabilities
+        self.browser = 'browserName' in capabilities
+        self.context = Context.WEB if self.browser else Context.NATIVE
+        # Element id -> the context, screen or page and position of the element when it was found
+        self.elements: dict[str, tuple[Context, str | None, str]] = {}
+
+
+class OfflineAppiumServer:
+    """
+    Local stand-in for an Appium server with the UiAutomator2 driver, which replays recorded hierarchies and DOMs.
+
+    It speaks enough of the W3C WebDriver and Appium protocol for the DriverController and the passkey and webauthn
+    utilities. What is on screen, and how actions change it, is described by a Scenario. To benchmark the framework
+    or reproduce slow devices, latency can be injected per command.
+    """
+
+    def __init__(self, scenario: Scenario, latency: float | dict[str, float] = 0.0, port: int = 0):
+        """
+        :param scenario: The simulated device.
+        :param latency: Seconds to wait before answering a command, either for all commands or per command name.
+        :param port: The port to listen on, 0 to pick a free port.
+        """
+        self.scenario = scenario
+        self.latency = latency
+        self.command_count = 0
+        self.sessions: dict[str, OfflineSession] = {}
+        # The W3C action sequences that were performed, the recorded screens don't react to gestures
+        self.performed_actions: list[list[dict]] = []
+        self._http = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        """ Get the url to give to webdriver.Remote """
+        host, port = self._http.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'OfflineAppiumServer':
+        """ Start serving in a background thread """
+        self._thread = threading.Thread(target=self._http.serve_forever, name='offline-appium', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """ Stop the server """
+        self._http.shutdown()
+        self._http.server_close()
+
+    def __enter__(self) -> 'OfflineAppiumServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, without this every response waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method: str):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+                try:
+                    status, value = 200, server.handle(method, self.path, body)
+                except WebDriverError as e:
+                    status, value = e.status, dict(error=e.error, message=str(e), stacktrace='')
+                response = json.dumps(dict(value=value)).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                if len(response) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    response = gzip.compress(response, compresslevel=1)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_DELETE(self):
+                self._handle('DELETE')
+
+        return Handler
+
+    # Routes, as (method, path pattern, command name), the command name is used for latency injection
+    _ROUTES = [
+        ('POST', r'/session', 'newSession'),
+        ('GET', r'/status', 'status'),
+        ('DELETE', r'/session/(?P<sid>[^/]+)', 'deleteSession'),
+        ('GET', r'/session/(?P<sid>[^/]+)/context', 'getCurrentContext'),
+        ('POST', r'/session/(?P<sid>[^/]+)/context', 'switchToContext'),
+        ('GET', r'/session/(?P<sid>[^/]+)/contexts', 'getContexts'),
+        ('POST', r'/session/(?P<sid>[^/]+)/element', 'findElement'),
+        ('POST', r'/session/(?P<sid>[^/]+)/elements', 'findElements'),
+        ('POST', r'/session/(?P<sid>[^/]+)/element/(?P<eid>[^/]+)/click', 'clickElement'),
+        ('POST', r'/session/(?P<sid>[^/]+)/element/(?P<eid>[^/]+)/value', 'sendKeysToElement'),
+        ('POST', r'/session/(?P<sid>[^/]+)/element/(?P<eid>[^/]+)/clear', 'clearElement'),
+        ('GET', r'/session/(?P<sid>[^/]+)/element/(?P<eid>[^/]+)/text', 'getElementText'),
+        ('GET', r'/session/(?P<sid>[^/]+)/element/(?P<eid>[^/]+)/attribute/(?P<name>[^/]+)', 'getElementAttribute'),
+        ('GET', r'/session/(?P<sid>[^/]+)/element/(?P<eid>[^/]+)/displayed', 'isElementDisplayed'),
+        ('GET', r'/session/(?P<sid>[^/]+)/source', 'getPageSource'),
+        ('GET', r'/session/(?P<sid>[^/]+)/screenshot', 'screenshot'),
+        ('GET', r'/session/(?P<sid>[^/]+)/window/rect', 'getWindowRect'),
+        ('POST', r'/session/(?P<sid>[^/]+)/url', 'get'),
+        ('POST', r'/session/(?P<sid>[^/]+)/back', 'goBack'),
+        ('DELETE', r'/session/(?P<sid>[^/]+)/cookie', 'deleteAllCookies'),
+        ('POST', r'/session/(?P<sid>[^/]+)/appium/device/press_keycode', 'pressKeyCode'),
+        ('POST', r'/session/(?P<sid>[^/]+)/actions', 'actions'),
+        ('DELETE', r'/session/(?P<sid>[^/]+)/actions', 'releaseActions'),
+        ('POST', r'/session/(?P<sid>[^/]+)/execute/sync', 'executeScript'),
+        ('POST', r'/session/(?P<sid>[^/]+)/execute/async', 'executeAsyncScript'),
+        ('POST', r'/session/(?P<sid>[^/]+)/timeouts', 'setTimeouts'),
+        ('POST', r'/session/(?P<sid>[^/]+)/se/log', 'getLog'),
+        ('POST', r'/session/(?P<sid>[^/]+)/appium/settings', 'updateSettings'),
+    ]
+
+    def handle(self, method: str, path: str, body: dict):
+        """ Handle one WebDriver command and return its value """
+        for route_method, pattern, command in self._ROUTES:
+            match = re.fullmatch(pattern, path.rstrip('/'))
+            if route_method == method and match:
+                break
+        else:
+            raise WebDriverError(404, 'unknown command', f'The command {method} {path} is not supported offline')
+
+        self.command_count += 1
+        latency = self.latency.get(command, 0.0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            time.sleep(latency)
+
+        params = match.groupdict()
+        session = None
+        if 'sid' in params:
+            if params['sid'] not in self.sessions:
+                raise WebDriverError(404, 'invalid session id', f"Session '{params['sid']}' does not exist")
+            session = self.sessions[params['sid']]
+        return getattr(self, f'_{command}')(session, body, **{k: v for k, v in params.items() if k != 'sid'})
+
+    def _newSession(self, session, body):
+        capabilities = body.get('capabilities', {}).get('alwaysMatch', {})
+        session = OfflineSession(capabilities)
+        self.sessions[session.id] = session
+        return dict(sessionId=session.id, capabilities=capabilities | {'platformName': 'Android'})
+
+    def _status(self, session, body):
+        return dict(ready=True, message='Offline Appium server')
+
+    def _deleteSession(self, session, body):
+        del self.sessions[session.id]
+
+    def _getCurrentContext(self, session, body):
+        return session.context.value
+
+    def _switchToContext(self, session, body):
+        try:
+            session.context = Context(body['name'])
+        except ValueError:
+            raise WebDriverError(404, 'no such context', f"Context '{body['name']}' does not exist")
+
+    def _getContexts(self, session, body):
+        return [context.value for context in Context] if session.browser else [Context.NATIVE.value]
+
+    def _find(self, session: OfflineSession, body: dict) -> list[dict]:
+        """ Find elements in the current screen or page and register them with the session """
+        snapshot = self.scenario.snapshot(session.context)
+        locator = Locator(session.context, body['using'], body['value'])
+        try:
+            elements = snapshot.find_all(locator)
+        except NotImplementedError as e:
+            raise WebDriverError(400, 'invalid argument', str(e))
+
+        location = self.scenario.screen if session.context == Context.NATIVE else self.scenario.page
+        references = []
+        for element in elements:
+            element_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f'{location}{snapshot.path_of(element)}'))
+            session.elements[element_id] = (session.context, location, snapshot.path_of(element))
+            references.append({ELEMENT_KEY: element_id})
+        return references
+
+    def _findElement(self, session, body):
+        references = self._find(session, body)
+        if not references:
+            raise WebDriverError(404, 'no such element', f"No element found by {body['using']}={body['value']}")
+        return references[0]
+
+    def _findElements(self, session, body):
+        return self._find(session, body)
+
+    def _element(self, session: OfflineSession, eid: str):
+        """ Get an element that was found before, if it is still on screen """
+        if eid not in session.elements:
+            raise WebDriverError(404, 'no such element', f"Element '{eid}' was never found")
+        context, location, path = session.elements[eid]
+        snapshot = self.scenario.snapshot(context)
+        current = self.scenario.screen if context == Context.NATIVE else self.scenario.page
+        element = snapshot.find_by_path(path) if location == current else None
+        if element is None:
+            raise WebDriverError(404, 'stale element reference', f"Element '{eid}' is no longer on screen")
+        return context, path, element
+
+    def _clickElement(self, session, body, eid):
+        context, path, _ = self._element(session, eid)
+        self.scenario.click(context, path)
+
+    def _sendKeysToElement(self, session, body, eid):
+        self._element(session, eid)
+        self.scenario.type(body.get('text') or ''.join(body.get('value', [])))
+
+    def _clearElement(self, session, body, eid):
+        self._element(session, eid)
+
+    def _getElementText(self, session, body, eid):
+        context, _, element = self._element(session, eid)
+        if context == Context.NATIVE:
+            return element.get('text', '')
+        return element.text_content().strip()
+
+    def _getElementAttribute(self, session, body, eid, name):
+        _, _, element = self._element(session, eid)
+        return element.get(name)
+
+    def _isElementDisplayed(self, session, body, eid):
+        self._element(session, eid)
+        return True
+
+    def _getPageSource(self, session, body):
+        return self.scenario.source(session.context)
+
+    def _screenshot(self, session, body):
+        return base64.b64encode(_blank_png()).decode()
+
+    def _getWindowRect(self, session, body):
+        return dict(x=0, y=0) | SCREEN_SIZE
+
+    def _get(self, session, body):
+        self.scenario.open_url(body['url'])
+
+    def _goBack(self, session, body):
+        self.scenario.press_keycode(4)
+
+    def _deleteAllCookies(self, session, body):
+        pass
+
+    def _pressKeyCode(self, session, body):
+        self.scenario.press_keycode(body['keycode'])
+
+    def _actions(self, session, body):
+        self.performed_actions.append(body['actions'])
+
+    def _releaseActions(self, session, body):
+        pass
+
+    def _executeScript(self, session, body):
+        script = body.get('script', '')
+        args = body.get('args') or [{}]
+        if script == 'mobile: pressKey':
+            self.scenario.press_keycode(args[0]['keycode'])
+            return None
+        if script == 'mobile: scrollGesture':
+            # The recorded hierarchies contain the whole scrollable view, there is never anything more to scroll to
+            return False
+        if script.startswith('mobile:'):
+            raise WebDriverError(404, 'unknown method', f"'{script}' is not supported offline")
+        # Javascript can't be run against a recorded DOM
+        return None
+
+    def _executeAsyncScript(self, session, body):
+        return None
+
+    def _setTimeouts(self, session, body):
+        pass
+
+    def _updateSettings(self, session, body):
+        pass
+
+    def _getLog(self, session, body):
+        # There is no device writing to logcat
+        return []
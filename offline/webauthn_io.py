@@ -0,0 +1,87 @@
+from appium.webdriver.extensions.android.nativekey import AndroidKey
+
+from offline.scenario import Scenario, load_recording
+from shared.locator import Locator, Context
+from shared.passkey_data import PasskeyLocators
+from shared.passkey_util import DEFAULT_USERNAME, DEFAULT_KEY_PIN, DEFAULT_DEVICE_PIN
+from webauthn.webauthn_data import WebAuthnLocators, WebAuthnText
+
+# How long the simulated security key needs before it accepts user presence, and before it times out
+KEY_READY_AFTER = 0.5
+KEY_TIMEOUT = 30
+
+
+def _alert(kind: str, text: str) -> str:
+    return f'<div class="alert alert-{kind}" role="alert">{text}</div>'
+
+
+def _credential_row(username: str) -> str:
+    return f'<tr><td>{username}</td><td><button class="btn btn-danger btn-sm"> Delete </button></td></tr>'
+
+
+def webauthn_io_scenario(username: str = DEFAULT_USERNAME, key_pin: str = DEFAULT_KEY_PIN,
+                         device_pin: str = DEFAULT_DEVICE_PIN, key_ready_after: float = KEY_READY_AFTER) -> Scenario:
+    """
+    Simulated phone with Chrome on webauthn.io, the GMS passkey sheets, the systemui PIN screen and a security key.
+    It supports registering and authenticating with a security key or a device passkey, discoverable credentials,
+    wrong PINs, user presence timeouts and deleting credentials.
+
+    :param key_ready_after: Seconds after the 'connect your key' prompt appears before the key accepts user presence.
+    """
+    scenario = Scenario('chrome', 'blank')
+
+    scenario.add_page('blank', '<html><head></head><body></body></html>')
+    scenario.add_page('webauthn', load_recording('webauthn_io.html'))
+    scenario.add_page('registered', load_recording('webauthn_io.html', alert=_alert('success', WebAuthnText.REGISTER_SUCCESS)))
+    scenario.add_page('not_allowed', load_recording('webauthn_io.html', alert=_alert('danger', WebAuthnText.TIMED_OUT_NOT_ALLOWED)))
+    scenario.add_page('logged_in', load_recording('logged_in.html', credentials=_credential_row(username)))
+    scenario.add_page('logged_in_empty', load_recording('logged_in.html'))
+
+    scenario.add_screen('chrome', load_recording('chrome.xml'))
+    scenario.add_screen('create_passkey', load_recording('create_passkey.xml'))
+    scenario.add_screen('discoverable', load_recording('discoverable.xml'))
+    scenario.add_screen('select_credential', load_recording('select_credential.xml'))
+    scenario.add_screen('device_pin', load_recording('device_pin.xml'))
+    scenario.add_screen('device_pin_wrong', load_recording('device_pin_wrong.xml'))
+    # The security key screens are the same for every flow, but where they lead to depends on the flow
+    for flow in ('register', 'authenticate', 'discoverable'):
+        scenario.add_screen(f'key_pin_{flow}', load_recording('key_pin.xml'))
+        scenario.add_screen(f'key_pin_wrong_{flow}', load_recording('key_pin_wrong.xml'))
+        scenario.add_screen(f'connect_key_{flow}', load_recording('connect_key.xml'))
+
+    # Web page
+    scenario.on_url('about:blank', screen='chrome', page='blank')
+    scenario.on_url('https://webauthn.io', screen='chrome', page='webauthn')
+    scenario.on_click('webauthn', WebAuthnLocators.REGISTER_BUTTON, screen='create_passkey')
+    scenario.on_click('webauthn', WebAuthnLocators.AUTHENTICATE_BUTTON, screen='discoverable', typed='')
+    scenario.on_click('webauthn', WebAuthnLocators.AUTHENTICATE_BUTTON, screen='key_pin_authenticate')
+    scenario.on_click('registered', WebAuthnLocators.AUTHENTICATE_BUTTON, screen='key_pin_authenticate')
+    scenario.on_click('logged_in', WebAuthnLocators.DELETE_BUTTON, page='logged_in_empty')
+    scenario.on_click('logged_in', WebAuthnLocators.LOG_OUT_BUTTON, page='webauthn')
+    scenario.on_click('logged_in_empty', WebAuthnLocators.LOG_OUT_BUTTON, page='webauthn')
+
+    # Passkey sheets
+    scenario.on_click('create_passkey', PasskeyLocators.DIFFERENT_DEVICE, screen='key_pin_register')
+    scenario.on_click('create_passkey', Locator.by_button_index(Context.NATIVE, 2), screen='device_pin')
+    scenario.on_click('discoverable', PasskeyLocators.DISCOVERABLE_DIFFERENT_DEVICE, screen='key_pin_discoverable')
+    scenario.on_click('select_credential', Locator.by_text(Context.NATIVE, username), screen='chrome', page='logged_in')
+
+    # Device PIN
+    for screen in ('device_pin', 'device_pin_wrong'):
+        scenario.on_keycode(screen, AndroidKey.ENTER, screen='chrome', page='registered', typed=device_pin)
+        scenario.on_keycode(screen, AndroidKey.ENTER, screen='device_pin_wrong')
+
+    # Security key PIN and user presence
+    success = dict(register=dict(screen='chrome', page='registered'),
+                   authenticate=dict(screen='chrome', page='logged_in'),
+                   discoverable=dict(screen='select_credential'))
+    for flow, target in success.items():
+        for screen in (f'key_pin_{flow}', f'key_pin_wrong_{flow}'):
+            scenario.on_click(screen, PasskeyLocators.CONFIRM_BUTTON, screen=f'connect_key_{flow}', typed=key_pin)
+            scenario.on_click(screen, PasskeyLocators.CONFIRM_BUTTON, screen=f'key_pin_wrong_{flow}')
+            scenario.on_click(screen, PasskeyLocators.CANCEL_BUTTON, screen='chrome', page='not_allowed')
+        scenario.on_relay(f'connect_key_{flow}', ready_after=key_ready_after, **target)
+        scenario.after(f'connect_key_{flow}', KEY_TIMEOUT, screen='chrome', page='not_allowed')
+        scenario.on_click(f'connect_key_{flow}', PasskeyLocators.CANCEL_BUTTON, screen='chrome', page='not_allowed')
+
+    return scenario
@@ -2,23 +2,65 @@ import time
 
 from appium import webdriver
 from appium.webdriver import WebElement
-from selenium.common import NoSuchElementException
+from selenium.common import NoSuchElementException, StaleElementReferenceException, TimeoutException
+from selenium.webdriver.common.actions import interaction
+from selenium.webdriver.common.actions.action_builder import ActionBuilder
+from selenium.webdriver.common.actions.mouse_button import MouseButton
+from selenium.webdriver.common.actions.pointer_input import PointerInput
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions
+from shared import ui_selector
+from shared.device_profile import DeviceProfile
 from shared.locator import Locator, Context
+from shared.snapshot import HierarchySnapshot
+from shared.tracing import tracer, traced, sleep
+from shared.wait_statistics import WaitStatistics
 
 
 # Note: when using a slow device or slow emulator this might need to be increased
 WAIT_TIMEOUT = 10
+# How long the screen must stay unchanged to be considered stable, in seconds
+QUIET_PERIOD = 0.1
+# The waitForIdleTimeout of UiAutomator2 unless it is changed, in milliseconds
+DEFAULT_WAIT_FOR_IDLE_TIMEOUT_MS = 10000
+# How long every segment of a swipe takes if no duration is given, in milliseconds, the same as driver.swipe
+SWIPE_SEGMENT_DURATION = 250
 
 
 class DriverController:
     """ Wrapper for the Appium driver that provides some utility methods """
 
-    def __init__(self, driver: webdriver.Remote):
+    def __init__(self, driver: webdriver.Remote, context: Context | None = None,
+                 device_size: dict[str, int] | None = None, wait_statistics: WaitStatistics | None = None,
+                 device_profile: DeviceProfile | None = None):
+        """
+        :param driver: The Appium driver to wrap.
+        :param context: The context the driver is currently in, if known. Otherwise, it is queried from the driver.
+        :param device_size: The size of the device's screen, if known. Otherwise, it is queried when first needed.
+        :param wait_statistics: Learned wait times, to derive timeouts and poll intervals per locator from.
+                                Without them, every wait uses WAIT_TIMEOUT and fixed poll intervals.
+        :param device_profile: What is known about the device, to only look for the variant of a composite locator
+                               that matches on it.
+        """
         self.driver = driver
-        self._current_context = Context.from_driver(self.driver)
-        self._device_size: dict[str, int] | None = None
+        self.wait_statistics = wait_statistics
+        self.device_profile = device_profile
+        # Wait times are learned per device model, as that is what determines how fast the UI is
+        self.device_model: str = (driver.capabilities or {}).get('deviceModel', 'unknown')
+        tracer.instrument_driver(self.driver)
+        self._current_context = context if context is not None else Context.from_driver(self.driver)
+        self._device_size: dict[str, int] | None = device_size
+        # Elements found before, per locator, they are forgotten whenever the screen might have changed
+        self._element_cache: dict[Locator, WebElement] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # The UiAutomator2 settings that were changed through this controller, and the defaults of those it restores
+        self._settings: dict = dict(waitForIdleTimeout=DEFAULT_WAIT_FOR_IDLE_TIMEOUT_MS)
+
+    @property
+    def current_context(self) -> Context:
+        """ Get the context the driver is currently in, without querying the driver """
+        return self._current_context
 
     @property
     def device_size(self) -> dict[str, int]:
@@ -27,6 +69,11 @@ class DriverController:
             self._device_size = self.driver.get_window_size()
         return self._device_size
 
+    @property
+    def cached_device_size(self) -> dict[str, int] | None:
+        """ Get the size of the device's screen if it is already known, without querying the driver """
+        return self._device_size
+
     @property
     def device_width(self) -> int:
         """ Get the width of the device's screen """
@@ -37,6 +84,7 @@ class DriverController:
         """ Get the height of the device's screen """
         return self.device_size["height"]
 
+    @traced
     def switch_context(self, context: Context, force: bool = False) -> None:
         """
         Switches the context of the Appium driver.
@@ -47,14 +95,59 @@ class DriverController:
         """
         if self._current_context == context and not force:
             return
+        self.clear_element_cache()
         self.driver.switch_to.context(context.value)
         self._current_context = context
 
+    def clear_element_cache(self) -> None:
+        """ Forget all elements found before, e.g. because the screen changed """
+        self._element_cache.clear()
+
+    def _cached_element(self, locator: Locator) -> WebElement:
+        """ Get the element of a locator from the cache, or find it if it isn't cached """
+        element = self._element_cache.get(locator)
+        if element is not None:
+            self.cache_hits += 1
+            return element
+        self.cache_misses += 1
+        return self.find_element(locator)
+
+    def _on_element(self, locator: Locator, action):
+        """
+        Do an action on the element of a locator, using the cached element if there is one.
+        If the element went stale, it is looked up again and the action is retried once.
+        """
+        try:
+            return action(self._cached_element(locator))
+        except StaleElementReferenceException:
+            self._element_cache.pop(locator, None)
+            self.cache_misses += 1
+            return action(self.find_element(locator))
+
+    @traced
+    def click(self, locator: Locator) -> None:
+        """ Click the element of a locator """
+        self._on_element(locator, lambda element: element.click())
+
+    @traced
+    def send_keys(self, locator: Locator, text: str) -> None:
+        """ Type text into the element of a locator """
+        self._on_element(locator, lambda element: element.send_keys(text))
+
+    @traced
+    def get_text(self, locator: Locator) -> str:
+        """ Get the text of the element of a locator """
+        return self._on_element(locator, lambda element: element.text)
+
+    @traced
     def find_element(self, locator: Locator) -> WebElement:
-        """ Find an element based on a locator """
+        """ Find an element based on a locator, this always asks the Appium server, but remembers the element """
         self.switch_context(locator.context)
-        return self.driver.find_element(locator.by, locator.value)
+        element = self.driver.find_element(locator.by, locator.value)
+        self._element_cache[locator] = element
+        return element
 
+    @traced
     def find_element_or_none(self, locator: Locator) -> WebElement | None:
         """ Find an element based on a locator, or return None if it doesn't exist. """
         # Not really a fan of this way of doing it, but there doesn't seem to be another way
@@ -63,11 +156,13 @@ class DriverController:
         except NoSuchElementException:
             return None
 
+    @traced
     def find_elements(self, locator: Locator) -> list[WebElement]:
         """ Find all elements that match a locator """
         self.switch_context(locator.context)
         return self.driver.find_elements(locator.by, locator.value)
 
+    @traced
     def wait_for(self, condition: expected_conditions, timeout: int = WAIT_TIMEOUT):
         """
         Wait for a condition to be met, with a maximum timeout
@@ -78,38 +173,226 @@ class DriverController:
         """
         return WebDriverWait(self.driver, timeout).until(condition)
 
-    def wait_for_element(self, locator: Locator, timeout: int = WAIT_TIMEOUT) -> WebElement:
-        """ Wait for an element based on a locator with a timeout """
+    def _learned_wait(self, locator: Locator, timeout: float | None) -> WebElement | None:
+        """
+        Poll for a locator with the poll intervals learned for it, and record how long it took to appear.
+
+        A learned deadline that passes is extended to WAIT_TIMEOUT, as the device may have become slower than it was.
+        Only successful waits are learned from, so otherwise the deadline would never grow and the wait would keep
+        failing. If the element doesn't appear at all, a wait time at the learned deadline is recorded.
+
+        :param timeout: The timeout, or None to use the learned deadline.
+        :return: The first element found, or None if it didn't appear in time.
+        """
+        statistics = self.wait_statistics
+        deadline = None
+        if timeout is None:
+            timeout = deadline = statistics.deadline(self.device_model, locator, WAIT_TIMEOUT)
+        start = time.monotonic()
+        while True:
+            elements = self.find_elements(locator)
+            elapsed = time.monotonic() - start
+            if elements:
+                statistics.record(self.device_model, locator, elapsed)
+                return elements[0]
+            if elapsed >= timeout:
+                if deadline is not None and timeout < WAIT_TIMEOUT:
+                    timeout = WAIT_TIMEOUT
+                    continue
+                if deadline is not None:
+                    statistics.record(self.device_model, locator, deadline)
+                return None
+            sleep(min(statistics.poll_interval(self.device_model, locator, elapsed), timeout - elapsed))
+
+    @traced
+    def wait_for_element(self, locator: Locator, timeout: float | None = None) -> WebElement:
+        """
+        Wait for an element based on a locator with a timeout.
+        Without a timeout, the deadline learned for the locator is used, or WAIT_TIMEOUT if nothing was learned yet.
+        For a composite locator of a native screen, only the alternative the device is known to use is waited for.
+        """
+        variant = self._known_variant(locator)
+        if variant is not None:
+            start = time.monotonic()
+            try:
+                element = self.wait_for_element(variant, timeout)
+                self._element_cache[locator] = element
+                return element
+            except TimeoutException:
+                self.device_profile.forget_variant(locator)
+                # The other alternatives only get what is left of the time the caller allowed
+                timeout = max((WAIT_TIMEOUT if timeout is None else timeout) - (time.monotonic() - start), 0)
+
         self.switch_context(locator.context)
-        return self.wait_for(expected_conditions.presence_of_element_located((locator.by, locator.value)), timeout)
+        if self.wait_statistics is None:
+            element = self.wait_for(expected_conditions.presence_of_element_located((locator.by, locator.value)),
+                                    WAIT_TIMEOUT if timeout is None else timeout)
+        else:
+            element = self._learned_wait(locator, timeout)
+            if element is None:
+                raise TimeoutException(f'Timed out waiting for {locator}')
+        self._element_cache[locator] = element
+        if self._learns_variant(locator):
+            alternative, _ = self._matching_alternative(locator, element)
+            self.device_profile.remember_variant(locator, alternative)
+        return element
 
-    def wait_for_element_or_none(self, locator: Locator, timeout: int = WAIT_TIMEOUT) -> WebElement | None:
+    def _learns_variant(self, locator: Locator) -> bool:
+        """
+        Check if the device profile learns which alternative of a locator the device uses.
+        Only native screens differ per device, the alternatives of a web locator are different states of the page.
+        """
+        return self.device_profile is not None and locator.context == Context.NATIVE and len(locator.alternatives) > 1
+
+    def _known_variant(self, locator: Locator) -> Locator | None:
+        """ Get the alternative of a composite locator the device is known to use """
+        return self.device_profile.variant(locator) if self._learns_variant(locator) else None
+
+    @traced
+    def wait_for_element_or_none(self, locator: Locator, timeout: float | None = None) -> WebElement | None:
         """ Wait for an element based on a locator, or return None if it doesn't exist. """
         try:
             return self.wait_for_element(locator, timeout)
         except NoSuchElementException:
             return None
 
-    def wait_for_first_element(self, locators: list[Locator], timeout: int = WAIT_TIMEOUT, time_between_tries: float = 0.5) -> WebElement:
-        """ Wait for the first element to be located from a list of locators """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            for locator in locators:
-                element = self.find_element_or_none(locator)
-                if element is not None:
-                    return element
-            time.sleep(time_between_tries)
+    @traced
+    def wait_for_first_element(self, locators: list[Locator], timeout: float | None = None,
+                               time_between_tries: float | None = None) -> WebElement:
+        """
+        Wait for the first element to be located from a list of locators.
+        All locators are merged into a single query, so every try is only one round trip to the Appium server.
+        Use wait_for_first_match to also know which locator matched, which costs extra round trips.
+        """
+        return self._wait_for_any(Locator.any_of(*locators), timeout, time_between_tries)
 
-        raise TimeoutError('Timed out waiting for first element to be located.')
+    @traced
+    def wait_for_first_match(self, locators: list[Locator], timeout: float | None = None,
+                             time_between_tries: float | None = None) -> tuple[Locator, WebElement]:
+        """
+        Wait for any of the locators to match an element.
+        All locators are merged into a single query, so every try is only one round trip to the Appium server.
+        Once an element is found, the locators before the last one are checked to find out which one matched.
 
+        :return: The first locator from the list that matches, and the element it found.
+        """
+        composite = Locator.any_of(*locators)
+        return self._matching_alternative(composite, self._wait_for_any(composite, timeout, time_between_tries))
+
+    def _wait_for_any(self, composite: Locator, timeout: float | None, time_between_tries: float | None) -> WebElement:
+        """
+        Wait for a composite locator to match an element.
+        Without a timeout or time between tries, the ones learned for the locator are used if there are any,
+        otherwise WAIT_TIMEOUT and 0.5 seconds.
+
+        :raises TimeoutException: If none of the locators matched in time.
+        """
+        if self.wait_statistics is not None and time_between_tries is None:
+            element = self._learned_wait(composite, timeout)
+        else:
+            element = None
+            deadline = time.monotonic() + (WAIT_TIMEOUT if timeout is None else timeout)
+            while True:
+                elements = self.find_elements(composite)
+                if elements:
+                    element = elements[0]
+                    break
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(0.5 if time_between_tries is None else time_between_tries)
+
+        if element is None:
+            raise TimeoutException('Timed out waiting for first element to be located.')
+        return element
+
+    def _matching_alternative(self, composite: Locator, element: WebElement) -> tuple[Locator, WebElement]:
+        """ Find out which locator of a composite locator matched, once the composite locator found an element """
+        alternatives = composite.alternatives
+        # Only check the alternatives up to the last one, if none of them match it must be the last one
+        for alternative in alternatives[:-1]:
+            elements = self.find_elements(alternative)
+            if elements:
+                return alternative, elements[0]
+        return alternatives[-1], element
+
+    @traced
+    def snapshot(self, context: Context = Context.NATIVE) -> HierarchySnapshot:
+        """
+        Fetch the native UI hierarchy or the web DOM once, so locators can be evaluated against it locally.
+        Use this when checking whether multiple elements are on screen, instead of looking for each one separately.
+        """
+        self.switch_context(context)
+        return HierarchySnapshot(context, self.driver.page_source)
+
+    @traced
+    def wait_until_stable(self, context: Context = Context.NATIVE, quiet_period: float = QUIET_PERIOD,
+                          timeout: float = WAIT_TIMEOUT, poll_interval: float = 0.05) -> HierarchySnapshot:
+        """
+        Wait until the screen stopped changing, e.g. after a swipe or after clicking something that updates the page.
+        The screen is stable when the fingerprint of its hierarchy didn't change for the quiet period.
+        If it keeps changing, like an animation that never ends, it stops waiting after the timeout.
+
+        :param context: The context to watch, the native hierarchy or the web DOM.
+        :param quiet_period: How long the hierarchy must stay the same, in seconds.
+        :param timeout: The longest time to wait, in seconds.
+        :param poll_interval: Time between fetching the hierarchy, in seconds.
+        :return: The last snapshot, so it can be used to check what is on the now stable screen.
+        """
+        deadline = time.monotonic() + timeout
+        snapshot = self.snapshot(context)
+        changed_at = time.monotonic()
+        while time.monotonic() - changed_at < quiet_period and time.monotonic() < deadline:
+            sleep(poll_interval)
+            previous, snapshot = snapshot, self.snapshot(context)
+            if snapshot.fingerprint != previous.fingerprint:
+                changed_at = time.monotonic()
+        return snapshot
+
+    @traced
+    def update_settings(self, settings: dict) -> None:
+        """
+        Change UiAutomator2 settings, only those that aren't set to the value yet, all of them in a single call.
+        Use this instead of driver.update_settings, so settings that are already set aren't sent again.
+        """
+        changed = {name: value for name, value in settings.items() if self._settings.get(name) != value}
+        if changed:
+            self.driver.update_settings(changed)
+            self._settings.update(changed)
+
+    @traced
+    def wait_for_idle(self, timeout: float = WAIT_TIMEOUT) -> None:
+        """
+        Wait until UiAutomator2 reports the app is idle, meaning it has no pending UI events or animations.
+        UiAutomator2 waits for this before every lookup, up to its waitForIdleTimeout setting, so this configures that
+        timeout (only when it changed) and does the cheapest lookup there is. The setting is restored afterwards, so
+        other lookups don't wait longer than before.
+        """
+        previous = self._settings['waitForIdleTimeout']
+        self.update_settings(dict(waitForIdleTimeout=int(timeout * 1000)))
+        try:
+            self.find_elements(Locator.by_ui_automator(Context.NATIVE, 'new UiSelector().index(0)'))
+        finally:
+            self.update_settings(dict(waitForIdleTimeout=previous))
+
+    @traced
+    def are_present(self, locators: list[Locator]) -> list[bool]:
+        """ Check which locators are currently on screen, with one snapshot per context instead of one call per locator """
+        snapshots = {context: self.snapshot(context) for context in dict.fromkeys(locator.context for locator in locators)}
+        return [snapshots[locator.context].is_present(locator) for locator in locators]
+
+    @traced
     def open_url(self, url: str) -> None:
         """ Open a web page, blocks until the page is fully loaded """
+        self.clear_element_cache()
         self.driver.get(url)
 
+    @traced
     def press_key(self, key: int):
         """ Press a key on the device, use AndroidKey to find the key codes """
+        self.clear_element_cache()
         self.driver.press_keycode(key)
 
+    @traced
     def swipe_percent(self, start_x: float, start_y: float, end_x: float, end_y: float, duration: int = 0):
         """
         Swipe using a percentage relative to the screen size, so (0.5, 0.5) would be the center of the screen.
@@ -120,13 +403,67 @@ class DriverController:
         :param end_y: The y percentage of the end of the swipe.
         :param duration: The duration of the swipe, in milliseconds.
         """
-        start_x_absolute = int(start_x * self.device_width)
-        start_y_absolute = int(start_y * self.device_height)
-        end_x_absolute = int(end_x * self.device_width)
-        end_y_absolute = int(end_y * self.device_height)
-        self.driver.swipe(start_x_absolute, start_y_absolute, end_x_absolute, end_y_absolute, duration)
+        self.swipe_paths([[(start_x, start_y), (end_x, end_y)]], duration)
+
+    @traced
+    def swipe_paths(self, paths: list[list[tuple[float, float]]], duration: int = 0):
+        """
+        Do one or more swipes, each through any number of points, in a single W3C actions request.
+
+        :param paths: The points every swipe goes through, as percentages relative to the screen size.
+        :param duration: The duration of every segment of a swipe, in milliseconds.
+        """
+        touch = PointerInput(interaction.POINTER_TOUCH, 'finger')
+        actions = ActionBuilder(self.driver, mouse=touch)
+        for (start_x, start_y), *points in paths:
+            touch.create_pointer_move(duration=0, x=int(start_x * self.device_width), y=int(start_y * self.device_height))
+            touch.create_pointer_down(button=MouseButton.LEFT)
+            for x, y in points:
+                touch.create_pointer_move(duration=duration or SWIPE_SEGMENT_DURATION,
+                                          x=int(x * self.device_width), y=int(y * self.device_height))
+            touch.create_pointer_up(button=MouseButton.LEFT)
+        self.clear_element_cache()
+        actions.perform()
+
+    @traced
+    def scroll_to(self, locator: Locator, max_scrolls: int = 10) -> WebElement:
+        """
+        Scroll until an element is on screen, and return it.
+
+        Locators that can be expressed as a single UiSelector are scrolled to by UiAutomator2 itself, with
+        UiScrollable.scrollIntoView, which is a single round trip. Other locators are looked for after every
+        'mobile: scrollGesture' on the screen, up to max_scrolls times.
+        """
+        self.clear_element_cache()
+        selector = locator.to_ui_automator()
+        if selector is not None and len(ui_selector.split_statements(selector)) == 1:
+            scrollable = Locator.by_ui_automator(Context.NATIVE, 'new UiScrollable(new UiSelector().scrollable(true))'
+                                                                 f'.scrollIntoView({selector.strip().rstrip(";")})')
+            try:
+                element = self.find_element(scrollable)
+            except NoSuchElementException:
+                # Nothing is scrollable, so the element can only be found as is
+                element = self.find_element(locator)
+            self._element_cache[locator] = element
+            return element
+
+        for _ in range(max_scrolls):
+            elements = self.find_elements(locator)
+            if elements:
+                self._element_cache[locator] = elements[0]
+                return elements[0]
+            self.switch_context(Context.NATIVE)
+            can_scroll_more = self.driver.execute_script('mobile: scrollGesture', {
+                'left': 0, 'top': int(self.device_height * 0.2), 'width': self.device_width,
+                'height': int(self.device_height * 0.6), 'direction': 'down', 'percent': 0.75,
+            })
+            if not can_scroll_more:
+                break
+        return self.find_element(locator)
 
+    @traced
     def press_back_button(self):
         """ Press the Android back button """
         self.switch_context(Context.NATIVE)
+        self.clear_element_cache()
         self.driver.back()
@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable
+
+from shared.locator import Context
+from shared.screen_recording import ScreenRecorder
+from shared.session_pool import PooledSession
+
+# How many logcat lines before the failure are kept
+LOGCAT_LINES = 500
+# The default limit on the size of all artifacts of a run, in bytes
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class FailureArtifacts:
+    """
+    Captures screenshots, page sources, logcat excerpts and screen recordings of failed tests on a background thread.
+
+    Fetching a screenshot is a big transfer over the Appium connection, so a test only queues the capture and its
+    teardown continues right away. The next test has to wait for the device until the capture is done, see
+    SessionPool.hold. Text artifacts are gzipped, an artifact identical to one already stored for the
+    same failure signature is skipped, and nothing is stored anymore once the run reaches its size limit.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        :param directory: The directory to store the artifacts in.
+        :param max_bytes: The limit on the size of all artifacts of the run.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stored_bytes = 0
+        self.skipped: list[str] = []
+        # Failure signature -> hashes of the artifacts stored for it
+        self._hashes: dict[str, set[str]] = {}
+        self._queue: queue.Queue[tuple | None] = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self._worker = threading.Thread(target=self._run, name='failure-artifacts', daemon=True)
+        self._worker.start()
+
+    def capture(self, name: str, signature: str, session: PooledSession,
+                done: Callable[[], None] | None = None, recorder: ScreenRecorder | None = None,
+                started: float | None = None) -> None:
+        """
+        Queue the capture of the artifacts of a failed test, without waiting for it.
+
+        :param name: The base file name of the artifacts, like the node id of the test.
+        :param signature: What identifies the failure, like the location and message of the error.
+        :param session: The session of the test, it must not be used by anything else until the capture is done.
+                        Nothing else must use the device either, or the screenshot shows what the next test does.
+        :param done: Called when the artifacts are taken from the session, e.g. to end it and let the next test start.
+        :param recorder: The screen recorder of the device, to pull the recording of the test from.
+        :param started: When the test started, as time.time(), the recording is pulled from then on.
+        """
+        self._queue.put((name, signature, session, done, recorder, started))
+
+    def _run(self) -> None:
+        """ Capture the queued failures, one after the other """
+        while (job := self._queue.get()) is not None:
+            name, signature, session, done, recorder, started = job
+            try:
+                self._capture(name, signature, session)
+            except Exception as e:
+                logger.warning("Could not capture the artifacts of %s: %s", name, e)
+            finally:
+                if done is not None:
+                    done()
+            # The recording is pulled with adb, the device can already be used by the next test
+            if recorder is not None and started is not None:
+                try:
+                    self._capture_recording(name, signature, recorder, started)
+                except Exception as e:
+                    logger.warning("Could not capture the screen recording of %s: %s", name, e)
+
+    def _capture(self, name: str, signature: str, session: PooledSession) -> None:
+        """ Fetch the artifacts of a failed test from the device and store them """
+        driver = session.driver
+        self._store(name + '.png', signature, driver.get_screenshot_as_png())
+
+        extension = '.xml' if session.controller.current_context == Context.NATIVE else '.html'
+        self._store(name + extension + '.gz', signature, driver.page_source.encode(), compress=True)
+
+        # Appium returns the logcat lines since the previous call, so this is what happened during the test
+        lines = driver.get_log('logcat')[-LOGCAT_LINES:]
+        logcat = '\n'.join(f"{line['timestamp']} {line['level']} {line['message']}" for line in lines)
+        self._store(name + '.logcat.txt.gz', signature, logcat.encode(), compress=True)
+
+    def _capture_recording(self, name: str, signature: str, recorder: ScreenRecorder, started: float) -> None:
+        """ Pull the screen recording of a failed test from the device and store it, one file per segment """
+        for index, segment in enumerate(recorder.collect(time.time() - started)):
+            self._store(f'{name}.screen{index}.mp4', signature, segment)
+
+    def _store(self, file_name: str, signature: str, data: bytes, compress: bool = False) -> None:
+        """ Write an artifact, unless it is a duplicate or the size limit is reached """
+        digest = hashlib.sha1(data).hexdigest()
+        hashes = self._hashes.setdefault(signature, set())
+        if digest in hashes:
+            return
+        if compress:
+            data = gzip.compress(data)
+        if self.stored_bytes + len(data) > self.max_bytes:
+            self.skipped.append(file_name)
+            return
+
+        hashes.add(digest)
+        self.stored_bytes += len(data)
+        with open(os.path.join(self.directory, file_name), 'wb') as file:
+            file.write(data)
+
+    def close(self) -> None:
+        """ Wait until all queued captures are done """
+        self._queue.put(None)
+        self._worker.join()
+        if self.skipped:
+            logger.warning("%d failure artifacts were not stored, the limit of %d MB was reached",
+                           len(self.skipped), self.max_bytes // (1024 * 1024))
@@ -0,0 +1,30 @@
+HARDWARE_KEY = 'hardware'
+DEVICE_PASSKEY = 'device'
+AUTHENTICATORS = (HARDWARE_KEY, DEVICE_PASSKEY)
+
+
+class CredentialState:
+    """
+    Which authenticators have a passkey registered during this test run, and for which user.
+
+    Registering goes through the whole flow: the page, the GMS sheet, the PIN and for a hardware key the relay, which
+    takes tens of seconds. Tests that only need a registered passkey reuse the one that is already there, and it is
+    only registered again after a test changed it, e.g. by deleting it or locking the PIN.
+    """
+
+    def __init__(self):
+        # Authenticator -> the username its passkey is registered for
+        self._registered: dict[str, str] = {}
+
+    def is_registered(self, authenticator: str, username: str) -> bool:
+        """ Check if the authenticator has a passkey for the user that can still be used """
+        return self._registered.get(authenticator) == username
+
+    def registered(self, authenticator: str, username: str) -> None:
+        """ Remember that a passkey was registered on the authenticator """
+        self._registered[authenticator] = username
+
+    def invalidate(self, *authenticators: str) -> None:
+        """ Forget the passkeys of the authenticators, of all of them if none are given """
+        for authenticator in authenticators or AUTHENTICATORS:
+            self._registered.pop(authenticator, None)
@@ -0,0 +1,111 @@
+import json
+import os
+
+from appium import webdriver
+from selenium.common import WebDriverException
+
+from shared.locator import Locator
+
+GMS_PACKAGE = 'com.google.android.gms'
+CHROME_PACKAGE = 'com.android.chrome'
+
+# One shell command that prints the build fingerprint and the versions of GMS and Chrome, one per line
+_PROBE_SCRIPT = (f'getprop ro.build.fingerprint; '
+                 f'echo gms $(dumpsys package {GMS_PACKAGE} | grep -m1 versionName=); '
+                 f'echo chrome $(dumpsys package {CHROME_PACKAGE} | grep -m1 versionName=)')
+
+
+class DeviceProfile:
+    """
+    What is known about a device, so it doesn't have to be queried or probed at runtime: its screen size, Android, GMS
+    and Chrome versions, the context sessions start in, and which variant of a locator its screens actually use.
+
+    It is stored in a JSON file and keyed by the serial and build fingerprint of the device. When either changes,
+    e.g. after a system or GMS update, everything is forgotten and learned again.
+    """
+
+    def __init__(self, path: str | None = None):
+        """ :param path: The JSON file to store the profile in, None to not store it. """
+        self.path = path
+        self.serial: str | None = None
+        self.fingerprint: str | None = None
+        self.android_version: str | None = None
+        self.gms_version: str | None = None
+        self.chrome_version: str | None = None
+        self._clear()
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                stored = json.load(file)
+            self.serial = stored.get('serial')
+            self.fingerprint = stored.get('fingerprint')
+            self.android_version = stored.get('android_version')
+            self.gms_version = stored.get('gms_version')
+            self.chrome_version = stored.get('chrome_version')
+            self.screen_size = stored.get('screen_size')
+            self.initial_contexts = stored.get('initial_contexts', {})
+            self.variants = stored.get('variants', {})
+
+    def _clear(self) -> None:
+        """ Forget everything that was learned about the device """
+        self.screen_size: dict[str, int] | None = None
+        # 'native' or 'browser' -> the context a session with those capabilities starts in
+        self.initial_contexts: dict[str, str] = {}
+        # Composite locator -> the alternative that matches on this device
+        self.variants: dict[str, str] = {}
+
+    def identify(self, driver: webdriver.Remote) -> bool:
+        """
+        Check which device and build a session runs on, and forget what was learned if it is a different one.
+        This is a single shell command, run it once per test run, when the first session is created.
+
+        :return: True if the profile still applies, False if it was cleared.
+        """
+        capabilities = driver.capabilities or {}
+        serial = capabilities.get('deviceUDID') or capabilities.get('udid')
+        android_version = capabilities.get('platformVersion')
+        gms_version = chrome_version = None
+        try:
+            output = driver.execute_script('mobile: shell', {'command': 'sh', 'args': ['-c', f"'{_PROBE_SCRIPT}'"]})
+            lines = output.splitlines()
+            fingerprint = lines[0].strip()
+            versions = dict(line.replace('versionName=', '').split()[:2] for line in lines[1:] if len(line.split()) > 1)
+            gms_version, chrome_version = versions.get('gms'), versions.get('chrome')
+        except (WebDriverException, IndexError, ValueError):
+            # Shell commands need the adb_shell feature of the Appium server, without it only the version is known
+            fingerprint = '/'.join(str(capabilities.get(key)) for key in
+                                   ('deviceManufacturer', 'deviceModel', 'platformVersion', 'deviceApiLevel'))
+
+        applies = (serial, fingerprint, gms_version, chrome_version) == \
+                  (self.serial, self.fingerprint, self.gms_version, self.chrome_version)
+        if not applies:
+            self._clear()
+            self.serial, self.fingerprint = serial, fingerprint
+            self.android_version, self.gms_version, self.chrome_version = android_version, gms_version, chrome_version
+        return applies
+
+    def variant(self, locator: Locator) -> Locator | None:
+        """ Get the alternative of a composite locator that matches on this device, if it is known """
+        alternatives = locator.alternatives
+        if len(alternatives) < 2:
+            return None
+        known = self.variants.get(locator.key)
+        return next((alternative for alternative in alternatives if alternative.key == known), None)
+
+    def remember_variant(self, locator: Locator, alternative: Locator) -> None:
+        """ Remember which alternative of a composite locator matched on this device """
+        self.variants[locator.key] = alternative.key
+
+    def forget_variant(self, locator: Locator) -> None:
+        """ Forget the alternative of a composite locator, e.g. because it didn't match anymore """
+        self.variants.pop(locator.key, None)
+
+    def save(self) -> None:
+        """ Store the profile in its file """
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as file:
+            json.dump(dict(serial=self.serial, fingerprint=self.fingerprint, android_version=self.android_version,
+                           gms_version=self.gms_version, chrome_version=self.chrome_version,
+                           screen_size=self.screen_size, initial_contexts=self.initial_contexts,
+                           variants=self.variants), file, indent=2)
@@ -0,0 +1,138 @@
+import json
+import os
+
+
+# Used when no registry file is given, this is the single device setup the tests were written for
+DEFAULT_APPIUM_SERVER_URL = 'http://localhost:4723'
+DEFAULT_RELAY_CHANNEL = 1
+DEFAULT_RELAY_BACKEND = 'relayboard'
+
+
+class DeviceConfig:
+    """ Everything needed to run tests on one device: its Appium server, ports and the relay pressing its security key """
+
+    def __init__(self, name: str, appium_server_url: str = DEFAULT_APPIUM_SERVER_URL, udid: str | None = None,
+                 system_port: int | None = None, chromedriver_port: int | None = None,
+                 relay_serial: str | None = None, relay_channel: int = DEFAULT_RELAY_CHANNEL,
+                 relay_backend: str = DEFAULT_RELAY_BACKEND):
+        """
+        :param name: A name for the device, used in logging and in the names of its calibration files, so it must be
+                     unique and stay the same between runs.
+        :param appium_server_url: The url of the Appium server that controls this device.
+        :param udid: The udid (adb serial) of the device, can be omitted if only one device is connected.
+        :param system_port: The port UiAutomator2 uses on the host, must be unique per device on the same host.
+        :param chromedriver_port: The port chromedriver uses, must be unique per device on the same host.
+        :param relay_serial: The serial of the relay board for this device's security key, None to use the first one.
+        :param relay_channel: The relay on the board that presses the button of this device's security key.
+        :param relay_backend: How to talk to the relay board, see shared.relay.create_backend.
+        """
+        self.name = name
+        self.appium_server_url = appium_server_url
+        self.udid = udid
+        self.system_port = system_port
+        self.chromedriver_port = chromedriver_port
+        self.relay_serial = relay_serial
+        self.relay_channel = relay_channel
+        self.relay_backend = relay_backend
+
+    @property
+    def capabilities(self) -> dict:
+        """ Get the capabilities that make Appium use this device """
+        capabilities = {}
+        if self.udid is not None:
+            capabilities['udid'] = self.udid
+        if self.system_port is not None:
+            capabilities['systemPort'] = self.system_port
+        if self.chromedriver_port is not None:
+            capabilities['chromedriverPort'] = self.chromedriver_port
+        return capabilities
+
+    @staticmethod
+    def from_dict(data: dict) -> 'DeviceConfig':
+        """ Create a device config from an entry of the registry file """
+        relay = data.get('relay', {})
+        return DeviceConfig(
+            name=data['name'],
+            appium_server_url=data.get('appium_server_url', DEFAULT_APPIUM_SERVER_URL),
+            udid=data.get('udid'),
+            system_port=data.get('system_port'),
+            chromedriver_port=data.get('chromedriver_port'),
+            relay_serial=relay.get('serial'),
+            relay_channel=relay.get('channel', DEFAULT_RELAY_CHANNEL),
+            relay_backend=relay.get('backend', DEFAULT_RELAY_BACKEND),
+        )
+
+
+class DeviceRegistry:
+    """
+    All devices tests can run on.
+    When running with pytest-xdist, every worker gets its own device, so tests are spread over all devices.
+    """
+
+    def __init__(self, devices: list[DeviceConfig]):
+        if not devices:
+            raise ValueError("A device registry needs at least one device")
+        # Devices can share a relay board, but a relay presses the security key of only one of them
+        channels: dict[tuple[str | None, int], str] = {}
+        for device in devices:
+            if device.relay_backend == 'simulated':
+                continue
+            if (device.relay_serial, device.relay_channel) in channels:
+                raise ValueError(f"The devices '{channels[device.relay_serial, device.relay_channel]}' and "
+                                 f"'{device.name}' share channel {device.relay_channel} of {_board_name(device)}")
+            channels[device.relay_serial, device.relay_channel] = device.name
+        self.devices = devices
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    @staticmethod
+    def load(path: str | None) -> 'DeviceRegistry':
+        """ Load the registry from a JSON file, if no path is given the default single device setup is used """
+        if path is None:
+            return DeviceRegistry([DeviceConfig('default')])
+        with open(path) as file:
+            data = json.load(file)
+        return DeviceRegistry([DeviceConfig.from_dict(device) for device in data['devices']])
+
+    def for_worker(self, worker_id: str, worker_count: int = 1) -> DeviceConfig:
+        """
+        Get the device for a pytest-xdist worker.
+
+        :param worker_id: The id of the worker, like 'gw0', or 'master' when not running in parallel.
+        :param worker_count: The number of workers, the first devices are used by them at the same time.
+        :raises ValueError: If the worker has no device, or its relay board is used by the device of another worker.
+        """
+        if worker_id == 'master':
+            return self.devices[0]
+        index = int(worker_id.removeprefix('gw'))
+        if index >= len(self.devices):
+            raise ValueError(f"Worker '{worker_id}' has no device, only {len(self.devices)} devices are registered")
+        device = self.devices[index]
+        # Every worker is a process of its own, and an FTDI chip can only be opened by one process. Even if it could,
+        # every process would write the state of all channels of the board, undoing the presses of the others.
+        for other in self.devices[:worker_count]:
+            if other is not device and _shares_board(device, other):
+                raise ValueError(f"The devices '{other.name}' and '{device.name}' share {_board_name(device)}, "
+                                 f"they can't be used by different workers at the same time")
+        return device
+
+
+def _shares_board(device: DeviceConfig, other: DeviceConfig) -> bool:
+    """ Check if two devices use the same relay board, simulated boards are never shared """
+    return 'simulated' not in (device.relay_backend, other.relay_backend) and device.relay_serial == other.relay_serial
+
+
+def _board_name(device: DeviceConfig) -> str:
+    """ Describe the relay board of a device, for error messages """
+    return f"the relay board '{device.relay_serial}'" if device.relay_serial else 'the first relay board'
+
+
+def current_worker_id() -> str:
+    """ Get the id of the pytest-xdist worker this process is, or 'master' when not running in parallel """
+    return os.environ.get('PYTEST_XDIST_WORKER', 'master')
+
+
+def current_worker_count() -> int:
+    """ Get the number of pytest-xdist workers, 1 when not running in parallel """
+    return int(os.environ.get('PYTEST_XDIST_WORKER_COUNT', '1'))
@@ -0,0 +1,97 @@
+from typing import Callable
+
+from selenium.common import WebDriverException
+
+from shared import tracing
+from shared.appium_util import DriverController
+from shared.locator import Locator
+
+# How many times a flow may resume after a step failed, before the failure is raised
+MAX_RESUMES = 2
+
+
+class Step:
+    """ One named step of a flow, with the screen it starts on so a flow can find out where to resume """
+
+    def __init__(self, name: str, action: Callable[[], object], screen: Locator | None = None,
+                 failure: Locator | None = None):
+        """
+        :param name: The name of the step, it is also the name of its span in the trace.
+        :param action: What the step does.
+        :param screen: What is on screen when the step can start, None if the step can't be recognised by its screen,
+                       e.g. because it waits for something that is still loading.
+        :param failure: What is on screen when the step really failed and retrying won't help, like a wrong PIN error.
+        """
+        self.name = name
+        self.action = action
+        self.screen = screen
+        self.failure = failure
+
+    def __repr__(self) -> str:
+        return f'Step({self.name!r})'
+
+
+class Flow:
+    """
+    A flow, like registering a passkey, as a list of named steps.
+
+    When a step fails, e.g. because a prompt appeared later than its wait allowed, the flow looks at what is on screen
+    and resumes from the step that starts there, instead of failing the whole test. Only the failed step and the steps
+    after it are candidates, a completed step is never done again, so a retry only costs the step that failed and
+    never opens the page or registers a second time. The screen is recognised with one snapshot per context.
+    """
+
+    def __init__(self, controller: DriverController, steps: list[Step], max_resumes: int = MAX_RESUMES):
+        """
+        :param controller: The controller of the device, to recognise the screen with.
+        :param steps: The steps of the flow, in order.
+        :param max_resumes: How many times the flow may resume, 0 to fail on the first failing step.
+        """
+        self.controller = controller
+        self.steps = steps
+        self.max_resumes = max_resumes
+        # The steps the flow resumed at, in order
+        self.resumed_at: list[str] = []
+
+    def run(self, start: int = 0) -> None:
+        """ Run the steps, from the given index on """
+        index = start
+        while index < len(self.steps):
+            step = self.steps[index]
+            try:
+                with tracing.step(step.name):
+                    step.action()
+            except (WebDriverException, TimeoutError) as e:
+                resume_at = self._resume_index(index) if len(self.resumed_at) < self.max_resumes else None
+                if resume_at is None:
+                    raise
+                print(f"Flow: step '{step.name}' failed with {type(e).__name__}, "
+                      f"resuming at '{self.steps[resume_at].name}'.")
+                self.resumed_at.append(self.steps[resume_at].name)
+                index = resume_at
+                continue
+            index += 1
+
+    def _resume_index(self, failed: int) -> int | None:
+        """
+        Find out which step the screen is at: the last step whose screen is shown, from the failed step on.
+        Later steps are checked first, as a native sheet is shown on top of the web page of an earlier step.
+
+        :param failed: The index of the step that failed.
+        :return: The index of the step, or None if the screen isn't recognised or shows a real failure.
+        """
+        screens = [(index, step.screen) for index, step in enumerate(self.steps)
+                   if index >= failed and step.screen is not None]
+        failures = [step.failure for step in self.steps if step.failure is not None]
+        locators = [locator for _, locator in screens] + failures
+        try:
+            present = self.controller.are_present(locators)
+        except WebDriverException:
+            return None
+
+        if any(present[len(screens):]):
+            return None
+        for (index, _), shown in reversed(list(zip(screens, present))):
+            if shown:
+                return index
+        return None
@@ -1,8 +1,12 @@
 import enum
+import functools
+import sys
 
 from appium import webdriver
 from appium.webdriver.common.appiumby import AppiumBy
 
+from shared import ui_selector
+
 
 class Context(enum.Enum):
     NATIVE = "NATIVE_APP"
@@ -14,41 +18,147 @@ class Context(enum.Enum):
         return Context(driver_context)
 
 
+# How many locators the parametrized factories, like by_text, remember, so the same locator isn't built again
+FACTORY_CACHE_SIZE = 1024
+# Marks a derived query that wasn't computed yet, None means the locator can't be expressed in that form
+_NOT_COMPILED = object()
+
+
 class Locator:
-    """ Data class representing an element on a webpage or a native element """
+    """
+    Value type representing an element on a webpage or a native element.
+
+    Locators are immutable and compare and hash by their type, context and query, so they can be used as keys of
+    caches and statistics. The query strings are interned and the XPath and UiSelector forms are compiled once per
+    locator, and the factories return the same locator for the same arguments.
+    """
+
+    __slots__ = ('_context', '_by', '_value', '_hash', '_key', '_description', '_xpath', '_ui_automator')
 
     def __init__(self, context: Context, by: str, value: str):
-        self.__context = context
-        self.__by: str = by
-        self.__value: str = value
+        set_attribute = super().__setattr__
+        set_attribute('_context', context)
+        set_attribute('_by', sys.intern(by))
+        set_attribute('_value', sys.intern(value))
+        set_attribute('_hash', hash((type(self), context, by, value)))
+        set_attribute('_key', f'{context.value}:{by}={value}')
+        set_attribute('_description', f'{by}={value}')
+        set_attribute('_xpath', _NOT_COMPILED)
+        set_attribute('_ui_automator', _NOT_COMPILED)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"'{type(self).__name__}' is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"'{type(self).__name__}' is immutable")
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, Locator):
+            return NotImplemented
+        # A composite locator isn't a plain locator with the same query, it has alternatives and is cached apart
+        return self._hash == other._hash and type(self) is type(other) and self._context == other._context \
+            and self._by == other._by and self._value == other._value
+
+    def __hash__(self) -> int:
+        return self._hash
 
-    def __or__(self, other) -> 'Locator':
-        """ Create a new locator that matches this locator, or the other locator, only implemented for XPath locators """
+    def __copy__(self) -> 'Locator':
+        # Immutable, so a copy can be the locator itself
+        return self
 
-        if self.__by != AppiumBy.XPATH or other.__by != AppiumBy.XPATH:
-            raise NotImplementedError("Or is only implemented for XPATH locators")
-        if self.__context != other.__context:
-            raise NotImplementedError("Or is only implemented when both locators have the same context")
+    def __deepcopy__(self, memo: dict) -> 'Locator':
+        return self
 
-        xpath = f'{self.__value} or {other.__value}'
-        return Locator.by_xpath(self.__context, xpath)
+    def __reduce__(self):
+        # Pickle the arguments instead of the slots, the derived slots are rebuilt by __init__
+        return Locator, (self._context, self._by, self._value)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self._context}, {self._by!r}, {self._value!r})'
+
+    def __str__(self) -> str:
+        return self._description
+
+    def __or__(self, other) -> 'CompositeLocator':
+        """ Create a new locator that matches this locator, or the other locator """
+        return Locator.any_of(self, other)
 
     @property
     def context(self) -> Context:
         """ Get the context this locator will work in. """
-        return self.__context
+        return self._context
 
     @property
     def by(self) -> str:
         """ Get what this locator searches by. """
-        return self.__by
+        return self._by
 
     @property
     def value(self) -> str:
         """ Get the value of what this locator searches for. """
-        return self.__value
+        return self._value
+
+    @property
+    def key(self) -> str:
+        """ Get the locator as a string with its context, to store it in a file, like 'NATIVE_APP:id=...'. """
+        return self._key
+
+    @property
+    def alternatives(self) -> tuple['Locator', ...]:
+        """ Get the locators this locator consists of, for a plain locator this is only the locator itself. """
+        return self,
+
+    def to_xpath(self) -> str | None:
+        """ Get an XPath that finds the same elements as this locator, or None if it can't be expressed as XPath. """
+        if self._xpath is _NOT_COMPILED:
+            super().__setattr__('_xpath', self._compile_xpath())
+        return self._xpath
+
+    def _compile_xpath(self) -> str | None:
+        if self._by == AppiumBy.XPATH:
+            return self._value
+        literal = ui_selector.xpath_literal(self._value)
+        if self._context == Context.NATIVE:
+            if self._by == AppiumBy.ANDROID_UIAUTOMATOR:
+                return ui_selector.to_xpath(self._value)
+            if self._by == AppiumBy.ID:
+                return f'//*[@resource-id={literal}]'
+            if self._by == AppiumBy.ACCESSIBILITY_ID:
+                return f'//*[@content-desc={literal}]'
+        elif self._context == Context.WEB:
+            if self._by == AppiumBy.ID:
+                return f'//*[@id={literal}]'
+            if self._by == AppiumBy.LINK_TEXT:
+                return f'//a[normalize-space(.)={literal}]'
+        return None
+
+    def to_ui_automator(self) -> str | None:
+        """ Get a UiSelector that finds the same elements as this locator, or None if it can't be expressed as one. """
+        if self._ui_automator is _NOT_COMPILED:
+            super().__setattr__('_ui_automator', self._compile_ui_automator())
+        return self._ui_automator
+
+    def _compile_ui_automator(self) -> str | None:
+        if self._context != Context.NATIVE:
+            return None
+        if self._by == AppiumBy.ANDROID_UIAUTOMATOR:
+            return self._value
+        if self._by == AppiumBy.ID:
+            return f'new UiSelector().resourceId("{Locator._escape_string(self._value)}")'
+        if self._by == AppiumBy.ACCESSIBILITY_ID:
+            return f'new UiSelector().description("{Locator._escape_string(self._value)}")'
+        return None
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
+    def any_of(*locators: 'Locator') -> 'CompositeLocator':
+        """ Create a locator that matches any of the given locators, which is searched for in a single query. """
+        return CompositeLocator([alternative for locator in locators for alternative in locator.alternatives])
+
+    @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_xpath(context: Context, xpath: str) -> 'Locator':
         """ Create a locator from a xpath. """
         return Locator(context, AppiumBy.XPATH, xpath)
@@ -61,11 +171,18 @@ class Locator:
     @staticmethod
     def by_attributes(context: Context, attributes: dict[str, str]) -> 'Locator':
         """ Create a locator from a dictionary of attributes. """
+        # A dict can't be a key of the factory cache, its items can
+        return Locator._by_attributes(context, tuple(attributes.items()))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
+    def _by_attributes(context: Context, attributes: tuple[tuple[str, str], ...]) -> 'Locator':
         # Create a xpath locator to find the attributes
-        xpath = f"//*[{" and ".join([f'@{key}="{Locator._escape_string(value)}"' for key, value in attributes.items()])}]"
+        xpath = f"//*[{" and ".join([f'@{key}="{Locator._escape_string(value)}"' for key, value in attributes])}]"
         return Locator.by_xpath(context, xpath)
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_text(context: Context, text: str) -> 'Locator':
         """ Create a locator that looks for an element by the text it has. """
         if context == Context.WEB:
@@ -78,6 +195,7 @@ class Locator:
             raise NotImplementedError(f"'Locator.by_text' is not yet implemented for the context '{context}'.")
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_contains_text(context: Context, text: str) -> 'Locator':
         """ Create a locator to see find an element containing a certain text. """
         if context == Context.WEB:
@@ -90,6 +208,7 @@ class Locator:
             raise NotImplementedError(f"'Locator.by_text' is not yet implemented for the context '{context}'.")
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_id(context: Context, id_value: str) -> 'Locator':
         """
         Create a locator by an id.
@@ -100,16 +219,19 @@ class Locator:
         return Locator(context, AppiumBy.ID, id_value)
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_ui_automator(context: Context, value: str) -> 'Locator':
         """ Create a locator by an Android UiAutomator instruction. """
         return Locator(context, AppiumBy.ANDROID_UIAUTOMATOR, value)
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_link_text(context: Context, link_text: str):
         """ Search for an element containing a link by the text the link has. """
         return Locator(context, AppiumBy.LINK_TEXT, link_text)
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_button_text(context: Context, button_text: str) -> 'Locator':
         """ Search for a button with a specific text """
         # Remove leading and trailing whitespaces from both sides
@@ -117,9 +239,54 @@ class Locator:
         return Locator.by_xpath(context, xpath)
 
     @staticmethod
+    @functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
     def by_button_index(context: Context, button_index: int) -> 'Locator':
         """
         Search for a button by the index it is on screen with, should only be used if a button doesn't have an id.
         """
         automator_str = f'new UiSelector().className("android.widget.Button").instance({button_index})'
         return Locator.by_ui_automator(context, automator_str)
+
+
+class CompositeLocator(Locator):
+    """
+    Locator that matches any of a number of locators, by merging them into one query for the Appium server.
+
+    In a native context, UiAutomator and id locators are merged into multiple UiSelector statements,
+    which is faster than XPath on UiAutomator2. As soon as one of the locators is XPath, all of them are merged
+    into an XPath union instead. In a web context, the locators are always merged into an XPath union.
+    """
+
+    __slots__ = ('_alternatives',)
+
+    def __init__(self, alternatives: list[Locator]):
+        if not alternatives:
+            raise ValueError("A composite locator needs at least one locator")
+        context = alternatives[0].context
+        if any(alternative.context != context for alternative in alternatives):
+            raise NotImplementedError("Composite locators are only implemented when all locators have the same context")
+
+        object.__setattr__(self, '_alternatives', tuple(alternatives))
+        if len(alternatives) == 1:
+            super().__init__(context, alternatives[0].by, alternatives[0].value)
+            return
+
+        selectors = [alternative.to_ui_automator() for alternative in alternatives]
+        if None not in selectors:
+            super().__init__(context, AppiumBy.ANDROID_UIAUTOMATOR, '; '.join(selectors))
+            return
+
+        xpaths = [alternative.to_xpath() for alternative in alternatives]
+        if None in xpaths:
+            unsupported = alternatives[xpaths.index(None)]
+            raise NotImplementedError(f"Can't combine a locator by '{unsupported.by}' with other locators "
+                                      f"in the context '{context}'")
+        super().__init__(context, AppiumBy.XPATH, ' | '.join(xpaths))
+
+    def __reduce__(self):
+        return CompositeLocator, (list(self._alternatives),)
+
+    @property
+    def alternatives(self) -> tuple[Locator, ...]:
+        """ Get the locators this locator consists of. """
+        return self._alternatives
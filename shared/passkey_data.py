@@ -7,6 +7,7 @@ class PasskeyText:
     WRONG_PIN                       = "Wrong PIN"
     ENTER_PIN_SECURITY_KEY          = "Enter the PIN for your security key"
     SEVEN_ATTEMPTS_REMAINING        = "7 attempts remaining for confirming PIN"
+    CHOOSE_PASSKEY                  = "Choose a passkey for "
 
 # Locators
 class PasskeyLocators:
@@ -14,6 +15,7 @@ class PasskeyLocators:
     CANCEL_BUTTON                   = Locator.by_id(Context.NATIVE, "com.google.android.gms:id/cancelButton")
     CREATE_PASSKEY_TEXT_1           = Locator.by_contains_text(Context.NATIVE, PasskeyText.CREATE_PASSKEY_1)
     CREATE_PASSKEY_TEXT_2           = Locator.by_text(Context.NATIVE, PasskeyText.CREATE_PASSKEY_2)
+    CREATE_PASSKEY_TEXT             = CREATE_PASSKEY_TEXT_1 | CREATE_PASSKEY_TEXT_2
     PIN_INPUT_FIELD_DEVICE          = Locator.by_id(Context.NATIVE, "com.android.systemui:id/lockPassword")
     PIN_ERROR_TEXT_DEVICE           = Locator.by_id(Context.NATIVE, "com.android.systemui:id/error")
     PIN_INPUT_FIELD_KEY             = Locator.by_text(Context.NATIVE, PasskeyText.ENTER_PIN_SECURITY_KEY)
@@ -22,3 +24,4 @@ class PasskeyLocators:
     PIN_ERROR_TEXT_KEY              = Locator.by_id(Context.NATIVE, "com.google.android.gms:id/textinput_error")
     DISCOVERABLE_TITLE = Locator.by_id(Context.NATIVE, "com.android.chrome:id/touch_to_fill_sheet_title")
     DISCOVERABLE_DIFFERENT_DEVICE   = Locator.by_id(Context.NATIVE, "com.android.chrome:id/touch_to_fill_sheet_use_passkeys_other_device")
+    CHOOSE_PASSKEY_TEXT             = Locator.by_contains_text(Context.NATIVE, PasskeyText.CHOOSE_PASSKEY)
@@ -1,12 +1,13 @@
-import time
-
 from appium.webdriver import WebElement
 from appium.webdriver.extensions.android.nativekey import AndroidKey
 
-from RelayBoard import RelayBoard
+from shared import tracing
 from shared.appium_util import DriverController
+from shared.flow import Flow, Step
 from shared.locator import Locator, Context
 from shared.passkey_data import PasskeyLocators
+from shared.presence import PresenceController
+from shared.relay import AsyncRelayBoard
 
 DEFAULT_USERNAME = "fx7mobile"
 DEFAULT_KEY_PIN = "1234" # Pin for the hardware security key
@@ -21,96 +22,125 @@ class LocalPasskeyUtil:
 
     def enter_pin(self, pin: str = DEFAULT_DEVICE_PIN):
         """ Enter the pin in the pin input field """
-        pin_field = self.controller.wait_for_element(PasskeyLocators.PIN_INPUT_FIELD_DEVICE)
-        pin_field.click()
-        pin_field.send_keys(pin)
+        self.controller.wait_for_element(PasskeyLocators.PIN_INPUT_FIELD_DEVICE)
+        self.controller.click(PasskeyLocators.PIN_INPUT_FIELD_DEVICE)
+        self.controller.send_keys(PasskeyLocators.PIN_INPUT_FIELD_DEVICE, pin)
         self.controller.press_key(AndroidKey.ENTER)
 
+    def pin_steps(self, pin: str = DEFAULT_DEVICE_PIN) -> list[Step]:
+        """ Get the steps to enter the pin of the device """
+        return [Step('pin_entry', lambda: self.enter_pin(pin), screen=PasskeyLocators.PIN_INPUT_FIELD_DEVICE,
+                     failure=PasskeyLocators.PIN_ERROR_TEXT_DEVICE)]
+
+    def registration_steps(self, pin: str = DEFAULT_DEVICE_PIN) -> list[Step]:
+        """ Get the steps to register a passkey on the mobile device, from the moment the relying party asked for it """
+        return [
+            # Wait for the pop-up to open, use text to check
+            Step('sheet_shown', lambda: self.controller.wait_for_element(PasskeyLocators.CREATE_PASSKEY_TEXT)),
+            # Button doesn't have an id, so search for it with the index
+            Step('choose_authenticator', lambda: self.controller.click(Locator.by_button_index(Context.NATIVE, 2)),
+                 screen=PasskeyLocators.CREATE_PASSKEY_TEXT),
+            *self.pin_steps(pin),
+        ]
+
     def do_local_passkey_registration_flow(self, pin: str = DEFAULT_DEVICE_PIN):
         """ Do the passkey registration flow and register the passkey on the mobile device."""
-        # Wait for the pop-up to open, use text to check
-        self.controller.wait_for_first_element(
-            [PasskeyLocators.CREATE_PASSKEY_TEXT_1, PasskeyLocators.CREATE_PASSKEY_TEXT_2])
-        # Button doesn't have an id, so search for it with the index
-        self.controller.find_element(Locator.by_button_index(Context.NATIVE, 2)).click()
-
-        self.enter_pin(pin)
+        Flow(self.controller, self.registration_steps(pin)).run()
 
     def do_local_passkey_authentication_flow(self, pin: str = DEFAULT_DEVICE_PIN):
         """ Do the passkey authentication flow for a passkey stored on the mobile device."""
         # Wait for the pin field and enter the pin
-        self.enter_pin(pin)
+        Flow(self.controller, self.pin_steps(pin)).run()
 
     def wait_for_pin_error_text(self):
         """ Wait for the error text to appear for a device/lock screen prompt and return it. """
-        element = self.controller.wait_for_element(PasskeyLocators.PIN_ERROR_TEXT_DEVICE)
-        return element.text
+        self.controller.wait_for_element(PasskeyLocators.PIN_ERROR_TEXT_DEVICE)
+        return self.controller.get_text(PasskeyLocators.PIN_ERROR_TEXT_DEVICE)
 
     def click_discoverable(self, user: str = DEFAULT_USERNAME):
         """ Click a discoverable credential, by username. """
         locator = Locator.by_text(Context.NATIVE, user)
-        element = self.controller.wait_for_element(locator)
-        element.click()
+        self.controller.wait_for_element(locator)
+        self.controller.click(locator)
 
 
 class HardwarePasskeyUtil:
     """ Utility class to interact with a hardware passkey """
 
-    def __init__(self, controller: DriverController, relay_board: RelayBoard):
+    def __init__(self, controller: DriverController, relay_board: AsyncRelayBoard, relay_channel: int = 1,
+                 presence: PresenceController | None = None):
+        """
+        :param controller: The controller of the device.
+        :param relay_board: The relay board that presses the button of the security key.
+        :param relay_channel: The relay on the board that is connected to the security key.
+        :param presence: Controls when user presence is provided, by default an uncalibrated one is used.
+        """
         self.controller: DriverController = controller
-        self.relay_board: RelayBoard = relay_board
+        self.relay_board: AsyncRelayBoard = AsyncRelayBoard.wrap(relay_board)
+        self.relay_channel: int = relay_channel
+        self.presence: PresenceController = presence or PresenceController(controller, self.relay_board, relay_channel)
+
+    def until_pin_input_steps(self) -> list[Step]:
+        """ Get the steps of the registration up until you have to enter the pin """
+        return [
+            # Wait for the pop-up to open, use text to check
+            Step('sheet_shown', lambda: self.controller.wait_for_element(PasskeyLocators.CREATE_PASSKEY_TEXT)),
+            # Click different device
+            Step('choose_authenticator', lambda: self.controller.click(PasskeyLocators.DIFFERENT_DEVICE),
+                 screen=PasskeyLocators.CREATE_PASSKEY_TEXT),
+        ]
+
+    def pin_and_presence_steps(self, pin: str = DEFAULT_KEY_PIN) -> list[Step]:
+        """ Get the steps to enter the pin, wait for user presence to be requested and provide it """
+        return [
+            Step('pin_entry', lambda: self.enter_pin(pin), screen=PasskeyLocators.PIN_INPUT_FIELD_KEY,
+                 failure=PasskeyLocators.PIN_ERROR_TEXT_KEY),
+            # The key asks for user presence once it accepted the PIN
+            Step('pin_accepted', self.wait_for_user_presence_request),
+            Step('user_presence', self.provide_user_presence, screen=PasskeyLocators.CONNECT_KEY),
+        ]
+
+    def registration_steps(self, pin: str = DEFAULT_KEY_PIN) -> list[Step]:
+        """ Get the steps to register a passkey on the security key, from the moment the relying party asked for it """
+        return self.until_pin_input_steps() + self.pin_and_presence_steps(pin)
+
+    def authentication_steps(self, pin: str = DEFAULT_KEY_PIN) -> list[Step]:
+        """ Get the steps to authenticate with the security key, from the moment the relying party asked for it """
+        return self.pin_and_presence_steps(pin)
+
+    def discoverable_steps(self, username: str = DEFAULT_USERNAME, pin: str = DEFAULT_KEY_PIN) -> list[Step]:
+        """ Get the steps to authenticate with a discoverable credential on the security key """
+        def choose_authenticator():
+            # Scroll to the "Use passkey on another device" button at the bottom, and click it
+            self.controller.scroll_to(PasskeyLocators.DISCOVERABLE_DIFFERENT_DEVICE)
+            self.controller.click(PasskeyLocators.DISCOVERABLE_DIFFERENT_DEVICE)
+
+        return [
+            # Wait for the window
+            Step('sheet_shown', lambda: self.controller.wait_for_element(PasskeyLocators.DISCOVERABLE_TITLE)),
+            Step('choose_authenticator', choose_authenticator, screen=PasskeyLocators.DISCOVERABLE_TITLE),
+            *self.pin_and_presence_steps(pin),
+            # Click the field for the discoverable credential. The list is recognised by its title, the username is
+            # also shown on the sheet of Chrome.
+            Step('choose_credential', lambda: self.click_discoverable(username),
+                 screen=PasskeyLocators.CHOOSE_PASSKEY_TEXT),
+        ]
 
     def do_registration_flow(self, pin: str = DEFAULT_KEY_PIN):
         """ Do the passkey registration flow with the given pin. """
-        self.do_registration_flow_until_pin_input()
-
-        # Wait for pin field and enter pin
-        self.enter_pin(pin)
-
-        # Wait for user presence to be requested and provide it
-        self.wait_for_user_presence_request()
-        self.provide_user_presence()
+        Flow(self.controller, self.registration_steps(pin)).run()
 
     def do_registration_flow_until_pin_input(self):
         """ Do the passkey registration flow up until you have to enter the pin. """
-        # Wait for the pop-up to open, use text to check
-        self.controller.wait_for_first_element(
-            [PasskeyLocators.CREATE_PASSKEY_TEXT_1, PasskeyLocators.CREATE_PASSKEY_TEXT_2])
-        # Click different device
-        self.controller.find_element(PasskeyLocators.DIFFERENT_DEVICE).click()
+        Flow(self.controller, self.until_pin_input_steps()).run()
 
     def do_authentication_flow(self, pin: str = DEFAULT_KEY_PIN):
         """ Do the passkey authentication flow with the given pin. """
-        # Wait for pin field and enter pin
-        self.enter_pin(pin)
-
-        # Wait for user presence to be requested and provide it
-        self.controller.wait_for_element(PasskeyLocators.CONNECT_KEY)
-        self.provide_user_presence()
+        Flow(self.controller, self.authentication_steps(pin)).run()
 
     def do_discoverable_flow(self, username: str = DEFAULT_USERNAME, pin: str = DEFAULT_KEY_PIN):
         """ Do the flow for a discoverable credential on a security key """
-        # Wait for the window
-        self.controller.wait_for_element(PasskeyLocators.DISCOVERABLE_TITLE)
-
-        # Scroll to the bottom, wait a bit between scrolls
-        time.sleep(0.1)
-        self.controller.swipe_percent(0.5, 0.8, 0.5, 0.2)
-        time.sleep(0.1)
-        self.controller.swipe_percent(0.5, 0.8, 0.5, 0.2)
-
-        # Click the "Use passkey on another device" button
-        self.controller.wait_for_element(PasskeyLocators.DISCOVERABLE_DIFFERENT_DEVICE).click()
-
-        # Enter the pin of the passkey
-        self.enter_pin(pin)
-
-        # Wait for user presence request and provide user presence
-        self.wait_for_user_presence_request()
-        self.provide_user_presence()
-
-        # Click the field for the discoverable credential
-        self.click_discoverable(username)
+        Flow(self.controller, self.discoverable_steps(username, pin)).run()
 
     def wait_for_pin_field(self) -> WebElement:
         """ Wait for the pin input field for a hardware security key to appear, and return it """
@@ -118,39 +148,47 @@ class HardwarePasskeyUtil:
 
     def enter_pin(self, pin: str = DEFAULT_KEY_PIN):
         """ Enter the pin in the pin input field for a security key """
-        pin_field = self.wait_for_pin_field()
-        pin_field.send_keys(pin)
-        self.controller.find_element(PasskeyLocators.CONFIRM_BUTTON).click()
+        self.wait_for_pin_field()
+        self.controller.send_keys(PasskeyLocators.PIN_INPUT_FIELD_KEY, pin)
+        self.controller.click(PasskeyLocators.CONFIRM_BUTTON)
 
     def wait_for_user_presence_request(self):
-        """ Wait for the user presence to be requested """
-        self.controller.wait_for_element(PasskeyLocators.CONNECT_KEY)
+        """ Wait for the user presence to be requested, and remember when it was requested """
+        self.presence.wait_for_prompt()
 
     def wait_for_pin_error_text(self):
         """ Wait for the error text to appear for a security key prompt and return it. """
-        element = self.controller.wait_for_element(PasskeyLocators.PIN_ERROR_TEXT_KEY)
-        return element.text
+        self.controller.wait_for_element(PasskeyLocators.PIN_ERROR_TEXT_KEY)
+        return self.controller.get_text(PasskeyLocators.PIN_ERROR_TEXT_KEY)
 
     def click_discoverable(self, user: str = DEFAULT_USERNAME):
         """ Click a discoverable credential, by username. """
         locator = Locator.by_text(Context.NATIVE, user)
-        element = self.controller.wait_for_element(locator)
-        element.click()
+        self.controller.wait_for_element(locator)
+        self.controller.click(locator)
 
     def cancel_pin_input(self):
         """ Cancel the pin input prompt. """
-        self.controller.find_element(PasskeyLocators.CANCEL_BUTTON).click()
+        self.controller.click(PasskeyLocators.CANCEL_BUTTON)
+
+    def provide_user_presence(self, wait_before: float | None = None):
+        """
+        Provide user presence to the device, as soon as the security key is ready for it.
+
+        :param wait_before: Wait this long before pressing the button instead, for tests that need a fixed delay.
+        """
+        if wait_before is None:
+            self.presence.press()
+            return
 
-    def provide_user_presence(self, wait_before=1):
-        """ Provide user presence to the device, wait a bit before pressing the button. """
         # Wait a bit to make sure the device is ready to receive user presence
-        time.sleep(wait_before)
+        tracing.sleep(wait_before)
 
         # Now use the relay (press the button on FX7).
         print("Relay: user presence button.")
-        self.relay_board.switch_relay(1, 200)
+        self.relay_board.switch_relay(self.relay_channel, 200)
 
     def wait_for_user_presence_timeout(self, wait_time=24):
-        """ Wait for user presence to be requested and the required amount of time to trigger a timeout """
+        """ Wait for user presence to be requested and until the required amount of time has passed to trigger a timeout """
         self.wait_for_user_presence_request()
-        time.sleep(wait_time)
+        self.presence.wait_until(wait_time)
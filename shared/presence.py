@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future
+
+from shared import tracing
+from shared.appium_util import DriverController, WAIT_TIMEOUT
+from shared.passkey_data import PasskeyLocators
+from shared.relay import AsyncRelayBoard, RelayBackend
+
+# Used until a device has been calibrated, this is the delay the tests always used
+DEFAULT_READINESS_DELAY = 1.0
+# How long the relay keeps the button of the security key pressed, in milliseconds
+PRESS_DURATION_MS = 200
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceCalibration:
+    """
+    The calibrated readiness delay of a device: how long its security key needs after the 'connect your key' prompt
+    appeared before it accepts user presence. It is stored in a JSON file, so it is remembered between runs.
+    """
+
+    # How much the delay is lowered after a press that was accepted right away, in seconds
+    STEP_DOWN = 0.05
+    # How much the delay is raised at most after a press that was ignored, in seconds
+    STEP_UP = 0.25
+
+    def __init__(self, path: str | None = None, readiness_delay: float = DEFAULT_READINESS_DELAY):
+        """
+        :param path: The JSON file to store the calibration in, None to not store it.
+        :param readiness_delay: The delay to use if the file doesn't exist yet.
+        """
+        self.path = path
+        self.readiness_delay = readiness_delay
+        # The delay isn't lowered below this anymore, a press before it was ignored
+        self.min_delay = 0.0
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                stored = json.load(file)
+            self.readiness_delay = stored['readiness_delay']
+            self.min_delay = stored.get('min_delay', 0.0)
+        # The last delay a press was accepted at, at once
+        self.last_accepted = self.readiness_delay
+
+    def accepted(self, delay: float) -> None:
+        """
+        A press this long after the prompt appeared was accepted at once, try a bit earlier next time, but not earlier
+        than a press that was ignored before
+        """
+        self.last_accepted = delay
+        self.readiness_delay = max(self.min_delay, min(self.readiness_delay, delay) - self.STEP_DOWN)
+
+    def rejected(self) -> None:
+        """
+        A press after the readiness delay was ignored, so the key needs more time: go back to the last delay that was
+        accepted, by at least STEP_DOWN and at most STEP_UP, and stay there. The time the retry was accepted at isn't
+        used, it is mostly the time waited before retrying.
+        """
+        self.readiness_delay = max(self.readiness_delay + self.STEP_DOWN,
+                                   min(self.last_accepted, self.readiness_delay + self.STEP_UP))
+        self.min_delay = self.readiness_delay
+
+    def save(self) -> None:
+        """ Store the calibration in its file """
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as file:
+            json.dump(dict(readiness_delay=self.readiness_delay, min_delay=self.min_delay), file)
+
+
+class PresenceController:
+    """
+    Provides user presence to the security key as soon as it is ready, instead of after a fixed sleep.
+
+    It timestamps the moment the 'connect your key' prompt appears, and presses the button of the key once the calibrated
+    readiness delay has passed since then. If the key ignores the press because it wasn't ready yet, the button is
+    pressed again and the calibration is updated. Timeouts are waited for as a deadline from the prompt appearing.
+    """
+
+    def __init__(self, controller: DriverController, relay_board: RelayBackend | AsyncRelayBoard, relay_channel: int = 1,
+                 calibration: PresenceCalibration | None = None, poll_interval: float = 0.1, retry_after: float = 1.5):
+        """
+        :param controller: The controller of the device.
+        :param relay_board: The relay board that presses the button of the security key.
+        :param relay_channel: The relay on the board that is connected to the security key.
+        :param calibration: The readiness delay of the device, the default delay is used if not given.
+        :param poll_interval: Time between checks for the prompt, this is how precise the prompt is timestamped.
+        :param retry_after: Press the button again if the prompt is still there this long after a press.
+        """
+        self.controller = controller
+        self.relay_board = AsyncRelayBoard.wrap(relay_board)
+        self.relay_channel = relay_channel
+        self.calibration = calibration or PresenceCalibration()
+        self.poll_interval = poll_interval
+        self.retry_after = retry_after
+        self.prompt_appeared_at: float | None = None
+
+    def wait_for_prompt(self, timeout: float = WAIT_TIMEOUT) -> float:
+        """
+        Wait for the security key to ask for user presence, and remember when that happened.
+
+        :return: The time the prompt appeared, as time.monotonic().
+        """
+        deadline = time.monotonic() + timeout
+        while not self.controller.find_elements(PasskeyLocators.CONNECT_KEY):
+            if time.monotonic() >= deadline:
+                raise TimeoutError('Timed out waiting for the security key to ask for user presence.')
+            tracing.sleep(self.poll_interval)
+        self.prompt_appeared_at = time.monotonic()
+        return self.prompt_appeared_at
+
+    def wait_until(self, seconds_after_prompt: float) -> None:
+        """ Wait until some time has passed since the prompt appeared """
+        remaining = self.prompt_appeared_at + seconds_after_prompt - time.monotonic()
+        if remaining > 0:
+            tracing.sleep(remaining)
+
+    def _pulse(self, delay: float = 0.0) -> Future:
+        """ Press the button of the security key after a delay in seconds, without waiting for it """
+        logger.info("Relay: user presence button.")
+        return self.relay_board.pulse(self.relay_channel, PRESS_DURATION_MS, delay_ms=max(0.0, delay) * 1000)
+
+    def _prompt_gone(self, timeout: float) -> bool:
+        """ Check if the prompt disappears within some time, meaning the key accepted user presence """
+        deadline = time.monotonic() + timeout
+        while self.controller.find_elements(PasskeyLocators.CONNECT_KEY):
+            if time.monotonic() >= deadline:
+                return False
+            tracing.sleep(self.poll_interval)
+        return True
+
+    def press(self, max_attempts: int = 3) -> None:
+        """
+        Provide user presence as soon as the security key is ready for it.
+        If the prompt wasn't timestamped with wait_for_prompt, it is waited for first.
+        The press is scheduled on the relay board, and the UI is polled while the button is held.
+
+        :raises TimeoutError: If the key didn't accept any of the presses.
+        """
+        if self.prompt_appeared_at is None:
+            self.wait_for_prompt()
+
+        delay = self.prompt_appeared_at + self.calibration.readiness_delay - time.monotonic()
+        for attempt in range(max_attempts):
+            pressed_after = time.monotonic() + max(0.0, delay) - self.prompt_appeared_at
+            pulse = self._pulse(delay)
+            gone = self._prompt_gone(max(0.0, delay) + self.retry_after)
+            # Make sure the button is released before pressing it again or continuing the flow
+            with tracing.tracer.span('wait_for_release', 'relay'):
+                pulse.result()
+            if gone:
+                if attempt == 0:
+                    self.calibration.accepted(pressed_after)
+                else:
+                    self.calibration.rejected()
+                break
+            delay = 0.0
+        else:
+            self.prompt_appeared_at = None
+            raise TimeoutError(f'The security key ignored {max_attempts} presses of its button.')
+
+        self.calibration.save()
+        self.prompt_appeared_at = None
@@ -0,0 +1,199 @@
+import abc
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Protocol
+
+
+class RelayBackend(Protocol):
+    """ Something that can switch the relays of a relay board, like the RelayBoard module """
+
+    def switch_relay(self, channel: int, duration_ms: int) -> None:
+        """ Switch a relay on for some time, blocks until the relay is off again """
+        ...
+
+    def close(self) -> None:
+        """ Release the relay board """
+        ...
+
+
+class BitBangRelayBackend(abc.ABC):
+    """
+    Relay board driven by the bit-bang mode of an FTDI chip, like the FT245R on the common 4 and 8 channel USB relay
+    boards: every output pin of the chip drives one relay, channel 1 being the lowest bit.
+    """
+
+    def __init__(self):
+        self._state = 0
+
+    @abc.abstractmethod
+    def _write(self, state: int) -> None:
+        """ Set all output pins of the chip at once """
+
+    def switch_relay(self, channel: int, duration_ms: int) -> None:
+        """ Switch a relay on for some time, blocks until the relay is off again """
+        bit = 1 << (channel - 1)
+        self._state |= bit
+        self._write(self._state)
+        time.sleep(duration_ms / 1000)
+        self._state &= ~bit
+        self._write(self._state)
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """ Release the relay board """
+
+
+class Ftd2xxRelayBackend(BitBangRelayBackend):
+    """ Relay board using FTDI's own D2XX driver, through ftd2xx """
+
+    def __init__(self, serial: str | None = None):
+        """ :param serial: The serial of the FTDI chip, None to use the first one. """
+        super().__init__()
+        # Imported here, so the D2XX library is only needed when this backend is used
+        import ftd2xx
+        self._device = ftd2xx.openEx(serial.encode()) if serial is not None else ftd2xx.open(0)
+        # Asynchronous bit-bang mode with all pins as output
+        self._device.setBitMode(0xFF, 0x01)
+        self._write(self._state)
+
+    def _write(self, state: int) -> None:
+        self._device.write(bytes([state]))
+
+    def close(self) -> None:
+        self._write(0)
+        self._device.close()
+
+
+class PyFtdiRelayBackend(BitBangRelayBackend):
+    """ Relay board using libusb, through pyftdi """
+
+    def __init__(self, serial: str | None = None):
+        """ :param serial: The serial of the FTDI chip, None to use the first one. """
+        super().__init__()
+        # Imported here, so libusb is only needed when this backend is used
+        from pyftdi.gpio import GpioAsyncController
+        self._gpio = GpioAsyncController()
+        self._gpio.configure(f'ftdi://ftdi:232r:{serial}/1' if serial is not None else 'ftdi:///1', direction=0xFF)
+        self._write(self._state)
+
+    def _write(self, state: int) -> None:
+        self._gpio.write(state)
+
+    def close(self) -> None:
+        self._write(0)
+        self._gpio.close()
+
+
+class SimulatedRelayBackend:
+    """ In-memory relay board for offline runs, it remembers when which relay was switched """
+
+    def __init__(self, on_press: Callable[[int], None] | None = None):
+        """ :param on_press: Called with the channel whenever a relay is switched on, e.g. to press a simulated key. """
+        self.on_press = on_press
+        self.presses: list[tuple[float, int, int]] = []
+
+    def switch_relay(self, channel: int, duration_ms: int) -> None:
+        """ Switch a relay on for some time, blocks until the relay is off again """
+        self.presses.append((time.monotonic(), channel, duration_ms))
+        if self.on_press is not None:
+            self.on_press(channel)
+        time.sleep(duration_ms / 1000)
+
+    def close(self) -> None:
+        """ Nothing to close, there is no hardware """
+        pass
+
+
+def create_backend(kind: str, serial: str | None = None) -> RelayBackend:
+    """
+    Connect to a relay board.
+
+    :param kind: 'relayboard' for the RelayBoard module, 'ftd2xx' or 'pyftdi' to drive the FTDI chip directly,
+                 or 'simulated' for an in-memory board.
+    :param serial: The serial of the board, None to use the first one.
+    """
+    if kind == 'relayboard':
+        # Imported here, so the FTDI libraries are only loaded when a real relay board is used
+        import RelayBoard
+        return RelayBoard.create_board() if serial is None else RelayBoard.create_board(serial)
+    if kind == 'ftd2xx':
+        return Ftd2xxRelayBackend(serial)
+    if kind == 'pyftdi':
+        return PyFtdiRelayBackend(serial)
+    if kind == 'simulated':
+        return SimulatedRelayBackend()
+    raise ValueError(f"Unknown relay board backend '{kind}'")
+
+
+class AsyncRelayBoard:
+    """
+    Relay board that doesn't block the test while a relay is switched.
+
+    Relay commands are queued to a dedicated worker thread, which executes them on the backend in the order they are
+    due. Every command returns a future, so the test can keep polling the UI while the button is held.
+    """
+
+    def __init__(self, backend: RelayBackend):
+        self.backend = backend
+        self._queue: list[tuple[float, int, int, int, Future]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='relay-board', daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def wrap(board: 'RelayBackend | AsyncRelayBoard') -> 'AsyncRelayBoard':
+        """ Make a relay board asynchronous, if it isn't already """
+        return board if isinstance(board, AsyncRelayBoard) else AsyncRelayBoard(board)
+
+    def pulse(self, channel: int, duration_ms: int, delay_ms: float = 0) -> Future:
+        """
+        Switch a relay on for some time, without waiting for it.
+
+        :param channel: The relay to switch.
+        :param duration_ms: How long to keep the relay on, in milliseconds.
+        :param delay_ms: Switch the relay on this many milliseconds from now, e.g. to press a button once it is ready.
+        :return: A future that is done when the relay is off again.
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The relay board is closed")
+            heapq.heappush(self._queue, (time.monotonic() + delay_ms / 1000, next(self._counter), channel,
+                                         duration_ms, future))
+            self._condition.notify()
+        return future
+
+    def switch_relay(self, channel: int, duration_ms: int) -> None:
+        """ Switch a relay on for some time, blocks until the relay is off again, like the synchronous boards """
+        self.pulse(channel, duration_ms).result()
+
+    def _run(self) -> None:
+        """ Execute the relay commands when they are due """
+        while True:
+            with self._condition:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    if self._closed and not self._queue:
+                        return
+                    self._condition.wait(None if not self._queue else self._queue[0][0] - time.monotonic())
+                _, _, channel, duration_ms, future = heapq.heappop(self._queue)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self.backend.switch_relay(channel, duration_ms)
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+
+    def close(self) -> None:
+        """ Execute the commands that are still queued, then release the relay board """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+        self.backend.close()
@@ -0,0 +1,149 @@
+import statistics
+
+import pytest
+
+# Key of the durations of earlier runs in the pytest cache
+DURATIONS_KEY = 'mobiletests/durations'
+# Duration assumed for tests that never ran before, in seconds
+DEFAULT_DURATION = 30.0
+DEFAULT_SLOW_DURATION = 120.0
+# How much a new duration counts, the history is smoothed so one hiccup doesn't reorder everything
+SMOOTHING = 0.5
+# With pytest-xdist, every worker gets about this many work units of fast tests, so they can be balanced
+UNITS_PER_WORKER = 3
+
+# Fixtures that tell which authenticator a test uses, and whether it starts on the web page
+HARDWARE_KEY_FIXTURES = {'relay_board', 'pk_util', 'registered_key'}
+DEVICE_PASSKEY_FIXTURES = {'local_pk_util', 'registered_device_passkey'}
+CREDENTIAL_FIXTURES = {'registered_key', 'registered_device_passkey'}
+WEB_FIXTURES = {'wa_util'}
+
+
+def strip_group(nodeid: str) -> str:
+    """ Get the node id without the '@group' suffix pytest-xdist adds to it with --dist loadgroup """
+    return nodeid.rsplit('@', 1)[0] if nodeid.rfind('@') > nodeid.rfind(']') else nodeid
+
+
+class DurationHistory:
+    """
+    How long every test took in earlier runs, stored in the pytest cache.
+    It is registered as a plugin, to hear about the durations of this run.
+    """
+
+    def __init__(self, cache: pytest.Cache | None):
+        """ :param cache: The pytest cache, None if the cacheprovider plugin is disabled. """
+        self.cache = cache
+        self.durations: dict[str, float] = cache.get(DURATIONS_KEY, {}) if cache is not None else {}
+        self._current: dict[str, float] = {}
+
+    def duration(self, item: pytest.Item) -> float:
+        """ Get how long a test is expected to take, in seconds """
+        known = self.durations.get(item.nodeid)
+        if known is not None:
+            return known
+        if item.get_closest_marker('slow'):
+            return DEFAULT_SLOW_DURATION
+        return statistics.median(self.durations.values()) if self.durations else DEFAULT_DURATION
+
+    def add(self, report: pytest.TestReport) -> None:
+        """ Add the duration of a phase of a test, setup, call and teardown together make up its duration """
+        nodeid = strip_group(report.nodeid)
+        self._current[nodeid] = self._current.get(nodeid, 0.0) + report.duration
+
+    def save(self) -> None:
+        """ Merge the durations of this run into the history and store it """
+        if self.cache is None or not self._current:
+            return
+        for nodeid, duration in self._current.items():
+            previous = self.durations.get(nodeid)
+            self.durations[nodeid] = duration if previous is None else \
+                previous * (1 - SMOOTHING) + duration * SMOOTHING
+        self.cache.set(DURATIONS_KEY, self.durations)
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        self.add(report)
+
+    def pytest_sessionfinish(self, session: pytest.Session) -> None:
+        # With pytest-xdist, the controller gets the reports of all workers, so only it stores them
+        if not hasattr(session.config, 'workerinput'):
+            self.save()
+
+
+def group_of(item: pytest.Item) -> str:
+    """
+    Get the group of a test: tests in the same group need a session with the same capabilities, the same authenticator
+    and start in the same context, so running them one after the other needs no new sessions or context switches.
+    """
+    fixtures = set(getattr(item, 'fixturenames', ()))
+    capabilities = 'browser' if item.get_closest_marker('browser') else 'native'
+    if fixtures & HARDWARE_KEY_FIXTURES:
+        authenticator = 'hardware'
+    elif fixtures & DEVICE_PASSKEY_FIXTURES:
+        authenticator = 'device'
+    else:
+        authenticator = 'none'
+    context = 'web' if fixtures & WEB_FIXTURES else 'native'
+    return f'{capabilities}-{authenticator}-{context}'
+
+
+def _credential_order(item: pytest.Item) -> int:
+    """ Tests that reuse a registered passkey run before those that change it, so it is registered less often """
+    if item.get_closest_marker('mutates_credentials'):
+        return 2
+    if set(getattr(item, 'fixturenames', ())) & CREDENTIAL_FIXTURES:
+        return 0
+    return 1
+
+
+def order_items(items: list[pytest.Item]) -> list[pytest.Item]:
+    """ Order tests by group, in the order the groups are first seen, with the slow tests last """
+    groups: dict[str, int] = {}
+    for item in items:
+        groups.setdefault(group_of(item), len(groups))
+    # sorted is stable, so within a group the tests keep the order they were collected in
+    return sorted(items, key=lambda item: (bool(item.get_closest_marker('slow')), groups[group_of(item)],
+                                           _credential_order(item)))
+
+
+def assign_work_units(items: list[pytest.Item], history: DurationHistory, workers: int) -> list[pytest.Item]:
+    """
+    Split the ordered tests into work units for pytest-xdist's loadgroup scheduling, and order the units the way they
+    should be handed out: the longest units of fast tests first, then every slow test as a unit of its own, also the
+    longest first. Idle workers take the next unit, so this balances the work over the devices, and the slow tests
+    are spread over them at the end.
+
+    A unit of fast tests is a run of tests of the same group, split once it is longer than its share of the work.
+
+    :return: The tests, marked with their unit, in the order of the units.
+    """
+    ordered = order_items(items)
+    fast = [item for item in ordered if not item.get_closest_marker('slow')]
+    slow = [item for item in ordered if item.get_closest_marker('slow')]
+    target = sum(history.duration(item) for item in fast) / max(1, workers * UNITS_PER_WORKER)
+
+    units: list[tuple[float, list[pytest.Item]]] = []
+    for item in fast:
+        duration = history.duration(item)
+        if units and group_of(units[-1][1][-1]) == group_of(item) and units[-1][0] + duration <= max(target, duration):
+            units[-1] = (units[-1][0] + duration, units[-1][1] + [item])
+        else:
+            units.append((duration, [item]))
+    units.sort(key=lambda unit: unit[0], reverse=True)
+    units += sorted(((history.duration(item), [item]) for item in slow), key=lambda unit: unit[0], reverse=True)
+
+    result = []
+    for index, (_, unit) in enumerate(units):
+        for item in unit:
+            item.add_marker(pytest.mark.xdist_group(f'{index:03d}-{group_of(item)}'))
+            result.append(item)
+    return result
+
+
+def keep_unit_order(option) -> None:
+    """
+    Make pytest-xdist hand out the work units in the order assign_work_units made them. By default, loadgroup
+    scheduling hands out the units with the most tests first, which would undo the longest first order.
+
+    :param option: The options of the pytest config.
+    """
+    option.loadscopereorder = False
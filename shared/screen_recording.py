@@ -0,0 +1,104 @@
+import subprocess
+
+# Directory on the device the segments are recorded in
+RECORDING_DIR = '/sdcard/mobiletests-recordings'
+# Length of one segment, and how many are kept on the device, together the part of the past that can be pulled
+SEGMENT_SECONDS = 15
+SEGMENTS = 8
+# Low enough to be cheap for the encoder and to pull, high enough to read the texts of the sheets
+BIT_RATE = 1_000_000
+# Time screenrecord gets to finish the segment it was recording after it is interrupted
+FINISH_SECONDS = 1
+ADB_TIMEOUT = 30
+
+
+class ScreenRecorder:
+    """
+    Records the screen of a device all the time, in short segments that are rotated in a ring buffer on the device.
+
+    Nothing is sent to the host while tests pass, so recording costs them nothing but the encoder on the device.
+    When a test fails, the segments that cover it are pulled, after the screenshot and the rest of its artifacts.
+    The recording is done by a shell loop around screenrecord, started with adb, so it keeps running across sessions.
+    Appium's own screen recording sends the whole video to the client every time it stops, which passing tests would
+    pay for.
+    """
+
+    def __init__(self, udid: str | None, directory: str = RECORDING_DIR, segment_seconds: int = SEGMENT_SECONDS,
+                 segments: int = SEGMENTS, bit_rate: int = BIT_RATE):
+        """
+        :param udid: The serial of the device, None if only one device is connected.
+        :param directory: The directory on the device to record in, it is emptied when the recording starts.
+        :param segment_seconds: The length of a segment, at most 180 seconds.
+        :param segments: How many segments are kept on the device.
+        :param bit_rate: The bit rate of the video.
+        """
+        self.udid = udid
+        self.directory = directory.rstrip('/')
+        self.segment_seconds = segment_seconds
+        self.segments = segments
+        self.bit_rate = bit_rate
+        # The process id of the recording loop on the device, None if it isn't recording
+        self._pid: str | None = None
+
+    @property
+    def recording(self) -> bool:
+        return self._pid is not None
+
+    def _adb(self, *args: str, timeout: float = ADB_TIMEOUT) -> bytes:
+        command = ['adb'] + (['-s', self.udid] if self.udid else []) + list(args)
+        return subprocess.run(command, check=True, capture_output=True, timeout=timeout).stdout
+
+    def start(self) -> bool:
+        """
+        Start recording, the segments of an earlier run are removed.
+
+        :return: False if the recording couldn't be started, e.g. because adb isn't available. Tests run as usual then.
+        """
+        directory = self.directory
+        # Every segment gets a new number, the one that falls out of the ring is removed before the next one starts
+        loop = (f'i=0; while [ ! -f {directory}/stop ]; do rm -f {directory}/$((i - {self.segments})).mp4; '
+                f'screenrecord --bit-rate {self.bit_rate} --time-limit {self.segment_seconds} {directory}/$i.mp4 '
+                f'|| sleep {self.segment_seconds}; i=$((i + 1)); done')
+        try:
+            output = self._adb('shell', f'rm -rf {directory}; mkdir -p {directory}; '
+                                        f"nohup sh -c '{loop}' > /dev/null 2>&1 & echo $!")
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Screen recording is off, it couldn't be started: {e}")
+            return False
+        self._pid = output.decode().strip() or None
+        return self.recording
+
+    def collect(self, seconds: float) -> list[bytes]:
+        """
+        Get the recording of the last seconds, as the segments that cover them, oldest first.
+        The segment that is being recorded is finished first, the recording continues in a new one.
+
+        :param seconds: How far back the recording should go, e.g. to the start of the failed test.
+        """
+        if not self.recording:
+            return []
+        output = self._adb('shell', f'pkill -INT -P {self._pid} screenrecord; sleep {FINISH_SECONDS}; date +%s; '
+                                    f'stat -c "%Y %n" {self.directory}/*.mp4 2> /dev/null || true').decode()
+        lines = output.split()
+        device_now = int(lines[0])
+        # Segment number -> the time it was last written to, which is when it ended
+        ended = {int(path.rsplit('/', 1)[1].removesuffix('.mp4')): int(mtime)
+                 for mtime, path in zip(lines[1::2], lines[2::2])}
+        if len(ended) < 2:
+            return []
+        # The newest segment just started, and the oldest one could be removed while it is pulled
+        numbers = sorted(ended)[1:-1] if len(ended) >= self.segments else sorted(ended)[:-1]
+        since = device_now - seconds - FINISH_SECONDS
+        return [self._adb('exec-out', 'cat', f'{self.directory}/{number}.mp4')
+                for number in numbers if ended[number] >= since]
+
+    def stop(self) -> None:
+        """ Stop recording and remove the segments from the device """
+        if not self.recording:
+            return
+        try:
+            self._adb('shell', f'touch {self.directory}/stop; pkill -INT -P {self._pid} screenrecord; '
+                               f'sleep {FINISH_SECONDS}; rm -rf {self.directory}')
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Could not stop the screen recording: {e}")
+        self._pid = None
@@ -0,0 +1,175 @@
+import threading
+from typing import Callable
+
+from appium import webdriver
+from appium.options.android import UiAutomator2Options
+from selenium.common import WebDriverException
+
+from shared.appium_util import DriverController
+from shared.device_profile import DeviceProfile
+from shared.locator import Context
+from shared.transport import PooledConnection
+from shared.wait_statistics import WaitStatistics
+
+# How long acquire waits at most for the device to be given back, e.g. when capturing the artifacts of a failure hangs
+HOLD_TIMEOUT = 120
+
+
+class PooledSession:
+    """ An Appium session that is kept alive by the SessionPool and can be reused by multiple tests """
+
+    def __init__(self, driver: webdriver.Remote, capabilities: dict, profile: DeviceProfile | None = None,
+                 wait_statistics: WaitStatistics | None = None):
+        """
+        :param driver: The driver of the session.
+        :param capabilities: The capabilities the session was created with.
+        :param profile: What is known about the device, shared by all sessions on the device.
+        :param wait_statistics: Learned wait times, shared by all sessions on the device.
+        """
+        self.driver = driver
+        self.capabilities = capabilities
+        self.browser = 'browserName' in capabilities
+        self.profile = profile or DeviceProfile()
+        self.wait_statistics = wait_statistics
+        self._controller: DriverController | None = None
+        # The context the session started in, used to reset the session before it is reused
+        self.initial_context = self.controller.current_context
+        self.profile.initial_contexts[self.kind] = self.initial_context.value
+
+    @property
+    def kind(self) -> str:
+        """ Get the kind of session, sessions of the same kind start in the same context """
+        return 'browser' if self.browser else 'native'
+
+    @property
+    def controller(self) -> DriverController:
+        """ Get the driver controller for this session, it is created once and reused together with the session """
+        if self._controller is None:
+            initial_context = self.profile.initial_contexts.get(self.kind)
+            self._controller = DriverController(self.driver, Context(initial_context) if initial_context else None,
+                                                self.profile.screen_size, self.wait_statistics, self.profile)
+        return self._controller
+
+    def is_healthy(self) -> bool:
+        """
+        Check if the session is still alive, with a single cheap command that reaches UiAutomator2 or Chrome.
+        Asking for the context isn't enough, Appium answers that itself, even when the device side of the session died.
+        """
+        try:
+            self.driver.get_window_size()
+            return True
+        except WebDriverException:
+            return False
+
+    def reset(self) -> None:
+        """
+        Bring the session back in a clean state so the next test can use it.
+        This is a lot faster than creating a new session, as neither UiAutomator2 nor Chrome have to be restarted.
+        """
+        self.controller.switch_context(self.initial_context, force=True)
+        if self.browser:
+            # Forget the logged-in user and leave the page, so the next test starts fresh
+            self.driver.delete_all_cookies()
+            self.controller.open_url('about:blank')
+
+    def quit(self) -> None:
+        """ End the session, errors are ignored as the session might already be dead """
+        try:
+            self.driver.quit()
+        except WebDriverException:
+            pass
+
+
+class SessionPool:
+    """
+    Keeps the Appium session of a device alive between tests, for as long as the tests need the same capabilities.
+
+    Creating a session starts the UiAutomator2 server and, for browser tests, Chrome and chromedriver,
+    which often takes longer than the test itself. The pool keeps the session alive between tests instead.
+    There is at most one session per device: creating a UiAutomator2 session stops the UiAutomator2 server of any
+    other session on the same device, so an idle session with other capabilities is ended before a new one is created.
+    """
+
+    def __init__(self, server_url: str, wait_statistics: WaitStatistics | None = None,
+                 profile: DeviceProfile | None = None):
+        """
+        :param server_url: The url of the Appium server.
+        :param wait_statistics: Learned wait times, given to the controller of every session.
+        :param profile: What is known about the device, it is checked against the device when the first session is
+                        created. All sessions of the pool are on the same device, so it is shared between them.
+        """
+        self.server_url = server_url
+        self.wait_statistics = wait_statistics
+        self.profile = profile or DeviceProfile()
+        self._identified = False
+        self._idle: PooledSession | None = None
+        # Acquire waits until all of these are set
+        self._holds: list[threading.Event] = []
+
+    @staticmethod
+    def _key(capabilities: dict) -> tuple:
+        """ Get the key of a set of capabilities, sessions are only shared between identical capabilities """
+        return tuple(sorted((key, repr(value)) for key, value in capabilities.items()))
+
+    def _create_session(self, capabilities: dict) -> PooledSession:
+        """ Create a new Appium session """
+        # All sessions on the server share one pool of keep-alive connections
+        driver = webdriver.Remote(PooledConnection(self.server_url),
+                                  options=UiAutomator2Options().load_capabilities(capabilities))
+        if not self._identified:
+            self.profile.identify(driver)
+            self._identified = True
+        return PooledSession(driver, capabilities, self.profile, self.wait_statistics)
+
+    def acquire(self, capabilities: dict) -> PooledSession:
+        """
+        Get a session with the given capabilities.
+        The idle session is reused if it has the same capabilities and is still healthy, otherwise it is ended and
+        a new session is created.
+        """
+        for hold in self._holds:
+            if not hold.wait(HOLD_TIMEOUT):
+                print(f"The device was still held after {HOLD_TIMEOUT} seconds, a new session is created anyway")
+        self._holds.clear()
+
+        session, self._idle = self._idle, None
+        if session is not None:
+            if self._key(session.capabilities) == self._key(capabilities) and session.is_healthy():
+                return session
+            session.quit()
+        return self._create_session(capabilities)
+
+    def hold(self) -> Callable[[], None]:
+        """
+        Keep the device for something other than a test, like capturing the artifacts of a failed test on a
+        background thread: the next acquire waits until the returned function is called.
+        """
+        released = threading.Event()
+        self._holds.append(released)
+        return released.set
+
+    def release(self, session: PooledSession, reusable: bool = True) -> None:
+        """
+        Give a session back to the pool.
+
+        :param session: The session to give back.
+        :param reusable: If False, the session is ended instead, e.g. because a failed test left it in an unknown state.
+        """
+        if self.profile.screen_size is None:
+            self.profile.screen_size = session.controller.cached_device_size
+        if reusable:
+            try:
+                session.reset()
+            except WebDriverException:
+                reusable = False
+
+        if reusable and self._idle is None:
+            self._idle = session
+        else:
+            session.quit()
+
+    def close(self) -> None:
+        """ End the idle session """
+        if self._idle is not None:
+            self._idle.quit()
+            self._idle = None
@@ -0,0 +1,99 @@
+import functools
+import hashlib
+from collections import Counter
+
+from lxml import etree, html
+
+from shared.locator import Locator, Context, FACTORY_CACHE_SIZE
+
+
+@functools.lru_cache(maxsize=FACTORY_CACHE_SIZE)
+def _compiled_xpath(locator: Locator) -> etree.XPath:
+    """ Get the XPath of a locator compiled by lxml, so it isn't parsed again for every snapshot """
+    xpath = locator.to_xpath()
+    if xpath is None:
+        raise NotImplementedError(f"Locators by '{locator.by}' can't be evaluated against a snapshot")
+    return etree.XPath(xpath)
+
+
+class SnapshotDiff:
+    """ Difference between two snapshots, as the elements that appeared and disappeared """
+
+    def __init__(self, added: list[tuple], removed: list[tuple]):
+        self.added = added
+        self.removed = removed
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed)
+
+    def __repr__(self) -> str:
+        return f'SnapshotDiff(added={self.added}, removed={self.removed})'
+
+
+class HierarchySnapshot:
+    """
+    The native UI hierarchy or the web DOM at one point in time, fetched with one page_source call.
+    Any number of locators can be evaluated against it locally, without extra round trips to the Appium server.
+    """
+
+    def __init__(self, context: Context, source: str):
+        self.context = context
+        self.source = source
+        if context == Context.NATIVE:
+            self._root = etree.fromstring(source.encode())
+        else:
+            self._root = html.fromstring(source)
+
+    @property
+    def fingerprint(self) -> str:
+        """ Get a hash of the snapshot, which changes whenever anything on screen changes """
+        return hashlib.sha1(self.source.encode()).hexdigest()
+
+    def find_all(self, locator: Locator) -> list[etree.ElementBase]:
+        """ Find all elements in the snapshot that match a locator """
+        if locator.context != self.context:
+            raise ValueError(f"Can't evaluate a locator for '{locator.context}' against a snapshot of '{self.context}'")
+
+        elements = []
+        for alternative in locator.alternatives:
+            elements.extend(element for element in _compiled_xpath(alternative)(self._root) if element not in elements)
+        return elements
+
+    def path_of(self, element: etree.ElementBase) -> str:
+        """ Get the absolute XPath of an element of the snapshot, to find the same element in a later snapshot """
+        return self._root.getroottree().getpath(element)
+
+    def find_by_path(self, path: str) -> etree.ElementBase | None:
+        """ Find an element by its absolute XPath, as returned by path_of """
+        elements = self._root.getroottree().xpath(path)
+        return elements[0] if elements else None
+
+    def is_present(self, locator: Locator) -> bool:
+        """ Check if a locator matches anything in the snapshot """
+        return len(self.find_all(locator)) > 0
+
+    def are_present(self, locators: list[Locator]) -> list[bool]:
+        """ Check for every locator if it matches anything in the snapshot """
+        return [self.is_present(locator) for locator in locators]
+
+    def text(self, locator: Locator) -> str | None:
+        """ Get the text of the first element that matches a locator, or None if nothing matches """
+        elements = self.find_all(locator)
+        if not elements:
+            return None
+        if self.context == Context.NATIVE:
+            return elements[0].get('text')
+        return elements[0].text_content().strip()
+
+    def _signatures(self) -> Counter:
+        """ Describe every element by its tag, attributes and text, so elements can be compared between snapshots """
+        return Counter(
+            (element.tag, tuple(sorted(element.attrib.items())), (element.text or '').strip())
+            for element in self._root.iter() if isinstance(element.tag, str)
+        )
+
+    def diff(self, other: 'HierarchySnapshot') -> SnapshotDiff:
+        """ Get the elements that were added and removed in another, later, snapshot compared to this one """
+        before = self._signatures()
+        after = other._signatures()
+        return SnapshotDiff(list((after - before).elements()), list((before - after).elements()))
@@ -0,0 +1,162 @@
+import functools
+import json
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+from shared.locator import Locator
+from shared.wait_statistics import percentile
+
+
+class Tracer:
+    """
+    Records how long driver commands, controller calls, relay actuations and sleeps take.
+
+    The trace of every test is written as a Chrome trace (open it in https://ui.perfetto.dev or chrome://tracing),
+    and the durations of all tests are aggregated into a summary per command and locator.
+    When the tracer is disabled, traced calls only cost a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._events: list[dict] = []
+        self._durations: dict[tuple[str, str, Locator | None], list[float]] = {}
+        self._start_ns = time.perf_counter_ns()
+
+    def start_trace(self) -> None:
+        """ Start a new trace, e.g. for a new test """
+        self._events = []
+        self._start_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name: str, category: str, locator: Locator | None = None, context: str | None = None, **args):
+        """
+        Record the duration of a block of code.
+
+        :param name: The name of what is being done, like the command or method name.
+        :param category: The kind of work, like 'driver', 'controller', 'relay', 'sleep' or 'step'.
+        :param locator: The locator the work is done for, if any.
+        :param context: The context the work is done in, if known.
+        :param args: Extra information to store with the event.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start_ns = time.perf_counter_ns()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            duration_ns = time.perf_counter_ns() - start_ns
+            if locator is not None:
+                args['locator'] = str(locator)
+                context = locator.context.value
+            if context is not None:
+                args['context'] = context
+            args['outcome'] = outcome
+            self._events.append(dict(name=name, cat=category, ph='X', ts=(start_ns - self._start_ns) / 1000,
+                                     dur=duration_ns / 1000, pid=os.getpid(), tid=threading.get_ident(), args=args))
+            key = (category, name, locator)
+            self._durations.setdefault(key, []).append(duration_ns / 1e6)
+
+    def instrument(self, obj, method_name: str, category: str) -> None:
+        """ Trace every call to a method of an object, like the switch_relay method of a relay board """
+        method = getattr(obj, method_name)
+        if getattr(method, '_traced', False):
+            return
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return method(*args, **kwargs)
+            with self.span(method_name, category):
+                return method(*args, **kwargs)
+
+        wrapper._traced = True
+        setattr(obj, method_name, wrapper)
+
+    def instrument_driver(self, driver) -> None:
+        """ Trace every command a driver sends to the Appium server """
+        execute = driver.execute
+        if getattr(execute, '_traced', False):
+            return
+
+        @functools.wraps(execute)
+        def wrapper(driver_command: str, params: dict | None = None):
+            if not self.enabled:
+                return execute(driver_command, params)
+            with self.span(driver_command, 'driver'):
+                return execute(driver_command, params)
+
+        wrapper._traced = True
+        driver.execute = wrapper
+
+    def write_trace(self, path: str) -> None:
+        """ Write the events of the current trace as a Chrome trace JSON file """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(dict(traceEvents=self._events, displayTimeUnit='ms'), file)
+
+    def time_in(self, *categories: str) -> float:
+        """ Get the time spent in the current trace on the given categories, in seconds """
+        return sum(event['dur'] for event in self._events if event['cat'] in categories) / 1e6
+
+    def durations(self, category: str) -> dict[str, float]:
+        """ Get the time spent in the current trace per name within a category, in milliseconds """
+        durations = {}
+        for event in self._events:
+            if event['cat'] == category:
+                durations[event['name']] = durations.get(event['name'], 0.0) + event['dur'] / 1000
+        return durations
+
+    def summary(self) -> list[dict]:
+        """ Get the latency statistics of every traced command and locator, slowest total time first """
+        rows = []
+        for (category, name, locator), durations in self._durations.items():
+            rows.append(dict(
+                category=category, name=name, locator='' if locator is None else str(locator), count=len(durations),
+                total_ms=sum(durations), mean_ms=statistics.fmean(durations),
+                p50_ms=percentile(durations, 0.5), p95_ms=percentile(durations, 0.95), max_ms=max(durations),
+            ))
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+    def write_summary(self, path: str) -> None:
+        """ Write the latency statistics of everything traced so far as a JSON file """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+# The tracer used by the whole test run, it is enabled by the --trace-dir option
+tracer = Tracer()
+
+
+def traced(function):
+    """ Decorator that traces calls to a DriverController method, together with their locator and context """
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        if not tracer.enabled:
+            return function(self, *args, **kwargs)
+        locator = next((arg for arg in args if isinstance(arg, Locator)), None)
+        with tracer.span(function.__name__, 'controller', locator, self.current_context.value):
+            return function(self, *args, **kwargs)
+
+    return wrapper
+
+
+def sleep(seconds: float) -> None:
+    """ time.sleep, but shows up in the trace, so fixed waits can be told apart from waiting for the device """
+    with tracer.span('sleep', 'sleep', seconds=seconds):
+        time.sleep(seconds)
+
+
+def step(name: str):
+    """ Mark a step of a flow, like the sheet appearing or the PIN being accepted, so its duration can be reported """
+    return tracer.span(name, 'step')
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import urllib3
+from appium.webdriver.appium_connection import AppiumConnection
+from appium.webdriver.client_config import AppiumClientConfig
+
+# Connections kept open per Appium server, enough for the sessions of one worker and the background artifact writer
+POOL_SIZE = 4
+# Appium commands aren't idempotent, so a failed request is never sent again
+RETRIES = False
+
+
+class TransportStatistics:
+    """ Number of requests, bytes and time spent per Appium command, for all sessions on one server """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Command -> [requests, bytes sent, bytes received, seconds]
+        self._commands: dict[str, list[float]] = {}
+
+    def record(self, command: str, sent: int, received: int, seconds: float) -> None:
+        with self._lock:
+            totals = self._commands.setdefault(command, [0, 0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += sent
+            totals[2] += received
+            totals[3] += seconds
+
+    @property
+    def requests(self) -> int:
+        with self._lock:
+            return sum(int(totals[0]) for totals in self._commands.values())
+
+    @property
+    def bytes_received(self) -> int:
+        with self._lock:
+            return sum(int(totals[2]) for totals in self._commands.values())
+
+    def reset(self) -> None:
+        with self._lock:
+            self._commands.clear()
+
+    def summary(self) -> list[dict]:
+        """ Get the totals per command, most bytes received first """
+        with self._lock:
+            rows = [dict(command=command, requests=int(requests), bytes_sent=int(sent), bytes_received=int(received),
+                         total_ms=seconds * 1000, mean_ms=seconds * 1000 / requests)
+                    for command, (requests, sent, received, seconds) in self._commands.items()]
+        return sorted(rows, key=lambda row: row['bytes_received'], reverse=True)
+
+
+class _CountingPool:
+    """
+    Wraps the pool manager selenium builds from the client config, and remembers, per thread, how many bytes the last
+    request sent and received
+    """
+
+    def __init__(self, manager: urllib3.PoolManager):
+        self.manager = manager
+        self.last_exchange = threading.local()
+
+    def request(self, method, url, body=None, **kwargs):
+        response = self.manager.request(method, url, body=body, **kwargs)
+        body = body or b''
+        body = body.encode() if isinstance(body, str) else body
+        # The size on the wire, which is the compressed size when the response was gzipped
+        received = response.headers.get('Content-Length')
+        self.last_exchange.sent = len(body)
+        self.last_exchange.received = int(received) if received is not None else len(response.data)
+        return response
+
+    def clear(self) -> None:
+        self.manager.clear()
+
+
+# Server url -> the connection pool and statistics shared by all sessions on it
+_pools: dict[str, _CountingPool] = {}
+_statistics: dict[str, TransportStatistics] = {}
+_servers_lock = threading.Lock()
+
+
+def statistics_for(server_url: str) -> TransportStatistics:
+    """ Get the transport statistics of all sessions on an Appium server """
+    with _servers_lock:
+        return _statistics.setdefault(server_url.rstrip('/'), TransportStatistics())
+
+
+class PooledConnection(AppiumConnection):
+    """
+    Connection to an Appium server that shares one pool of keep-alive connections with all other sessions on the same
+    server, instead of every session opening its own. It asks for gzipped responses, which pays off for page sources
+    and screenshots when the server or a proxy in front of it compresses, and counts the bytes and time of every
+    command in the TransportStatistics of the server.
+    """
+
+    def __init__(self, server_url: str, client_config: AppiumClientConfig | None = None):
+        """
+        :param server_url: The url of the Appium server.
+        :param client_config: The certificates, proxy and timeout of the connections, which must be kept alive.
+                              The pool of a server is built from the config of the first connection to it.
+                              By default, POOL_SIZE connections are kept open and failed requests aren't retried.
+        """
+        self.server_url = server_url.rstrip('/')
+        if client_config is None:
+            pool_args = dict(maxsize=POOL_SIZE, block=False, retries=RETRIES)
+            client_config = AppiumClientConfig(remote_server_addr=self.server_url, keep_alive=True,
+                                               init_args_for_pool_manager=dict(init_args_for_pool_manager=pool_args))
+        super().__init__(client_config=client_config)
+        self.statistics = statistics_for(self.server_url)
+
+    def _get_connection_manager(self):
+        with _servers_lock:
+            if self.server_url not in _pools:
+                _pools[self.server_url] = _CountingPool(super()._get_connection_manager())
+            return _pools[self.server_url]
+
+    def get_remote_connection_headers(self, parsed_url, keep_alive=True):
+        headers = super().get_remote_connection_headers(parsed_url, keep_alive=keep_alive)
+        headers['Accept-Encoding'] = 'gzip'
+        return headers
+
+    def execute(self, command, params):
+        exchange = self._conn.last_exchange
+        exchange.sent = exchange.received = 0
+        start = time.perf_counter()
+        try:
+            return super().execute(command, params)
+        finally:
+            self.statistics.record(command, exchange.sent, exchange.received, time.perf_counter() - start)
+
+    def close(self):
+        # The pool is shared with the other sessions on the server, so it stays open
+        pass
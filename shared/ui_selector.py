@@ -0,0 +1,157 @@
+import re
+
+
+# Matches one method call of a UiSelector chain, like '.text("Hello")' or '.instance(2)'
+_METHOD_PATTERN = re.compile(r'\.(\w+)\(\s*("(?:[^"\\]|\\.)*"|[^)]*?)\s*\)')
+_SELECTOR_START = 'new UiSelector()'
+# Matches 'new UiScrollable(...).scrollIntoView(<selector>)', which finds the selector after scrolling to it
+_SCROLL_INTO_VIEW_PATTERN = re.compile(r'new UiScrollable\(.*?\)\.scrollIntoView\((.*)\)\s*;?\s*$', re.DOTALL)
+
+# How UiSelector methods map onto the attributes of the UiAutomator2 hierarchy
+_ATTRIBUTE_METHODS = {
+    'text': 'text',
+    'className': 'class',
+    'resourceId': 'resource-id',
+    'description': 'content-desc',
+    'packageName': 'package',
+}
+_CONTAINS_METHODS = {
+    'textContains': 'text',
+    'descriptionContains': 'content-desc',
+}
+_STARTS_WITH_METHODS = {
+    'textStartsWith': 'text',
+    'descriptionStartsWith': 'content-desc',
+}
+_BOOLEAN_METHODS = {
+    'checkable': 'checkable',
+    'checked': 'checked',
+    'clickable': 'clickable',
+    'enabled': 'enabled',
+    'focusable': 'focusable',
+    'focused': 'focused',
+    'longClickable': 'long-clickable',
+    'scrollable': 'scrollable',
+    'selected': 'selected',
+}
+
+
+def _unescape(value: str) -> str:
+    """ Undo the escaping of a Java string literal, as done by Locator._escape_string """
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def _parse_argument(argument: str) -> str | int | bool:
+    """ Parse the argument of a UiSelector method """
+    if argument.startswith('"'):
+        return _unescape(argument[1:-1])
+    if argument in ('true', 'false'):
+        return argument == 'true'
+    return int(argument)
+
+
+def parse(selector: str) -> list[tuple[str, str | int | bool]] | None:
+    """
+    Parse a single UiSelector chain, like 'new UiSelector().className("android.widget.Button").instance(2)'.
+
+    :return: The methods of the chain with their argument, or None if the selector isn't a plain UiSelector chain.
+    """
+    selector = selector.strip().rstrip(';').strip()
+    if not selector.startswith(_SELECTOR_START):
+        return None
+    chain = selector[len(_SELECTOR_START):]
+
+    methods = []
+    position = 0
+    for match in _METHOD_PATTERN.finditer(chain):
+        if match.start() != position:
+            return None
+        try:
+            methods.append((match.group(1), _parse_argument(match.group(2))))
+        except ValueError:
+            return None
+        position = match.end()
+    if position != len(chain):
+        return None
+    return methods
+
+
+def xpath_literal(value: str) -> str:
+    """ Create an XPath 1.0 string literal, XPath has no escape characters so quotes need some extra care """
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    # Contains both kinds of quotes, glue the parts between the double quotes together with quoted double quotes
+    separator = ", '\"', "
+    return 'concat(' + separator.join(f'"{part}"' for part in value.split('"')) + ')'
+
+
+def split_statements(selectors: str) -> list[str]:
+    """ Split multiple UiSelector statements, separated by ';', ignoring any ';' inside string arguments """
+    statements = []
+    current = ''
+    in_string = False
+    escaped = False
+    for character in selectors:
+        if character == ';' and not in_string:
+            statements.append(current)
+            current = ''
+            continue
+        current += character
+        if escaped:
+            escaped = False
+        elif character == '\\':
+            escaped = True
+        elif character == '"':
+            in_string = not in_string
+    statements.append(current)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def to_xpath(selectors: str) -> str | None:
+    """
+    Convert one or more UiSelector chains to an XPath for the UiAutomator2 hierarchy.
+
+    :return: The XPath, or None if a selector uses methods that can't be converted.
+    """
+    xpaths = [_selector_to_xpath(selector) for selector in split_statements(selectors)]
+    if not xpaths or None in xpaths:
+        return None
+    return ' | '.join(xpaths)
+
+
+def _selector_to_xpath(selector: str) -> str | None:
+    """ Convert a single UiSelector chain to an XPath """
+    # The hierarchy contains the whole scrollable view, so scrolling an element into view is the same as finding it
+    scroll_into_view = _SCROLL_INTO_VIEW_PATTERN.match(selector.strip())
+    if scroll_into_view is not None:
+        return _selector_to_xpath(scroll_into_view.group(1))
+
+    methods = parse(selector)
+    if methods is None:
+        return None
+
+    conditions = []
+    instance = None
+    for method, argument in methods:
+        if method in _ATTRIBUTE_METHODS:
+            conditions.append(f'@{_ATTRIBUTE_METHODS[method]}={xpath_literal(argument)}')
+        elif method in _CONTAINS_METHODS:
+            conditions.append(f'contains(@{_CONTAINS_METHODS[method]}, {xpath_literal(argument)})')
+        elif method in _STARTS_WITH_METHODS:
+            conditions.append(f'starts-with(@{_STARTS_WITH_METHODS[method]}, {xpath_literal(argument)})')
+        elif method in _BOOLEAN_METHODS:
+            conditions.append(f'@{_BOOLEAN_METHODS[method]}="{str(argument).lower()}"')
+        elif method == 'index':
+            conditions.append(f'@index="{argument}"')
+        elif method == 'instance':
+            instance = argument
+        else:
+            return None
+
+    xpath = '//*' + ''.join(f'[{condition}]' for condition in conditions)
+    if instance is not None:
+        # UiSelector instances start counting at 0, XPath positions at 1
+        xpath = f'({xpath})[{instance + 1}]'
+    return xpath
@@ -0,0 +1,86 @@
+import json
+import os
+
+from shared.locator import Locator
+
+# How many of the most recent wait times are kept per locator
+MAX_SAMPLES = 50
+# How many wait times are needed before anything is derived from them
+MIN_SAMPLES = 5
+# Deadline = high percentile of the wait times * factor + margin, in seconds
+DEADLINE_PERCENTILE = 0.95
+DEADLINE_FACTOR = 1.5
+DEADLINE_MARGIN = 2.0
+# Learned deadlines are never shorter than this, in seconds
+MIN_DEADLINE = 3.0
+# Bounds on the time between polls, in seconds
+MIN_POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    """ Get a percentile of some samples, using the nearest rank """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class WaitStatistics:
+    """
+    How long locators take to appear on each device model, stored in a JSON file so it is remembered between runs.
+
+    From these wait times it derives how to wait for a locator: poll often around the time the element usually
+    appears and back off once it is later than usual, and give up at a deadline based on a high percentile plus a
+    margin, instead of the same fixed timeout and poll interval for every locator on every device.
+    """
+
+    def __init__(self, path: str | None = None):
+        """ :param path: The JSON file to store the statistics in, None to not store them. """
+        self.path = path
+        # Device model -> locator key -> the most recent wait times, in seconds
+        self._samples: dict[str, dict[str, list[float]]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                self._samples = json.load(file)
+
+    def samples(self, model: str, locator: Locator) -> list[float]:
+        """ Get the recorded wait times of a locator on a device model """
+        return self._samples.get(model, {}).get(locator.key, [])
+
+    def record(self, model: str, locator: Locator, seconds: float) -> None:
+        """ Remember how long it took for a locator to appear """
+        samples = self._samples.setdefault(model, {}).setdefault(locator.key, [])
+        samples.append(round(seconds, 3))
+        del samples[:-MAX_SAMPLES]
+
+    def deadline(self, model: str, locator: Locator, default: float) -> float:
+        """ Get how long to wait for a locator before failing, or the default if too little is known """
+        samples = self.samples(model, locator)
+        if len(samples) < MIN_SAMPLES:
+            return default
+        return max(MIN_DEADLINE, percentile(samples, DEADLINE_PERCENTILE) * DEADLINE_FACTOR + DEADLINE_MARGIN)
+
+    def poll_interval(self, model: str, locator: Locator, elapsed: float) -> float:
+        """
+        Get how long to wait before looking for a locator again.
+
+        :param elapsed: How long the wait has been going on, in seconds.
+        """
+        samples = self.samples(model, locator)
+        if len(samples) < MIN_SAMPLES:
+            usual, late = 0.0, 1.0
+        else:
+            usual, late = percentile(samples, 0.5), percentile(samples, DEADLINE_PERCENTILE)
+        # A tenth of the usual wait is precise enough, and doesn't flood the Appium server
+        interval = max(MIN_POLL_INTERVAL, usual / 10)
+        if elapsed > late:
+            # Later than usual, something is probably wrong, so back off
+            interval *= 2 ** ((elapsed - late) / max(late, 0.5))
+        return min(MAX_POLL_INTERVAL, interval)
+
+    def save(self) -> None:
+        """ Store the statistics in their file """
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as file:
+            json.dump(self._samples, file)
@@ -0,0 +1,157 @@
+from selenium.common import WebDriverException, TimeoutException
+
+from shared.appium_util import DriverController, WAIT_TIMEOUT
+from shared.locator import Locator, Context
+from shared.tracing import traced
+
+# Helper functions available to every script, locators are passed to the page as XPath
+_HELPERS = '''
+function find(xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function setValue(input, value) {
+    // Use the native setter, so frameworks that track the value of the input notice the change
+    Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set.call(input, value);
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+    input.dispatchEvent(new Event('change', {bubbles: true}));
+}
+function whenChanged(check, timeout, done) {
+    // Call done with the first result of check that isn't null, or with null after the timeout
+    const first = check();
+    if (first !== null) { done(first); return; }
+    const observer = new MutationObserver(() => {
+        const result = check();
+        if (result !== null) { observer.disconnect(); clearTimeout(timer); done(result); }
+    });
+    const timer = setTimeout(() => { observer.disconnect(); done(null); }, timeout);
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+'''
+
+_FILL = _HELPERS + '''
+const [inputXpath, value, buttonXpath] = arguments;
+const input = find(inputXpath);
+const button = buttonXpath === null ? null : find(buttonXpath);
+if (input === null || (buttonXpath !== null && button === null)) return false;
+setValue(input, value);
+if (button !== null) button.click();
+return true;
+'''
+
+_CLICK = _HELPERS + '''
+const element = find(arguments[0]);
+if (element === null) return false;
+element.click();
+return true;
+'''
+
+_CLICK_ALL = _HELPERS + '''
+const [xpath, timeout, done] = arguments;
+let clicked = 0;
+function next() {
+    const element = find(xpath);
+    if (element === null) { done(clicked); return; }
+    element.click();
+    clicked++;
+    // Wait until the page removed what was clicked, before looking for the next one
+    whenChanged(() => element.isConnected ? null : true, timeout, (removed) => removed === null ? done(-1) : next());
+}
+next();
+'''
+
+_WAIT_FOR_FIRST = _HELPERS + '''
+const [xpaths, timeout, done] = arguments;
+whenChanged(() => {
+    for (let i = 0; i < xpaths.length; i++) {
+        const element = find(xpaths[i]);
+        if (element !== null) return [i, element.textContent.trim()];
+    }
+    return null;
+}, timeout, (match) => done(match === null ? -1 : match));
+'''
+
+
+class WebScriptExecutor:
+    """
+    Does multistep interactions with a web page in a single execute_script call, instead of an Appium round trip for
+    finding every element and another one for every action.
+
+    Every method returns None when the script could not do its work, e.g. because the page doesn't allow scripts or
+    an element is missing, so the caller can fall back to the locator based way. Nothing is changed on the page then.
+    A wait that ran out of time raises a TimeoutException instead, falling back would only wait a second time.
+    """
+
+    def __init__(self, controller: DriverController):
+        self.controller = controller
+
+    @property
+    def current_context(self) -> Context:
+        return self.controller.current_context
+
+    @staticmethod
+    def _xpath(locator: Locator) -> str:
+        """ Get the XPath to pass a web locator to a script """
+        xpath = locator.to_xpath()
+        if locator.context != Context.WEB or xpath is None:
+            raise ValueError(f"Locator {locator} can't be used in a web script")
+        return xpath
+
+    def _execute(self, script: str, *args, asynchronous: bool = False):
+        """ Run a script in the web context, or return None if it failed """
+        self.controller.switch_context(Context.WEB)
+        try:
+            if asynchronous:
+                return self.controller.driver.execute_async_script(script, *args)
+            return self.controller.driver.execute_script(script, *args)
+        except WebDriverException:
+            return None
+
+    @traced
+    def fill(self, input_locator: Locator, value: str, submit_locator: Locator | None = None) -> bool | None:
+        """
+        Set the value of an input, and optionally click a button to submit it.
+
+        :return: True if done, None if one of the elements wasn't found or the script failed.
+        """
+        submit = None if submit_locator is None else self._xpath(submit_locator)
+        return self._execute(_FILL, self._xpath(input_locator), value, submit) or None
+
+    @traced
+    def click(self, locator: Locator) -> bool | None:
+        """
+        Click an element.
+
+        :return: True if done, None if the element wasn't found or the script failed.
+        """
+        return self._execute(_CLICK, self._xpath(locator)) or None
+
+    @traced
+    def click_all(self, locator: Locator, timeout: float = WAIT_TIMEOUT) -> int | None:
+        """
+        Click every element a locator matches, one after the other, each time waiting for the page to remove the
+        clicked element, like the delete buttons of a list.
+
+        :param locator: The elements to click.
+        :param timeout: How long to wait for the page to remove a clicked element, in seconds.
+        :return: How many elements were clicked, or None if the script failed or an element wasn't removed in time.
+        """
+        clicked = self._execute(_CLICK_ALL, self._xpath(locator), timeout * 1000, asynchronous=True)
+        return None if clicked is None or clicked < 0 else clicked
+
+    @traced
+    def wait_for_first_text(self, locators: list[Locator], timeout: float = WAIT_TIMEOUT) -> tuple[Locator, str] | None:
+        """
+        Wait for any of the locators to match an element, the page is watched with a MutationObserver.
+
+        :return: The first locator from the list that matches and the text of its element, or None if the script failed.
+        :raises TimeoutException: If the script ran, but nothing matched within the timeout. Waiting for the locators
+                                  in another way wouldn't find anything either.
+        """
+        result = self._execute(_WAIT_FOR_FIRST, [self._xpath(locator) for locator in locators], timeout * 1000,
+                               asynchronous=True)
+        if result == -1:
+            raise TimeoutException(f"Timed out waiting for {', '.join(str(locator) for locator in locators)}")
+        if not result:
+            return None
+        index, text = result
+        return locators[index], text
@@ -0,0 +1,81 @@
+"""
+The artifacts of failed tests, captured from a session on the offline server on the background thread.
+"""
+import gzip
+import os
+
+import pytest
+
+from offline.fixtures import offline_capabilities
+from shared.artifacts import FailureArtifacts
+
+
+@pytest.fixture(scope='function')
+def session(offline_session_pool):
+    session = offline_session_pool.acquire(offline_capabilities)
+    session.controller.open_url('https://webauthn.io')
+    return session
+
+
+def test_artifacts_are_stored(tmp_path, session):
+    artifacts = FailureArtifacts(str(tmp_path))
+
+    artifacts.capture('test_a', 'error', session)
+    artifacts.close()
+
+    assert sorted(os.listdir(tmp_path)) == ['test_a.html.gz', 'test_a.logcat.txt.gz', 'test_a.png']
+    assert gzip.decompress((tmp_path / 'test_a.html.gz').read_bytes()).decode() == session.driver.page_source
+    assert artifacts.stored_bytes == sum(file.stat().st_size for file in tmp_path.iterdir())
+
+
+def test_duplicates_of_same_signature_are_skipped(tmp_path, session):
+    artifacts = FailureArtifacts(str(tmp_path))
+
+    artifacts.capture('test_a', 'error', session)
+    artifacts.capture('test_b', 'error', session)
+    artifacts.capture('test_c', 'other error', session)
+    artifacts.close()
+
+    # The second failure shows the same screen as the first one, only another failure stores it again
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('test_b')]
+    assert len([name for name in os.listdir(tmp_path) if name.startswith('test_c')]) == 3
+
+
+def test_size_limit(tmp_path, session):
+    screenshot = session.driver.get_screenshot_as_png()
+    artifacts = FailureArtifacts(str(tmp_path), max_bytes=len(screenshot))
+
+    artifacts.capture('test_a', 'error', session)
+    artifacts.close()
+
+    assert os.listdir(tmp_path) == ['test_a.png']
+    assert artifacts.stored_bytes == len(screenshot)
+    assert artifacts.skipped == ['test_a.html.gz', 'test_a.logcat.txt.gz']
+
+
+def test_close_drains_queue(tmp_path, offline_server, session):
+    # A slow screenshot keeps the captures queued until close
+    offline_server.latency = dict(screenshot=0.1)
+    artifacts = FailureArtifacts(str(tmp_path))
+    done = []
+
+    for name in ['test_a', 'test_b', 'test_c']:
+        artifacts.capture(name, name, session, done=lambda name=name: done.append(name))
+    assert len(done) < 3
+    artifacts.close()
+
+    assert done == ['test_a', 'test_b', 'test_c']
+    assert len(os.listdir(tmp_path)) == 9
+
+
+def test_failed_capture_calls_done(tmp_path, offline_server, session):
+    artifacts = FailureArtifacts(str(tmp_path))
+    done = []
+    offline_server.sessions.clear()
+
+    artifacts.capture('test_a', 'error', session, done=lambda: done.append('test_a'))
+    artifacts.close()
+
+    # The next test must get the device, even when the session of the failed test died
+    assert done == ['test_a']
+    assert not os.listdir(tmp_path)
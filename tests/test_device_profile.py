@@ -0,0 +1,150 @@
+"""
+The device profile, and how the driver controller uses the variants of composite locators it remembers.
+"""
+import json
+import time
+
+import pytest
+from selenium.common import TimeoutException, WebDriverException
+
+from shared.appium_util import DriverController
+from shared.device_profile import DeviceProfile
+from shared.locator import Context, Locator
+from shared.wait_statistics import WaitStatistics
+
+PROBE_OUTPUT = ('google/panther/panther:14/UQ1A/1:user/release-keys\n'
+                'gms versionName=24.02.13\n'
+                'chrome versionName=120.0.6099.230\n')
+CAPABILITIES = dict(deviceUDID='serial', platformVersion='14', deviceManufacturer='Google', deviceModel='Pixel 7',
+                    deviceApiLevel=34)
+
+URL_BAR = Locator.by_id(Context.NATIVE, 'com.android.chrome:id/url_bar')
+MISSING = Locator.by_id(Context.NATIVE, 'com.android.chrome:id/missing')
+URL_BAR_OR_MISSING = URL_BAR | MISSING
+
+
+class FakeDriver:
+    """ Answers the probe of identify, or fails like a server without the adb_shell feature """
+
+    def __init__(self, output: str | None = PROBE_OUTPUT, capabilities: dict | None = None):
+        self.output = output
+        self.capabilities = capabilities or CAPABILITIES
+
+    def execute_script(self, script, args):
+        if self.output is None:
+            raise WebDriverException('adb_shell is not enabled')
+        return self.output
+
+
+def learned_profile() -> DeviceProfile:
+    profile = DeviceProfile()
+    profile.identify(FakeDriver())
+    profile.screen_size = dict(width=1080, height=2400)
+    profile.remember_variant(URL_BAR_OR_MISSING, URL_BAR)
+    return profile
+
+
+def test_identify_new_device():
+    profile = DeviceProfile()
+
+    assert not profile.identify(FakeDriver())
+
+    assert profile.serial == 'serial'
+    assert profile.fingerprint == 'google/panther/panther:14/UQ1A/1:user/release-keys'
+    assert (profile.android_version, profile.gms_version, profile.chrome_version) == \
+           ('14', '24.02.13', '120.0.6099.230')
+
+
+def test_identify_same_device():
+    profile = learned_profile()
+
+    assert profile.identify(FakeDriver())
+    assert profile.variant(URL_BAR_OR_MISSING) == URL_BAR
+
+
+def test_identify_after_update_clears():
+    profile = learned_profile()
+
+    assert not profile.identify(FakeDriver(PROBE_OUTPUT.replace('24.02.13', '24.06.15')))
+
+    assert profile.gms_version == '24.06.15'
+    assert profile.screen_size is None
+    assert profile.variant(URL_BAR_OR_MISSING) is None
+
+
+def test_identify_without_shell():
+    profile = DeviceProfile()
+    profile.identify(FakeDriver(None))
+
+    assert profile.fingerprint == 'Google/Pixel 7/14/34'
+    assert profile.gms_version is None
+    assert profile.identify(FakeDriver(None))
+
+
+def test_variant():
+    profile = DeviceProfile()
+
+    assert profile.variant(URL_BAR_OR_MISSING) is None
+    profile.remember_variant(URL_BAR_OR_MISSING, MISSING)
+    assert profile.variant(URL_BAR_OR_MISSING) == MISSING
+    profile.forget_variant(URL_BAR_OR_MISSING)
+    assert profile.variant(URL_BAR_OR_MISSING) is None
+    # A plain locator has no variants to choose from
+    assert profile.variant(URL_BAR) is None
+
+
+def test_stored_profile(tmp_path):
+    path = str(tmp_path / 'profile.json')
+    profile = learned_profile()
+    profile.path = path
+    profile.save()
+
+    stored = DeviceProfile(path)
+
+    assert stored.identify(FakeDriver())
+    assert stored.screen_size == profile.screen_size
+    assert stored.variant(URL_BAR_OR_MISSING) == URL_BAR
+
+
+def test_unknown_fields_are_ignored(tmp_path):
+    path = tmp_path / 'profile.json'
+    path.write_text(json.dumps(dict(serial='serial', path='/elsewhere.json', _clear=None)))
+
+    profile = DeviceProfile(str(path))
+
+    assert profile.serial == 'serial'
+    assert profile.path == str(path)
+    assert profile.variants == {}
+
+
+@pytest.fixture(scope='function')
+def profiled_controller(offline_controller) -> DriverController:
+    return DriverController(offline_controller.driver, wait_statistics=WaitStatistics(), device_profile=DeviceProfile())
+
+
+def test_wait_learns_variant(profiled_controller):
+    profiled_controller.wait_for_element(URL_BAR_OR_MISSING)
+
+    assert profiled_controller.device_profile.variant(URL_BAR_OR_MISSING) == URL_BAR
+
+
+def test_wait_falls_back_to_other_variants(profiled_controller):
+    profiled_controller.device_profile.remember_variant(URL_BAR_OR_MISSING, MISSING)
+
+    element = profiled_controller.wait_for_element(URL_BAR_OR_MISSING, timeout=0.5)
+
+    assert element.get_attribute('resource-id') == URL_BAR.value
+    assert profiled_controller.device_profile.variant(URL_BAR_OR_MISSING) == URL_BAR
+
+
+def test_fallback_keeps_deadline(profiled_controller):
+    missing = MISSING | Locator.by_id(Context.NATIVE, 'com.android.chrome:id/also_missing')
+    profiled_controller.device_profile.remember_variant(missing, MISSING)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutException):
+        profiled_controller.wait_for_element(missing, timeout=1)
+
+    # The remembered variant used up the timeout, the other alternatives aren't waited for again
+    assert time.monotonic() - start < 1.5
+    assert profiled_controller.device_profile.variant(missing) is None
@@ -0,0 +1,66 @@
+"""
+The device registry: which device a worker gets, and which relay boards devices can share.
+"""
+import pytest
+
+from shared.device_registry import DeviceConfig, DeviceRegistry
+
+
+def device(name: str, serial: str | None = 'A', channel: int = 1, backend: str = 'relayboard') -> DeviceConfig:
+    return DeviceConfig(name, relay_serial=serial, relay_channel=channel, relay_backend=backend)
+
+
+def test_for_worker():
+    registry = DeviceRegistry([device('first', 'A'), device('second', 'B')])
+
+    assert registry.for_worker('master').name == 'first'
+    assert registry.for_worker('gw0', 2).name == 'first'
+    assert registry.for_worker('gw1', 2).name == 'second'
+
+
+def test_worker_without_device():
+    registry = DeviceRegistry([device('first')])
+
+    with pytest.raises(ValueError, match="'gw1' has no device"):
+        registry.for_worker('gw1', 2)
+
+
+def test_same_channel_cannot_be_shared():
+    with pytest.raises(ValueError, match='share channel 1'):
+        DeviceRegistry([device('first', 'A', 1), device('second', 'A', 1)])
+
+
+def test_board_shared_on_other_channels():
+    registry = DeviceRegistry([device('first', 'A', 1), device('second', 'B', 1), device('spare', 'A', 2)])
+
+    # Only two workers, the spare device isn't used at the same time as the first one
+    assert registry.for_worker('gw1', 2).name == 'second'
+    with pytest.raises(ValueError, match="'first' and 'spare' share the relay board 'A'"):
+        registry.for_worker('gw2', 3)
+
+
+def test_first_board_is_shared_board():
+    registry = DeviceRegistry([device('first', None, 1), device('second', None, 2)])
+
+    with pytest.raises(ValueError, match='the first relay board'):
+        registry.for_worker('gw1', 2)
+
+
+def test_simulated_boards_are_not_shared():
+    registry = DeviceRegistry([device('first', None, 1, 'simulated'), device('second', None, 1, 'simulated')])
+
+    assert registry.for_worker('gw1', 2).name == 'second'
+
+
+def test_load(tmp_path):
+    path = tmp_path / 'devices.json'
+    path.write_text('{"devices": [{"name": "pixel", "udid": "serial", "system_port": 8200, '
+                    '"relay": {"serial": "A", "channel": 2}}]}')
+
+    registry = DeviceRegistry.load(str(path))
+
+    config = registry.for_worker('master')
+    assert (config.name, config.relay_serial, config.relay_channel, config.relay_backend) == \
+           ('pixel', 'A', 2, 'relayboard')
+    assert config.capabilities == dict(udid='serial', systemPort=8200)
+    assert DeviceRegistry.load(None).for_worker('master').name == 'default'
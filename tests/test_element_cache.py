@@ -0,0 +1,44 @@
+"""
+The element cache of DriverController, on the offline server: found elements are reused until the screen changes.
+"""
+from shared.locator import Context
+from webauthn.webauthn_data import WebAuthnLocators
+
+
+def test_repeated_wait_uses_cache(offline_server, offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    offline_controller.wait_for_element(WebAuthnLocators.REGISTER_BUTTON)
+    offline_server.command_count = 0
+    hits = offline_controller.cache_hits
+
+    offline_controller.click(WebAuthnLocators.REGISTER_BUTTON)
+
+    # The element found by the wait is clicked without looking it up again
+    assert offline_controller.cache_hits == hits + 1
+    assert offline_server.command_count == 1
+
+
+def test_stale_element_is_found_again(offline_scenario, offline_server, offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    offline_controller.wait_for_element(WebAuthnLocators.AUTHENTICATE_BUTTON)
+    # The page reloads behind the back of the controller, the cached element is gone
+    offline_scenario.page = 'registered'
+    offline_server.command_count = 0
+
+    offline_controller.click(WebAuthnLocators.AUTHENTICATE_BUTTON)
+
+    # Click the stale element, find it again and click it
+    assert offline_server.command_count == 3
+    assert offline_scenario.screen == 'key_pin_authenticate'
+
+
+def test_switching_context_clears_cache(offline_server, offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    offline_controller.wait_for_element(WebAuthnLocators.REGISTER_BUTTON)
+    misses = offline_controller.cache_misses
+
+    offline_controller.switch_context(Context.NATIVE)
+    offline_controller.switch_context(Context.WEB)
+    offline_controller.click(WebAuthnLocators.REGISTER_BUTTON)
+
+    assert offline_controller.cache_misses == misses + 1
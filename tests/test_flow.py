@@ -0,0 +1,81 @@
+"""
+Resuming a flow at the step the screen shows after a step failed, on the screens of the offline server.
+"""
+import pytest
+from selenium.common import TimeoutException
+
+from shared.flow import Flow, Step
+from shared.locator import Locator, Context
+from shared.passkey_data import PasskeyLocators
+from shared.passkey_util import HardwarePasskeyUtil
+
+# The address bar of Chrome, on screen whenever no sheet is shown
+CHROME = Locator.by_id(Context.NATIVE, 'com.android.chrome:id/url_bar')
+
+
+class TestFlowResume:
+    """ Resuming a flow at the step the screen shows, after a step failed """
+
+    @staticmethod
+    def _failing(exception: Exception):
+        def action():
+            raise exception
+        return action
+
+    def test_resumes_at_later_step(self, offline_controller):
+        done = []
+        flow = Flow(offline_controller, [
+            Step('first', lambda: done.append('first')),
+            Step('failing', self._failing(TimeoutException())),
+            Step('skipped', lambda: done.append('skipped')),
+            Step('on screen', lambda: done.append('on screen'), screen=CHROME),
+        ])
+
+        flow.run()
+
+        assert done == ['first', 'on screen']
+        assert flow.resumed_at == ['on screen']
+
+    def test_never_resumes_at_completed_step(self, offline_controller):
+        done = []
+        flow = Flow(offline_controller, [
+            Step('first', lambda: done.append('first'), screen=CHROME),
+            Step('failing', self._failing(TimeoutError())),
+        ])
+
+        with pytest.raises(TimeoutError):
+            flow.run()
+        assert done == ['first']
+        assert flow.resumed_at == []
+
+    def test_failure_screen_is_raised(self, offline_scenario, offline_controller):
+        offline_scenario.screen = 'key_pin_wrong_register'
+        flow = Flow(offline_controller, [
+            Step('failing', self._failing(TimeoutException()), failure=PasskeyLocators.PIN_ERROR_TEXT_KEY),
+            Step('pin', lambda: None, screen=PasskeyLocators.PIN_INPUT_FIELD_KEY),
+        ])
+
+        with pytest.raises(TimeoutException):
+            flow.run()
+        assert flow.resumed_at == []
+
+    def test_max_resumes(self, offline_controller):
+        flow = Flow(offline_controller, [Step('failing', self._failing(TimeoutException()), screen=CHROME)],
+                    max_resumes=2)
+
+        with pytest.raises(TimeoutException):
+            flow.run()
+        assert flow.resumed_at == ['failing', 'failing']
+
+    def test_resumes_at_credential_list(self, offline_scenario, offline_controller, offline_relay_board):
+        pk = HardwarePasskeyUtil(offline_controller, offline_relay_board)
+        offline_controller.open_url('https://webauthn.io')
+        # The key accepted the presence before the flow noticed, the list of credentials is shown
+        offline_scenario.screen = 'select_credential'
+        choose_credential = pk.discoverable_steps()[-1]
+        flow = Flow(offline_controller, [Step('user_presence', self._failing(TimeoutError())), choose_credential])
+
+        flow.run()
+
+        assert flow.resumed_at == ['choose_credential']
+        assert offline_scenario.page == 'logged_in'
@@ -0,0 +1,75 @@
+"""
+Swipes and scrolling of DriverController, on the offline server.
+"""
+import pytest
+from selenium.common import NoSuchElementException
+
+from shared.locator import Context, Locator
+
+URL_BAR = Locator.by_id(Context.NATIVE, 'com.android.chrome:id/url_bar')
+
+
+@pytest.fixture(scope='function')
+def native_controller(offline_server, offline_controller):
+    """ A controller on the native screen, with the screen size known, and no commands counted yet """
+    offline_controller.switch_context(Context.NATIVE)
+    assert offline_controller.device_size
+    offline_server.command_count = 0
+    return offline_controller
+
+
+def test_swipes_in_one_request(offline_server, native_controller):
+    native_controller.swipe_paths([[(0.5, 0.8), (0.5, 0.5), (0.5, 0.2)], [(0.2, 0.5), (0.8, 0.5)]], duration=100)
+
+    assert offline_server.command_count == 1
+    [finger] = offline_server.performed_actions[0]
+    steps = [(action['type'], action.get('x'), action.get('y')) for action in finger['actions']]
+    assert steps == [
+        ('pointerMove', 540, 1920), ('pointerDown', None, None),
+        ('pointerMove', 540, 1200), ('pointerMove', 540, 480), ('pointerUp', None, None),
+        ('pointerMove', 216, 1200), ('pointerDown', None, None),
+        ('pointerMove', 864, 1200), ('pointerUp', None, None),
+    ]
+    # Every swipe starts where it is put down, and takes the duration for every segment after that
+    moves = [action for action in finger['actions'] if action['type'] == 'pointerMove']
+    assert [move['duration'] for move in moves] == [0, 100, 100, 0, 100]
+
+
+def test_swipe_clears_element_cache(native_controller):
+    native_controller.wait_for_element(URL_BAR)
+    misses = native_controller.cache_misses
+
+    native_controller.swipe_percent(0.5, 0.8, 0.5, 0.2)
+    native_controller.click(URL_BAR)
+
+    assert native_controller.cache_misses == misses + 1
+
+
+def test_scroll_to_ui_selector(offline_server, native_controller):
+    element = native_controller.scroll_to(URL_BAR)
+
+    # UiAutomator2 scrolls to the element and finds it, in a single lookup
+    assert offline_server.command_count == 1
+    assert element.get_attribute('resource-id') == URL_BAR.value
+    hits = native_controller.cache_hits
+    native_controller.click(URL_BAR)
+    assert native_controller.cache_hits == hits + 1
+
+
+def test_scroll_to_other_locator(offline_server, native_controller):
+    url_bar = Locator.by_xpath(Context.NATIVE, '//*[@resource-id="com.android.chrome:id/url_bar"]/..//*[@text!=""]')
+    assert url_bar.to_ui_automator() is None
+
+    native_controller.scroll_to(url_bar)
+
+    assert offline_server.command_count == 1
+
+
+def test_scroll_to_missing_element(offline_server, native_controller):
+    missing = Locator.by_xpath(Context.NATIVE, '//*[@text="Not on this screen"]/..')
+
+    with pytest.raises(NoSuchElementException):
+        native_controller.scroll_to(missing)
+
+    # Look for it, scroll once and find out there is nothing more to scroll to, look for it a last time
+    assert offline_server.command_count == 3
@@ -0,0 +1,127 @@
+"""
+Locators and their translation to XPath, against the recorded hierarchies the offline server replays.
+What the offline server finds has to match what UiAutomator2 finds, or the flow benchmarks measure the wrong thing.
+"""
+import copy
+import pickle
+
+import pytest
+from appium.webdriver.common.appiumby import AppiumBy
+
+from offline.scenario import load_recording
+from shared import ui_selector
+from shared.locator import Locator, CompositeLocator, Context
+from shared.passkey_data import PasskeyLocators
+from shared.snapshot import HierarchySnapshot
+
+
+@pytest.fixture(scope='module')
+def credential_sheet() -> HierarchySnapshot:
+    return HierarchySnapshot(Context.NATIVE, load_recording('select_credential.xml'))
+
+
+@pytest.mark.parametrize('selector, xpath', [
+    ('new UiSelector().text("Create a passkey")', '//*[@text="Create a passkey"]'),
+    ('new UiSelector().textContains("passkey")', '//*[contains(@text, "passkey")]'),
+    ('new UiSelector().className("android.widget.Button").instance(2)', '(//*[@class="android.widget.Button"])[3]'),
+    ('new UiSelector().resourceId("a:id/b").clickable(true)', '//*[@resource-id="a:id/b"][@clickable="true"]'),
+    ('new UiSelector().text("a; b"); new UiSelector().index(0)', '//*[@text="a; b"] | //*[@index="0"]'),
+    ('new UiSelector().text("say \\"hi\\"")', "//*[@text='say \"hi\"']"),
+    ('new UiScrollable(new UiSelector().scrollable(true)).scrollIntoView(new UiSelector().text("x"))',
+     '//*[@text="x"]'),
+])
+def test_ui_selector_to_xpath(selector, xpath):
+    assert ui_selector.to_xpath(selector) == xpath
+
+
+@pytest.mark.parametrize('selector', [
+    'new UiSelector().childSelector(new UiSelector().text("x"))',
+    'new UiSelector().text("x").fromParent(new UiSelector())',
+    'UiSelector().text("x")',
+])
+def test_ui_selector_unsupported(selector):
+    assert ui_selector.to_xpath(selector) is None
+
+
+def test_xpath_literal_with_both_quotes():
+    assert ui_selector.xpath_literal('a"b\'c') == 'concat("a", \'"\', "b\'c")'
+
+
+def test_factories_return_same_locator():
+    assert Locator.by_text(Context.NATIVE, 'x') is Locator.by_text(Context.NATIVE, 'x')
+    assert Locator.by_attributes(Context.WEB, dict(id='a')) is Locator.by_attributes(Context.WEB, dict(id='a'))
+
+
+def test_locator_is_value():
+    locator = Locator(Context.NATIVE, AppiumBy.ID, 'a:id/b')
+    assert locator == Locator.by_id(Context.NATIVE, 'a:id/b')
+    assert locator != Locator.by_id(Context.WEB, 'a:id/b')
+    assert {locator: 1}[Locator.by_id(Context.NATIVE, 'a:id/b')] == 1
+    assert locator.key == 'NATIVE_APP:id=a:id/b'
+    with pytest.raises(AttributeError):
+        locator.value = 'other'
+
+
+@pytest.mark.parametrize('locator', [
+    Locator.by_text(Context.NATIVE, 'x'),
+    PasskeyLocators.CREATE_PASSKEY_TEXT,
+    Locator.by_id(Context.WEB, 'a') | Locator.by_button_text(Context.WEB, 'b'),
+], ids=['plain', 'native composite', 'web composite'])
+def test_locator_copy_and_pickle(locator):
+    assert copy.copy(locator) is locator
+    assert copy.deepcopy(dict(locator=locator))['locator'] is locator
+    unpickled = pickle.loads(pickle.dumps(locator))
+    assert unpickled == locator
+    assert type(unpickled) is type(locator)
+    assert unpickled.alternatives == locator.alternatives
+
+
+def test_composite_differs_from_plain_locator():
+    plain = Locator.by_id(Context.NATIVE, 'a:id/b')
+    composite = CompositeLocator([plain])
+    assert composite.value == plain.value
+    assert composite != plain
+    assert len({plain, composite}) == 2
+
+
+def test_composite_merges_into_ui_selectors():
+    composite = PasskeyLocators.CONFIRM_BUTTON | PasskeyLocators.CREATE_PASSKEY_TEXT_2
+    assert composite.by == AppiumBy.ANDROID_UIAUTOMATOR
+    assert composite.value == ('new UiSelector().resourceId("com.google.android.gms:id/confirmButton"); '
+                               'new UiSelector().text("Create a passkey")')
+    assert composite.alternatives == (PasskeyLocators.CONFIRM_BUTTON, PasskeyLocators.CREATE_PASSKEY_TEXT_2)
+
+
+def test_composite_with_xpath_merges_into_union():
+    composite = Locator.any_of(PasskeyLocators.CONFIRM_BUTTON, Locator.by_xpath(Context.NATIVE, '//a'))
+    assert composite.by == AppiumBy.XPATH
+    assert composite.value == '//*[@resource-id="com.google.android.gms:id/confirmButton"] | //a'
+
+
+def test_composite_of_composites_is_flat():
+    composite = PasskeyLocators.CREATE_PASSKEY_TEXT | PasskeyLocators.CONFIRM_BUTTON
+    assert composite.alternatives == (*PasskeyLocators.CREATE_PASSKEY_TEXT.alternatives, PasskeyLocators.CONFIRM_BUTTON)
+
+
+def test_composite_errors():
+    with pytest.raises(ValueError):
+        CompositeLocator([])
+    with pytest.raises(NotImplementedError):
+        Locator.any_of(Locator.by_id(Context.NATIVE, 'a'), Locator.by_id(Context.WEB, 'b'))
+    with pytest.raises(NotImplementedError):
+        Locator.any_of(Locator.by_link_text(Context.WEB, 'a'), Locator(Context.WEB, AppiumBy.CSS_SELECTOR, 'b'))
+
+
+def test_snapshot_finds_credential(credential_sheet):
+    assert credential_sheet.is_present(PasskeyLocators.CHOOSE_PASSKEY_TEXT)
+    assert credential_sheet.are_present([PasskeyLocators.CHOOSE_PASSKEY_TEXT, PasskeyLocators.CONFIRM_BUTTON]) == \
+        [True, False]
+
+
+def test_snapshot_finds_composite_once(credential_sheet):
+    # Every alternative of a composite locator is evaluated in turn, an element several of them match is found once
+    buttons = Locator.by_xpath(Context.NATIVE, '//*[@clickable="true"]')
+    everything = Locator.by_xpath(Context.NATIVE, '//*')
+    found = credential_sheet.find_all(buttons | everything)
+    assert len(found) == len(credential_sheet.find_all(everything))
+    assert found[:len(credential_sheet.find_all(buttons))] == credential_sheet.find_all(buttons)
@@ -0,0 +1,48 @@
+"""
+The offline Appium server and its webauthn.io scenario, which the benchmarks and the other framework tests run on.
+"""
+import time
+
+import pytest
+from selenium.common import WebDriverException
+
+from offline.server import OfflineAppiumServer, WebDriverError
+from shared.passkey_util import HardwarePasskeyUtil
+from webauthn.webauthn_util import WebauthnUtil
+
+
+def test_wrong_key_pin_is_reported(offline_scenario, offline_controller, offline_relay_board):
+    wa = WebauthnUtil(offline_controller, use_scripts=False)
+    pk = HardwarePasskeyUtil(offline_controller, offline_relay_board)
+    wa.open_page()
+    wa.fill_username()
+    wa.click_register_button()
+    pk.do_registration_flow_until_pin_input()
+
+    pk.enter_pin('0000')
+
+    assert pk.wait_for_pin_error_text()
+    assert offline_scenario.screen == 'key_pin_wrong_register'
+
+
+def test_unsupported_command(offline_server):
+    with pytest.raises(WebDriverError) as error:
+        offline_server.handle('GET', '/session/unknown/orientation', {})
+    assert error.value.status == 404
+
+
+def test_stale_element(offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    element = offline_controller.driver.find_element('xpath', '//button[@id="register-button"]')
+    offline_controller.open_url('about:blank')
+
+    with pytest.raises(WebDriverException, match='stale'):
+        element.click()
+
+
+def test_latency_per_command(offline_scenario):
+    with OfflineAppiumServer(offline_scenario, latency=dict(status=0.1)) as server:
+        start = time.monotonic()
+        server.handle('GET', '/status', {})
+        assert time.monotonic() - start >= 0.1
+        assert server.command_count == 1
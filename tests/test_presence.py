@@ -0,0 +1,96 @@
+"""
+The calibration of the readiness delay of a security key, and pressing its button on the offline server.
+"""
+import pytest
+
+from shared.passkey_util import HardwarePasskeyUtil, DEFAULT_KEY_PIN
+from shared.presence import PresenceCalibration, PresenceController
+from webauthn.webauthn_util import WebauthnUtil
+
+
+def calibrate(calibration: PresenceCalibration, ready_after: float, runs: int) -> int:
+    """ Press a key that is ready this long after its prompt a number of times, like the tests do, count the retries """
+    retries = 0
+    for _ in range(runs):
+        if calibration.readiness_delay >= ready_after:
+            calibration.accepted(calibration.readiness_delay)
+        else:
+            retries += 1
+            calibration.rejected()
+    return retries
+
+
+def test_calibration_converges():
+    calibration = PresenceCalibration(readiness_delay=1.0)
+
+    retries = calibrate(calibration, 0.72, 50)
+
+    # It steps down until a press is ignored once, then stays at the last delay that was accepted
+    assert retries == 1
+    assert calibration.readiness_delay == pytest.approx(0.75)
+    assert calibrate(calibration, 0.72, 10) == 0
+    assert calibration.readiness_delay == pytest.approx(0.75)
+
+
+def test_calibration_follows_slower_key():
+    calibration = PresenceCalibration(readiness_delay=0.5)
+    calibrate(calibration, 0.5, 10)
+
+    calibrate(calibration, 0.8, 20)
+
+    # Every ignored press raises the delay until the key accepts it again
+    assert calibration.readiness_delay >= 0.8
+    assert calibrate(calibration, 0.8, 10) == 0
+
+
+def test_calibration_is_stored(tmp_path):
+    path = str(tmp_path / 'presence.json')
+    calibration = PresenceCalibration(path)
+    calibrate(calibration, 0.72, 50)
+    calibration.save()
+
+    stored = PresenceCalibration(path)
+
+    assert stored.readiness_delay == pytest.approx(calibration.readiness_delay)
+    assert calibrate(stored, 0.72, 10) == 0
+
+
+@pytest.fixture(scope='function')
+def prompt(offline_controller, offline_relay_board) -> HardwarePasskeyUtil:
+    """ Register with the security key up to the prompt asking for user presence """
+    wa = WebauthnUtil(offline_controller, use_scripts=False)
+    pk = HardwarePasskeyUtil(offline_controller, offline_relay_board)
+    wa.open_page()
+    wa.fill_username()
+    wa.click_register_button()
+    pk.do_registration_flow_until_pin_input()
+    pk.enter_pin(DEFAULT_KEY_PIN)
+    return pk
+
+
+def test_press_retries_until_accepted(offline_scenario, offline_controller, offline_relay_board, prompt):
+    # The simulated key needs half a second, a press right away is ignored
+    calibration = PresenceCalibration(readiness_delay=0.0)
+    presence = PresenceController(offline_controller, offline_relay_board, calibration=calibration, retry_after=0.3)
+    presence.wait_for_prompt()
+
+    presence.press()
+
+    assert len(offline_scenario.relay_presses) >= 2
+    assert offline_scenario.page == 'registered'
+    assert calibration.readiness_delay > 0.0
+    assert presence.prompt_appeared_at is None
+
+
+def test_press_gives_up(offline_scenario, offline_controller, offline_relay_board, prompt):
+    calibration = PresenceCalibration(readiness_delay=0.0)
+    presence = PresenceController(offline_controller, offline_relay_board, calibration=calibration, retry_after=0.1)
+    presence.wait_for_prompt()
+
+    with pytest.raises(TimeoutError):
+        presence.press(max_attempts=2)
+
+    assert len(offline_scenario.relay_presses) == 2
+    assert offline_scenario.screen == 'connect_key_register'
+    assert calibration.readiness_delay == 0.0
+    assert presence.prompt_appeared_at is None
@@ -0,0 +1,47 @@
+"""
+The relay backends that drive an FTDI chip in bit-bang mode, without the chip.
+"""
+import pytest
+
+from shared.relay import BitBangRelayBackend
+
+
+class RecordingBackend(BitBangRelayBackend):
+    """ Remembers the states written to the pins of the chip """
+
+    def __init__(self):
+        super().__init__()
+        self.states: list[int] = []
+        self.closed = False
+
+    def _write(self, state: int) -> None:
+        self.states.append(state)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_switch_relay_sets_pin_of_channel():
+    backend = RecordingBackend()
+
+    backend.switch_relay(3, 0)
+
+    assert backend.states == [0b100, 0]
+
+
+def test_backend_without_write_cannot_be_created():
+    class WithoutWrite(BitBangRelayBackend):
+        def close(self) -> None:
+            pass
+
+    with pytest.raises(TypeError, match='_write'):
+        WithoutWrite()
+
+
+def test_backend_without_close_cannot_be_created():
+    class WithoutClose(BitBangRelayBackend):
+        def _write(self, state: int) -> None:
+            pass
+
+    with pytest.raises(TypeError, match='close'):
+        WithoutClose()
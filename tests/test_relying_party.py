@@ -0,0 +1,142 @@
+"""
+The local relying party over HTTP, with the client data a browser would send, as the page's script does.
+"""
+import base64
+import http.client
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webauthn.relying_party import LocalRelyingParty
+from webauthn.webauthn_data import WebAuthnText
+
+USERNAME = 'alice'
+CREDENTIAL_ID = 'Y3JlZGVudGlhbA'
+
+
+class Client:
+    """ Calls the relying party the way the script of its page does """
+
+    def __init__(self, relying_party: LocalRelyingParty):
+        self.relying_party = relying_party
+        self.base = f'http://127.0.0.1:{relying_party.port}'
+        self.origin = f'http://localhost:{relying_party.port}'
+
+    def post(self, path: str, body: dict) -> tuple[int, dict, dict]:
+        """ :return: The status, the JSON body and the headers of the response. """
+        request = urllib.request.Request(self.base + path, data=json.dumps(body).encode(), method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read()), dict(response.headers)
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read()), dict(e.headers)
+
+    def page(self, path: str, cookie: str) -> str:
+        request = urllib.request.Request(self.base + path, headers={'Cookie': cookie})
+        with urllib.request.urlopen(request) as response:
+            return response.read().decode()
+
+    def client_data(self, challenge: str, kind: str, origin: str | None = None) -> str:
+        client_data = dict(type=f'webauthn.{kind}', challenge=challenge, origin=origin or self.origin)
+        return base64.urlsafe_b64encode(json.dumps(client_data).encode()).rstrip(b'=').decode()
+
+    def register(self, username: str = USERNAME, credential_id: str = CREDENTIAL_ID) -> tuple[int, dict]:
+        _, options, _ = self.post('/registration/options', dict(username=username))
+        status, value, _ = self.post('/registration/verify', dict(
+            username=username, id=credential_id, clientDataJSON=self.client_data(options['challenge'], 'create')))
+        return status, value
+
+
+@pytest.fixture(scope='function')
+def client() -> Client:
+    with LocalRelyingParty(port=0) as relying_party:
+        yield Client(relying_party)
+
+
+def test_register_and_authenticate(client):
+    assert client.register() == (200, dict(verified=True))
+    status, options, _ = client.post('/authentication/options', dict(username=USERNAME))
+    assert status == 200
+    assert options['allowCredentials'] == [dict(type='public-key', id=CREDENTIAL_ID)]
+
+    status, _, headers = client.post('/authentication/verify', dict(
+        id=CREDENTIAL_ID, clientDataJSON=client.client_data(options['challenge'], 'get')))
+
+    assert status == 200
+    cookie = headers['Set-Cookie'].split(';')[0]
+    assert cookie == f'username={USERNAME}'
+    page = client.page('/logged-in', cookie)
+    assert f'data-id="{CREDENTIAL_ID}"' in page
+
+
+def test_registered_credential_is_excluded(client):
+    client.register()
+
+    _, options, _ = client.post('/registration/options', dict(username=USERNAME))
+
+    assert options['excludeCredentials'] == [dict(type='public-key', id=CREDENTIAL_ID)]
+
+
+def test_reset(client):
+    client.register()
+    client.register('bob', 'Ym9i')
+
+    status, _, _ = client.post(f'/reset?username={USERNAME}', {})
+
+    assert status == 200
+    assert client.relying_party.credentials == {'Ym9i': 'bob'}
+    status, value, _ = client.post('/authentication/options', dict(username=USERNAME))
+    assert (status, value) == (400, dict(error=WebAuthnText.NO_CREDENTIALS))
+    client.post('/reset', {})
+    assert client.relying_party.credentials == {}
+
+
+def test_unknown_challenge_is_rejected(client):
+    status, value, _ = client.post('/registration/verify', dict(
+        username=USERNAME, id=CREDENTIAL_ID, clientDataJSON=client.client_data('bm90LWlzc3VlZA', 'create')))
+
+    assert (status, value) == (400, dict(error=WebAuthnText.UNKNOWN_EXCEPTION))
+    assert client.relying_party.credentials == {}
+
+
+def test_challenge_is_used_once(client):
+    _, options, _ = client.post('/registration/options', dict(username=USERNAME))
+    body = dict(username=USERNAME, id=CREDENTIAL_ID, clientDataJSON=client.client_data(options['challenge'], 'create'))
+
+    assert client.post('/registration/verify', body)[0] == 200
+    assert client.post('/registration/verify', body)[0] == 400
+
+
+def test_other_origin_is_rejected(client):
+    _, options, _ = client.post('/registration/options', dict(username=USERNAME))
+
+    status, _, _ = client.post('/registration/verify', dict(
+        username=USERNAME, id=CREDENTIAL_ID,
+        clientDataJSON=client.client_data(options['challenge'], 'create', origin='https://evil.example')))
+
+    assert status == 400
+    assert client.relying_party.credentials == {}
+
+
+def test_registration_challenge_cannot_authenticate(client):
+    client.register()
+    _, options, _ = client.post('/registration/options', dict(username=USERNAME))
+
+    status, _, headers = client.post('/authentication/verify', dict(
+        id=CREDENTIAL_ID, clientDataJSON=client.client_data(options['challenge'], 'get')))
+
+    assert status == 400
+    assert 'Set-Cookie' not in headers
+
+
+def test_logged_in_page_needs_login(client):
+    connection = http.client.HTTPConnection('127.0.0.1', client.relying_party.port)
+    connection.request('GET', '/logged-in')
+    response = connection.getresponse()
+
+    assert response.status == 303
+    assert response.getheader('Location') == '/'
+    connection.close()
@@ -0,0 +1,121 @@
+"""
+Ordering the tests and splitting them into work units, on stand-ins for collected tests so no test module is needed.
+"""
+from types import SimpleNamespace
+
+import pytest
+from xdist.scheduler import LoadGroupScheduling
+
+from shared.scheduling import DurationHistory, order_items, assign_work_units, group_of, strip_group, keep_unit_order
+
+
+class FakeItem:
+    """ The parts of a pytest.Item the scheduling looks at """
+
+    def __init__(self, name: str, fixtures: tuple[str, ...] = (), markers: tuple[str, ...] = ()):
+        self.nodeid = f'webauthn/test_fake.py::{name}'
+        self.fixturenames = list(fixtures)
+        self.markers = {marker: getattr(pytest.mark, marker) for marker in markers}
+
+    def get_closest_marker(self, name: str):
+        return self.markers.get(name)
+
+    def add_marker(self, marker) -> None:
+        self.markers[marker.name] = marker
+
+    def __repr__(self) -> str:
+        return self.nodeid.rsplit('::', 1)[1]
+
+
+@pytest.fixture(scope='function')
+def history() -> DurationHistory:
+    return DurationHistory(None)
+
+
+def test_group_of():
+    assert group_of(FakeItem('a', ('wa_util', 'pk_util'), ('browser',))) == 'browser-hardware-web'
+    assert group_of(FakeItem('b', ('local_pk_util',))) == 'native-device-native'
+    assert group_of(FakeItem('c')) == 'native-none-native'
+
+
+def test_order_by_group_with_slow_last():
+    hardware = FakeItem('hardware', ('wa_util', 'pk_util'), ('browser',))
+    slow = FakeItem('slow', ('wa_util', 'pk_util'), ('browser', 'slow'))
+    device = FakeItem('device', ('wa_util', 'local_pk_util'), ('browser',))
+    hardware_2 = FakeItem('hardware_2', ('wa_util', 'pk_util'), ('browser',))
+
+    assert order_items([hardware, slow, device, hardware_2]) == [hardware, hardware_2, device, slow]
+
+
+def test_registered_passkey_reused_before_it_is_changed():
+    deletes = FakeItem('deletes', ('registered_key',), ('mutates_credentials',))
+    uses = FakeItem('uses', ('registered_key',))
+    registers = FakeItem('registers', ('pk_util',))
+
+    assert order_items([deletes, registers, uses]) == [uses, registers, deletes]
+
+
+class FakeNode:
+    """ A pytest-xdist worker that remembers the tests it was sent """
+
+    def __init__(self):
+        self.sent: list[int] = []
+        self.shutting_down = False
+
+    def send_runtest_some(self, indexes: list[int]) -> None:
+        self.sent.extend(indexes)
+
+
+def _work_unit_items(history: DurationHistory) -> list[FakeItem]:
+    """ Four short hardware tests, one long device test and a slow test """
+    items = [FakeItem(f'hardware_{index}', ('pk_util',)) for index in range(4)] + \
+            [FakeItem('device', ('local_pk_util',)), FakeItem('slow', ('pk_util',), ('slow',))]
+    history.durations = {item.nodeid: 10.0 for item in items}
+    history.durations[items[4].nodeid] = 30.0
+    return items
+
+
+def test_work_units_longest_first(history):
+    items = _work_unit_items(history)
+
+    ordered = assign_work_units(items, history, workers=2)
+
+    units = [item.get_closest_marker('xdist_group').args[0] for item in ordered]
+    # The device test is the longest unit, the hardware tests are split in units of their share of the work and the
+    # slow test comes last, as a unit of its own
+    assert ordered[0] is items[4]
+    assert ordered[-1] is items[5]
+    assert len(set(units)) == len(units) == 6
+    assert units == sorted(units)
+
+
+def test_units_dispatched_in_order(history):
+    items = _work_unit_items(history)
+    # Short hardware tests share a unit, which has more tests than the longer unit of the device test
+    history.durations.update({item.nodeid: 2.0 for item in items[:4]})
+    ordered = assign_work_units(items, history, workers=2)
+    assert len(set(item.get_closest_marker('xdist_group').args[0] for item in ordered)) < len(ordered)
+    # The node ids as pytest-xdist makes them with --dist loadgroup
+    collection = [f"{item.nodeid}@{item.get_closest_marker('xdist_group').args[0]}" for item in ordered]
+    option = SimpleNamespace(dist='loadgroup', loadscopereorder=True, tx=['popen'])
+    keep_unit_order(option)
+    scheduler = LoadGroupScheduling(SimpleNamespace(option=option, getvalue=lambda name: getattr(option, name)))
+    node = FakeNode()
+    scheduler.add_node(node)
+    scheduler.add_node_collection(node, collection)
+
+    scheduler.schedule()
+
+    # The first units are sent right away, the rest waits in the queue in the order they are handed out
+    dispatched = [collection[index] for index in node.sent]
+    dispatched += [nodeid for unit in scheduler.workqueue.values() for nodeid in unit]
+    assert dispatched == collection
+
+
+@pytest.mark.parametrize('nodeid, stripped', [
+    ('a/test_b.py::test_c@001-native-none-native', 'a/test_b.py::test_c'),
+    ('a/test_b.py::test_c[x@y]', 'a/test_b.py::test_c[x@y]'),
+    ('a/test_b.py::test_c[x@y]@002-group', 'a/test_b.py::test_c[x@y]'),
+])
+def test_strip_group(nodeid, stripped):
+    assert strip_group(nodeid) == stripped
@@ -0,0 +1,140 @@
+"""
+The screen recorder, with a fake adb: one that answers with canned output, and one that runs the recording loop on
+this machine with a fake screenrecord, so the ring buffer rotates like it does on a device.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from shared import screen_recording
+from shared.screen_recording import ScreenRecorder
+
+# Runs the shell commands of adb on this machine, the files of the device are in the temporary directory of the test
+FAKE_ADB = f'''#!{sys.executable}
+import subprocess, sys
+args = sys.argv[1:]
+if args[0] == '-s':
+    args = args[2:]
+if args[0] == 'shell':
+    sys.exit(subprocess.run(['sh', '-c', ' '.join(args[1:])]).returncode)
+if args[0] == 'exec-out':
+    sys.exit(subprocess.run(args[1:]).returncode)
+sys.exit(1)
+'''
+
+# Records nothing, but creates the segment when it starts and writes it when it ends, like screenrecord does
+FAKE_SCREENRECORD = f'''#!{sys.executable}
+import sys, time
+limit, path = int(sys.argv[sys.argv.index('--time-limit') + 1]), sys.argv[-1]
+open(path, 'wb').close()
+try:
+    time.sleep(limit)
+except KeyboardInterrupt:
+    pass
+with open(path, 'wb') as file:
+    file.write(path.encode())
+'''
+
+
+class FakeAdb:
+    """ Stands in for subprocess.run, records the adb commands and answers them with canned output """
+
+    def __init__(self, *outputs: str):
+        self.outputs = list(outputs)
+        self.commands: list[list[str]] = []
+
+    def __call__(self, command, **kwargs):
+        self.commands.append(command)
+        if command[-3:-1] == ['exec-out', 'cat']:
+            return subprocess.CompletedProcess(command, 0, command[-1].encode())
+        return subprocess.CompletedProcess(command, 0, self.outputs.pop(0).encode())
+
+
+def stat_output(now: int, ended: dict[int, int]) -> str:
+    """ The output of the collect command, for the segments and when they ended """
+    return f'{now}\n' + ''.join(f'{mtime} /rec/{number}.mp4\n' for number, mtime in ended.items())
+
+
+@pytest.fixture(scope='function')
+def adb(monkeypatch) -> FakeAdb:
+    adb = FakeAdb('4242\n')
+    monkeypatch.setattr(screen_recording.subprocess, 'run', adb)
+    return adb
+
+
+def test_start(adb):
+    recorder = ScreenRecorder('serial', '/rec/', segment_seconds=15, segments=8)
+
+    assert recorder.start()
+
+    assert recorder.recording
+    assert adb.commands[0][:4] == ['adb', '-s', 'serial', 'shell']
+    assert 'rm -f /rec/$((i - 8)).mp4' in adb.commands[0][4]
+    assert '--time-limit 15 /rec/$i.mp4' in adb.commands[0][4]
+
+
+def test_start_without_adb(monkeypatch):
+    def missing(command, **kwargs):
+        raise FileNotFoundError(command[0])
+    monkeypatch.setattr(screen_recording.subprocess, 'run', missing)
+    recorder = ScreenRecorder(None)
+
+    assert not recorder.start()
+    assert not recorder.recording
+    assert recorder.collect(60) == []
+
+
+def test_collect_segments_of_test(adb):
+    recorder = ScreenRecorder(None, '/rec', segment_seconds=15, segments=8)
+    recorder.start()
+    adb.outputs.append(stat_output(1000, {3: 955, 4: 970, 5: 985, 6: 1000}))
+
+    segments = recorder.collect(35)
+
+    # Segment 3 ended before the test started, segment 6 was just started by interrupting segment 5
+    assert segments == [b'/rec/4.mp4', b'/rec/5.mp4']
+    assert 'pkill -INT -P 4242 screenrecord' in adb.commands[1][2]
+
+
+def test_collect_skips_oldest_of_full_ring(adb):
+    recorder = ScreenRecorder(None, '/rec', segment_seconds=15, segments=3)
+    recorder.start()
+    adb.outputs.append(stat_output(1000, {7: 970, 8: 985, 9: 1000}))
+
+    # The oldest segment is removed by the loop when the next one starts, it could be gone while it is pulled
+    assert recorder.collect(60) == [b'/rec/8.mp4']
+
+
+def test_collect_without_finished_segment(adb):
+    recorder = ScreenRecorder(None, '/rec')
+    recorder.start()
+    adb.outputs.append(stat_output(1000, {0: 1000}))
+
+    assert recorder.collect(60) == []
+
+
+def test_ring_buffer(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for name, script in [('adb', FAKE_ADB), ('screenrecord', FAKE_SCREENRECORD)]:
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    directory = tmp_path / 'recordings'
+    recorder = ScreenRecorder(None, str(directory), segment_seconds=1, segments=3)
+
+    assert recorder.start()
+    try:
+        time.sleep(4.5)
+        segments = recorder.collect(60)
+        # The segments that fell out of the ring are removed, the one being recorded is part of it
+        assert len(list(directory.glob('*.mp4'))) <= 3
+        assert not (directory / '0.mp4').exists()
+    finally:
+        recorder.stop()
+
+    assert segments and all(segment.startswith(str(directory).encode()) for segment in segments)
+    assert not directory.exists()
@@ -0,0 +1,69 @@
+"""
+The session pool against the offline server: sessions are reused while the capabilities stay the same, and there is
+never more than one session on the device.
+"""
+import threading
+import time
+
+from offline.fixtures import offline_capabilities
+
+native_capabilities = {key: value for key, value in offline_capabilities.items() if key != 'browserName'}
+
+
+def test_reuses_session(offline_server, offline_session_pool):
+    session = offline_session_pool.acquire(offline_capabilities)
+    offline_session_pool.release(session)
+    offline_server.command_count = 0
+
+    assert offline_session_pool.acquire(offline_capabilities) is session
+    # Only the health check reaches the server
+    assert offline_server.command_count == 1
+    assert len(offline_server.sessions) == 1
+
+
+def test_other_capabilities_end_idle_session(offline_server, offline_session_pool):
+    browser = offline_session_pool.acquire(offline_capabilities)
+    offline_session_pool.release(browser)
+
+    native = offline_session_pool.acquire(native_capabilities)
+
+    assert native is not browser
+    assert list(offline_server.sessions) == [native.driver.session_id]
+
+
+def test_dead_session_is_replaced(offline_server, offline_session_pool):
+    session = offline_session_pool.acquire(offline_capabilities)
+    offline_session_pool.release(session)
+    offline_server.sessions.clear()
+
+    assert offline_session_pool.acquire(offline_capabilities) is not session
+    assert len(offline_server.sessions) == 1
+
+
+def test_unreusable_session_is_ended(offline_server, offline_session_pool):
+    session = offline_session_pool.acquire(offline_capabilities)
+    offline_session_pool.release(session, reusable=False)
+
+    assert not offline_server.sessions
+    assert offline_session_pool.acquire(offline_capabilities) is not session
+
+
+def test_release_resets_session(offline_scenario, offline_session_pool):
+    session = offline_session_pool.acquire(offline_capabilities)
+    session.controller.open_url('https://webauthn.io')
+
+    offline_session_pool.release(session)
+
+    assert offline_scenario.page == 'blank'
+
+
+def test_acquire_waits_for_hold(offline_session_pool):
+    offline_session_pool.release(offline_session_pool.acquire(offline_capabilities))
+    release_device = offline_session_pool.hold()
+    timer = threading.Timer(0.2, release_device)
+
+    start = time.monotonic()
+    timer.start()
+    offline_session_pool.acquire(offline_capabilities)
+
+    assert time.monotonic() - start >= 0.2
@@ -0,0 +1,60 @@
+"""
+The connection pool shared by the sessions on an Appium server, and the bytes it counts per command.
+"""
+from appium.webdriver.client_config import AppiumClientConfig
+
+from shared.locator import Context
+from shared.transport import POOL_SIZE, PooledConnection, TransportStatistics, statistics_for
+
+
+def test_statistics_summary():
+    statistics = TransportStatistics()
+    statistics.record('findElement', 60, 100, 0.01)
+    statistics.record('findElement', 60, 100, 0.03)
+    statistics.record('getPageSource', 0, 5000, 0.1)
+
+    summary = statistics.summary()
+
+    assert [row['command'] for row in summary] == ['getPageSource', 'findElement']
+    assert summary[1]['requests'] == 2
+    assert summary[1]['bytes_sent'] == 120
+    assert round(summary[1]['mean_ms']) == 20
+    assert statistics.requests == 3
+    assert statistics.bytes_received == 5200
+
+
+def test_bytes_counted_per_command(offline_server, offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    offline_controller.switch_context(Context.NATIVE)
+    statistics = statistics_for(offline_server.url)
+    statistics.reset()
+
+    page_source = offline_controller.driver.page_source
+    offline_controller.driver.find_element('id', 'com.android.chrome:id/url_bar')
+
+    rows = {row['command']: row for row in statistics.summary()}
+    assert rows['getPageSource']['requests'] == 1
+    assert rows['getPageSource']['bytes_sent'] == 0
+    # The hierarchy is gzipped on the wire
+    assert 0 < rows['getPageSource']['bytes_received'] < len(page_source.encode())
+    assert rows['findElement']['bytes_sent'] > len('com.android.chrome:id/url_bar')
+
+
+def test_pool_is_shared():
+    server_url = 'http://appium.example:4723'
+    first = PooledConnection(server_url)
+    second = PooledConnection(server_url + '/')
+
+    assert first._conn is second._conn
+    assert first._conn.manager.connection_pool_kw['maxsize'] == POOL_SIZE
+    assert first._conn.manager.connection_pool_kw['retries'].total is False
+
+
+def test_client_config_is_kept():
+    server_url = 'https://appium.example:4724'
+    config = AppiumClientConfig(remote_server_addr=server_url, keep_alive=True, ignore_certificates=True, timeout=7)
+
+    connection = PooledConnection(server_url, config)
+
+    assert connection._conn.manager.connection_pool_kw['cert_reqs'] == 'CERT_NONE'
+    assert connection._conn.manager.connection_pool_kw['timeout'] == 7
@@ -0,0 +1,142 @@
+"""
+The waits of DriverController on the offline server.
+"""
+import itertools
+import threading
+import time
+
+import pytest
+from selenium.common import TimeoutException, WebDriverException
+
+from shared.appium_util import DEFAULT_WAIT_FOR_IDLE_TIMEOUT_MS
+from shared.locator import Context, Locator
+from webauthn.webauthn_data import WebAuthnLocators
+
+MISSING = Locator.by_id(Context.WEB, 'missing')
+
+
+def test_first_element(offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+
+    element = offline_controller.wait_for_first_element([MISSING, WebAuthnLocators.REGISTER_BUTTON], timeout=1)
+
+    assert element.get_attribute('id') == 'register-button'
+
+
+def test_first_match(offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+
+    locator, _ = offline_controller.wait_for_first_match([MISSING, WebAuthnLocators.REGISTER_BUTTON],
+                                                          time_between_tries=0.1)
+
+    assert locator == WebAuthnLocators.REGISTER_BUTTON
+
+
+def test_first_element_times_out(offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutException):
+        offline_controller.wait_for_first_element([MISSING], timeout=0.3, time_between_tries=0.1)
+
+    assert 0.3 <= time.monotonic() - start < 1
+
+
+def test_zero_timeout_tries_once(offline_server, offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    offline_server.command_count = 0
+
+    with pytest.raises(TimeoutException):
+        offline_controller.wait_for_first_element([MISSING], timeout=0, time_between_tries=0.1)
+
+    assert offline_server.command_count == 1
+
+
+def test_stable_page(offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+
+    start = time.monotonic()
+    snapshot = offline_controller.wait_until_stable(Context.WEB, quiet_period=0.2)
+
+    assert 0.2 <= time.monotonic() - start < 1
+    assert snapshot.is_present(WebAuthnLocators.REGISTER_BUTTON)
+
+
+def test_waits_until_page_stops_changing(offline_scenario, offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    offline_scenario.page = 'logged_in'
+    # The page updates a moment later, like after clicking a Delete button
+    timer = threading.Timer(0.15, lambda: setattr(offline_scenario, 'page', 'logged_in_empty'))
+    timer.start()
+
+    start = time.monotonic()
+    snapshot = offline_controller.wait_until_stable(Context.WEB, quiet_period=0.2)
+    timer.join()
+
+    assert time.monotonic() - start >= 0.35
+    assert not snapshot.is_present(WebAuthnLocators.DELETE_BUTTON)
+
+
+def test_unstable_page_times_out(offline_scenario, offline_controller):
+    offline_controller.open_url('https://webauthn.io')
+    stop = threading.Event()
+
+    def animate():
+        # Every frame is a page of its own, so no two snapshots are the same
+        for frame in itertools.count():
+            if stop.wait(0.02):
+                return
+            offline_scenario.add_page(f'frame{frame}', f'<html><body><p>{frame}</p></body></html>')
+            offline_scenario.page = f'frame{frame}'
+    animation = threading.Thread(target=animate)
+    animation.start()
+    try:
+        start = time.monotonic()
+        offline_controller.wait_until_stable(Context.WEB, quiet_period=0.2, timeout=0.5)
+        elapsed = time.monotonic() - start
+    finally:
+        stop.set()
+        animation.join()
+
+    assert 0.5 <= elapsed < 1.5
+
+
+@pytest.fixture(scope='function')
+def settings(monkeypatch, offline_controller) -> list[dict]:
+    """ The settings the controller sends to UiAutomator2 """
+    sent = []
+    update_settings = offline_controller.driver.update_settings
+    monkeypatch.setattr(offline_controller.driver, 'update_settings',
+                        lambda changed: sent.append(changed) or update_settings(changed))
+    return sent
+
+
+def test_wait_for_idle(offline_server, offline_controller, settings):
+    offline_server.command_count = 0
+
+    offline_controller.wait_for_idle(2)
+
+    # The shorter timeout is only used for the lookup that waits for idle
+    assert settings == [dict(waitForIdleTimeout=2000), dict(waitForIdleTimeout=DEFAULT_WAIT_FOR_IDLE_TIMEOUT_MS)]
+    assert offline_server.command_count == 4
+
+
+def test_wait_for_idle_with_default_timeout(offline_server, offline_controller, settings):
+    offline_controller.switch_context(Context.NATIVE)
+    offline_server.command_count = 0
+
+    offline_controller.wait_for_idle()
+
+    assert settings == []
+    assert offline_server.command_count == 1
+
+
+def test_wait_for_idle_restores_timeout_on_error(monkeypatch, offline_controller, settings):
+    def fail(locator):
+        raise WebDriverException('UiAutomator2 crashed')
+    monkeypatch.setattr(offline_controller, 'find_elements', fail)
+
+    with pytest.raises(WebDriverException):
+        offline_controller.wait_for_idle(2)
+
+    assert settings[-1] == dict(waitForIdleTimeout=DEFAULT_WAIT_FOR_IDLE_TIMEOUT_MS)
@@ -0,0 +1,89 @@
+"""
+The web scripts, and the locator based way the webauthn utilities fall back to when they can't run.
+The offline server can't run javascript, so what the scripts return is faked, and the fallbacks run against it.
+"""
+import pytest
+from selenium.common import JavascriptException, NoSuchElementException, TimeoutException
+
+from shared.locator import Context, Locator
+from shared.web_script import WebScriptExecutor
+from webauthn.webauthn_data import WebAuthnLocators
+from webauthn.webauthn_util import WebauthnUtil
+
+
+class FakeDriver:
+    """ Returns a canned result for every script, or raises it if it is an exception """
+
+    def __init__(self, result):
+        self.result = result
+        self.calls: list[tuple] = []
+
+    def _run(self, script, *args):
+        self.calls.append(args)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    execute_script = execute_async_script = _run
+
+
+class FakeController:
+    """ Just enough of a DriverController to run scripts with """
+
+    def __init__(self, driver: FakeDriver):
+        self.driver = driver
+        self.current_context = Context.NATIVE
+
+    def switch_context(self, context: Context) -> None:
+        self.current_context = context
+
+
+def executor(result) -> WebScriptExecutor:
+    return WebScriptExecutor(FakeController(FakeDriver(result)))
+
+
+def test_fill_passes_xpaths():
+    scripts = executor(True)
+
+    assert scripts.fill(WebAuthnLocators.USERNAME_BOX, 'alice', WebAuthnLocators.REGISTER_BUTTON)
+
+    assert scripts.current_context == Context.WEB
+    assert scripts.controller.driver.calls == [(WebAuthnLocators.USERNAME_BOX.to_xpath(), 'alice',
+                                                WebAuthnLocators.REGISTER_BUTTON.to_xpath())]
+
+
+@pytest.mark.parametrize('result', [False, JavascriptException('Refused to evaluate a string as JavaScript')])
+def test_click_not_done(result):
+    assert executor(result).click(WebAuthnLocators.REGISTER_BUTTON) is None
+
+
+@pytest.mark.parametrize('result, clicked', [(2, 2), (0, 0), (-1, None), (None, None)])
+def test_click_all(result, clicked):
+    assert executor(result).click_all(WebAuthnLocators.DELETE_BUTTON) == clicked
+
+
+def test_wait_for_first_text():
+    locators = [WebAuthnLocators.REGISTER_BUTTON, WebAuthnLocators.DELETE_BUTTON]
+
+    assert executor([1, 'Delete']).wait_for_first_text(locators) == (WebAuthnLocators.DELETE_BUTTON, 'Delete')
+    assert executor(None).wait_for_first_text(locators) is None
+    with pytest.raises(TimeoutException):
+        executor(-1).wait_for_first_text(locators)
+
+
+def test_native_locator_is_refused():
+    with pytest.raises(ValueError):
+        executor(True).click(Locator.by_id(Context.NATIVE, 'com.android.chrome:id/url_bar'))
+
+
+@pytest.mark.parametrize('use_scripts', [False, True], ids=['without_scripts', 'script_failed'])
+def test_delete_credentials_fallback(offline_scenario, offline_controller, use_scripts):
+    wa = WebauthnUtil(offline_controller, use_scripts=use_scripts)
+    wa.open_page()
+    offline_scenario.page = 'logged_in'
+
+    wa.delete_credentials()
+
+    assert offline_scenario.page == 'logged_in_empty'
+    with pytest.raises(NoSuchElementException):
+        wa.delete_credentials()
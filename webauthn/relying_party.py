@@ -0,0 +1,378 @@
+import base64
+import hashlib
+import json
+import secrets
+import subprocess
+import threading
+from http.cookies import SimpleCookie
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+
+from webauthn.webauthn_data import WebAuthnText
+
+# The port the relying party listens on, both on this machine and, through adb reverse, on the device
+DEFAULT_PORT = 8765
+# Browsers only allow WebAuthn on https pages and on localhost, so the device has to reach the server as localhost
+RP_ID = 'localhost'
+
+
+def _b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _user_id(username: str) -> str:
+    """ Get the user handle of a username, always the same one so a discoverable credential replaces the old one """
+    return _b64url_encode(hashlib.sha256(username.encode()).digest()[:16])
+
+
+class RelyingPartyError(Exception):
+    """ Error that is shown on the page in the error alert """
+
+
+class LocalRelyingParty:
+    """
+    Local stand-in for webauthn.io, a WebAuthn relying party with the same ids, classes and texts as
+    WebAuthnLocators and WebAuthnText, so the webauthn tests run against it without any change.
+
+    The browser on the device does the real ceremonies, with GMS and the authenticators, only the server side is
+    simplified: the challenge, origin and type of the client data are checked, but attestations and assertion
+    signatures are not. Credentials are kept in memory and can be reset with a single request to /reset, instead of
+    deleting them one by one on the page. The device reaches the server through `adb reverse`, see reverse_port.
+    """
+
+    def __init__(self, port: int = DEFAULT_PORT, host: str = '127.0.0.1'):
+        """
+        :param port: The port to listen on, 0 to pick a free port.
+        :param host: The address to listen on, adb reverse connects to the loopback address.
+        """
+        self._http = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        # Credential id -> the username it was registered for
+        self.credentials: dict[str, str] = {}
+        # Challenges that were handed out and not yet used, challenge -> the kind of ceremony
+        self._challenges: dict[str, str] = {}
+
+    @property
+    def port(self) -> int:
+        return self._http.server_address[1]
+
+    @property
+    def url(self) -> str:
+        """ Get the url of the page, as seen from both this machine and the device """
+        return f'http://{RP_ID}:{self.port}/'
+
+    def start(self) -> 'LocalRelyingParty':
+        """ Start serving in a background thread """
+        self._thread = threading.Thread(target=self._http.serve_forever, name='local-rp', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """ Stop the server """
+        self._http.shutdown()
+        self._http.server_close()
+
+    def __enter__(self) -> 'LocalRelyingParty':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def reset(self, username: str | None = None) -> None:
+        """ Forget the credentials of a user, of all users if none is given """
+        with self._lock:
+            self.credentials = {credential_id: user for credential_id, user in self.credentials.items()
+                                if username is not None and user != username}
+            if username is None:
+                self._challenges.clear()
+
+    def credentials_of(self, username: str) -> list[str]:
+        """ Get the ids of the credentials registered for a user """
+        with self._lock:
+            return [credential_id for credential_id, user in self.credentials.items() if user == username]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, without this every response waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, content_type: str, body: bytes, headers: dict[str, str] | None = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _username(self) -> str | None:
+                morsel = SimpleCookie(self.headers.get('Cookie', '')).get('username')
+                return unquote(morsel.value) if morsel else None
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path == '/':
+                    self._send(200, 'text/html; charset=utf-8', server.index_page().encode())
+                elif path == '/logged-in' and (username := self._username()) is not None:
+                    self._send(200, 'text/html; charset=utf-8', server.logged_in_page(username).encode())
+                elif path == '/logged-in':
+                    self._send(303, 'text/plain', b'', {'Location': '/'})
+                else:
+                    self._send(404, 'text/plain', b'Not found')
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+                headers = {}
+                try:
+                    if url.path == '/reset':
+                        server.reset(parse_qs(url.query).get('username', [None])[0])
+                        value = dict(ok=True)
+                    elif url.path == '/registration/options':
+                        value = server.registration_options(body.get('username', ''))
+                    elif url.path == '/registration/verify':
+                        value = server.verify_registration(body)
+                    elif url.path == '/authentication/options':
+                        value = server.authentication_options(body.get('username', ''))
+                    elif url.path == '/authentication/verify':
+                        username = server.verify_authentication(body)
+                        headers['Set-Cookie'] = f'username={quote(username)}; Path=/; SameSite=Strict'
+                        value = dict(ok=True)
+                    elif url.path == '/credentials/delete':
+                        server.delete_credential(self._username(), body.get('id', ''))
+                        value = dict(ok=True)
+                    else:
+                        self._send(404, 'text/plain', b'Not found')
+                        return
+                    status = 200
+                except RelyingPartyError as e:
+                    status, value = 400, dict(error=str(e))
+                self._send(status, 'application/json', json.dumps(value).encode(), headers)
+
+        return Handler
+
+    def _challenge(self, kind: str) -> str:
+        challenge = _b64url_encode(secrets.token_bytes(32))
+        with self._lock:
+            self._challenges[challenge] = kind
+        return challenge
+
+    def _check_client_data(self, client_data_json: str, kind: str) -> None:
+        """ Check that the client data is for a challenge of this server and the expected ceremony """
+        try:
+            client_data = json.loads(_b64url_decode(client_data_json))
+        except ValueError:
+            raise RelyingPartyError(WebAuthnText.UNKNOWN_EXCEPTION)
+        with self._lock:
+            challenge_kind = self._challenges.pop(client_data.get('challenge', ''), None)
+        if challenge_kind != kind or client_data.get('type') != f'webauthn.{kind}':
+            raise RelyingPartyError(WebAuthnText.UNKNOWN_EXCEPTION)
+        if urlsplit(client_data.get('origin', '')).hostname != RP_ID:
+            raise RelyingPartyError(WebAuthnText.UNKNOWN_EXCEPTION)
+
+    def registration_options(self, username: str) -> dict:
+        """ Get the options for navigator.credentials.create, like webauthn.io's defaults """
+        return dict(
+            challenge=self._challenge('create'),
+            rp=dict(id=RP_ID, name='Local WebAuthn'),
+            user=dict(id=_user_id(username), name=username, displayName=username),
+            pubKeyCredParams=[dict(type='public-key', alg=-7), dict(type='public-key', alg=-257)],
+            authenticatorSelection=dict(residentKey='preferred', userVerification='preferred'),
+            excludeCredentials=[dict(type='public-key', id=credential_id)
+                                for credential_id in self.credentials_of(username)],
+            attestation='none',
+            timeout=60000,
+        )
+
+    def verify_registration(self, body: dict) -> dict:
+        """ Store the credential that the browser created """
+        self._check_client_data(body.get('clientDataJSON', ''), 'create')
+        with self._lock:
+            self.credentials[body['id']] = body['username']
+        return dict(verified=True)
+
+    def authentication_options(self, username: str) -> dict:
+        """ Get the options for navigator.credentials.get, without a username for discoverable credentials """
+        allowed = self.credentials_of(username) if username else []
+        if username and not allowed:
+            raise RelyingPartyError(WebAuthnText.NO_CREDENTIALS)
+        return dict(
+            challenge=self._challenge('get'),
+            rpId=RP_ID,
+            allowCredentials=[dict(type='public-key', id=credential_id) for credential_id in allowed],
+            userVerification='preferred',
+            timeout=60000,
+        )
+
+    def verify_authentication(self, body: dict) -> str:
+        """ Check the assertion of the browser and return the user it logs in """
+        self._check_client_data(body.get('clientDataJSON', ''), 'get')
+        with self._lock:
+            username = self.credentials.get(body.get('id', ''))
+        if username is None:
+            raise RelyingPartyError(WebAuthnText.UNKNOWN_EXCEPTION)
+        return username
+
+    def delete_credential(self, username: str | None, credential_id: str) -> None:
+        """ Delete one credential of the logged-in user """
+        with self._lock:
+            if username is not None and self.credentials.get(credential_id) == username:
+                del self.credentials[credential_id]
+
+    def index_page(self) -> str:
+        texts = dict(TIMED_OUT_NOT_ALLOWED=WebAuthnText.TIMED_OUT_NOT_ALLOWED,
+                     PREVIOUSLY_REGISTERED=WebAuthnText.PREVIOUSLY_REGISTERED,
+                     UNKNOWN_EXCEPTION=WebAuthnText.UNKNOWN_EXCEPTION,
+                     REGISTER_SUCCESS=WebAuthnText.REGISTER_SUCCESS)
+        return _INDEX_PAGE.replace('/*TEXTS*/', json.dumps(texts))
+
+    def logged_in_page(self, username: str) -> str:
+        rows = ''.join(f'<tr><td>{credential_id[:16]}...</td>'
+                       f'<td><button class="btn btn-danger" data-id="{credential_id}">Delete</button></td></tr>'
+                       for credential_id in self.credentials_of(username))
+        return _LOGGED_IN_PAGE.replace('<!--CREDENTIALS-->', rows)
+
+
+def reverse_port(udid: str | None, port: int, remove: bool = False) -> None:
+    """
+    Make a port of this machine available on the device as localhost, with `adb reverse`.
+
+    :param udid: The serial of the device, None if only one device is connected.
+    :param port: The port, it is the same on both sides.
+    :param remove: Remove the mapping again instead.
+    """
+    command = ['adb'] + (['-s', udid] if udid else []) + ['reverse']
+    command += ['--remove', f'tcp:{port}'] if remove else [f'tcp:{port}', f'tcp:{port}']
+    subprocess.run(command, check=not remove, capture_output=True, timeout=10)
+
+
+_SCRIPT = r'''
+const TEXTS = /*TEXTS*/;
+const decode = s => Uint8Array.from(atob(s.replace(/-/g, '+').replace(/_/g, '/')), c => c.charCodeAt(0));
+const encode = b => btoa(String.fromCharCode(...new Uint8Array(b))).replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '');
+
+function showAlert(success, text) {
+  document.querySelectorAll('.alert').forEach(alert => alert.remove());
+  const alert = document.createElement('div');
+  alert.className = success ? 'alert alert-success' : 'alert alert-danger';
+  alert.textContent = text;
+  document.getElementById('main-content').prepend(alert);
+}
+
+async function post(path, body) {
+  const response = await fetch(path, {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                      body: JSON.stringify(body)});
+  const value = await response.json();
+  if (!response.ok) throw {serverMessage: value.error};
+  return value;
+}
+
+function errorText(e) {
+  if (e.serverMessage) return e.serverMessage;
+  if (e.name === 'NotAllowedError') return TEXTS.TIMED_OUT_NOT_ALLOWED;
+  if (e.name === 'InvalidStateError') return TEXTS.PREVIOUSLY_REGISTERED;
+  return TEXTS.UNKNOWN_EXCEPTION;
+}
+
+async function register(event) {
+  event.preventDefault();
+  const username = document.getElementById('input-email').value;
+  try {
+    const options = await post('/registration/options', {username});
+    options.challenge = decode(options.challenge);
+    options.user.id = decode(options.user.id);
+    options.excludeCredentials.forEach(c => c.id = decode(c.id));
+    const credential = await navigator.credentials.create({publicKey: options});
+    await post('/registration/verify', {username, id: credential.id,
+                                        clientDataJSON: encode(credential.response.clientDataJSON)});
+    showAlert(true, TEXTS.REGISTER_SUCCESS);
+  } catch (e) {
+    showAlert(false, errorText(e));
+  }
+}
+
+async function authenticate(event) {
+  event.preventDefault();
+  const username = document.getElementById('input-email').value;
+  try {
+    const options = await post('/authentication/options', {username});
+    options.challenge = decode(options.challenge);
+    options.allowCredentials.forEach(c => c.id = decode(c.id));
+    const credential = await navigator.credentials.get({publicKey: options});
+    await post('/authentication/verify', {id: credential.id,
+                                          clientDataJSON: encode(credential.response.clientDataJSON)});
+    location.href = '/logged-in';
+  } catch (e) {
+    showAlert(false, errorText(e));
+  }
+}
+
+document.getElementById('register-button').addEventListener('click', register);
+document.getElementById('login-button').addEventListener('click', authenticate);
+'''
+
+_INDEX_PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1">
+  <title>Local WebAuthn</title>
+</head>
+<body>
+  <main class="container">
+    <section id="main-content">
+      <form>
+        <input type="email" id="input-email" placeholder="example_username" autocomplete="username webauthn">
+        <button type="submit" id="register-button">Register</button>
+        <button type="submit" id="login-button">Authenticate</button>
+      </form>
+    </section>
+  </main>
+  <script>''' + _SCRIPT + '''</script>
+</body>
+</html>
+'''
+
+_LOGGED_IN_PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1">
+  <title>Local WebAuthn</title>
+</head>
+<body>
+  <main class="container">
+    <section id="main-content">
+      <h3>You're logged in!</h3>
+      <p><a href="/">Try it again?</a></p>
+      <h4>Your registered credentials</h4>
+      <table class="table">
+        <tbody>
+          <!--CREDENTIALS-->
+        </tbody>
+      </table>
+    </section>
+  </main>
+  <script>
+    document.querySelectorAll('button[data-id]').forEach(button => button.addEventListener('click', async () => {
+      await fetch('/credentials/delete', {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                          body: JSON.stringify({id: button.dataset.id})});
+      button.closest('tr').remove();
+    }));
+  </script>
+</body>
+</html>
+'''
@@ -1,58 +1,184 @@
-import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from selenium.common import NoSuchElementException
 
 from shared.appium_util import DriverController
+from shared.flow import Flow, Step, MAX_RESUMES
 from shared.passkey_util import DEFAULT_USERNAME
+from shared.web_script import WebScriptExecutor
 from webauthn.webauthn_data import *
 
+WEBAUTHN_IO_URL = 'https://webauthn.io/'
+
 
 class WebauthnUtil:
-    def __init__(self, controller: DriverController):
+    def __init__(self, controller: DriverController, use_scripts: bool = True, base_url: str = WEBAUTHN_IO_URL):
+        """
+        :param controller: The controller of the device.
+        :param use_scripts: Interact with the page with javascript, which needs less round trips to Appium.
+                            If a script fails, the locators are used instead.
+        :param base_url: The url of the relying party, webauthn.io or a LocalRelyingParty.
+        """
         self.controller = controller
+        self.scripts = WebScriptExecutor(controller) if use_scripts else None
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
 
     def open_page(self):
-        """ Open the webauthn.io page. """
-        self.controller.open_url('https://webauthn.io/')
+        """ Open the page of the relying party. """
+        self.controller.open_url(self.base_url)
 
     def fill_username(self, username: str = DEFAULT_USERNAME):
         """ Fill the username field. """
-        self.controller.find_element(WebAuthnLocators.USERNAME_BOX).send_keys(username)
+        if self.scripts is None or not self.scripts.fill(WebAuthnLocators.USERNAME_BOX, username):
+            self.controller.send_keys(WebAuthnLocators.USERNAME_BOX, username)
 
     def click_register_button(self):
         """ Press the register button. """
-        self.controller.find_element(WebAuthnLocators.REGISTER_BUTTON).click()
+        if self.scripts is None or not self.scripts.click(WebAuthnLocators.REGISTER_BUTTON):
+            self.controller.click(WebAuthnLocators.REGISTER_BUTTON)
 
     def click_authenticate_button(self):
         """ Press the authenticate button. """
-        self.controller.find_element(WebAuthnLocators.AUTHENTICATE_BUTTON).click()
+        if self.scripts is None or not self.scripts.click(WebAuthnLocators.AUTHENTICATE_BUTTON):
+            self.controller.click(WebAuthnLocators.AUTHENTICATE_BUTTON)
+
+    def register(self, username: str = DEFAULT_USERNAME):
+        """ Fill the username field and press the register button. """
+        if self.scripts is None or not self.scripts.fill(WebAuthnLocators.USERNAME_BOX, username,
+                                                         WebAuthnLocators.REGISTER_BUTTON):
+            self.fill_username(username)
+            self.click_register_button()
+
+    def authenticate(self, username: str = DEFAULT_USERNAME):
+        """ Fill the username field and press the authenticate button. """
+        if self.scripts is None or not self.scripts.fill(WebAuthnLocators.USERNAME_BOX, username,
+                                                         WebAuthnLocators.AUTHENTICATE_BUTTON):
+            self.fill_username(username)
+            self.click_authenticate_button()
+
+    def _wait_for_text(self, locator: Locator) -> str:
+        """ Wait for an element to appear and return its text. """
+        # The script raises if it timed out, only a script that couldn't run falls back to the locator
+        if self.scripts is not None and (match := self.scripts.wait_for_first_text([locator])) is not None:
+            return match[1]
+        return self.controller.wait_for_element(locator).text
 
     def wait_for_success_text(self) -> str:
         """ Wait for success text to appear and return it. """
-        element = self.controller.wait_for_element(WebAuthnLocators.SUCCESS_BOX)
-        return element.text
+        return self._wait_for_text(WebAuthnLocators.SUCCESS_BOX)
 
     def wait_for_error_text(self) -> str:
         """ Wait for the error text to appear and return it. """
-        element = self.controller.wait_for_element(WebAuthnLocators.ERROR_BOX)
-        return element.text
+        return self._wait_for_text(WebAuthnLocators.ERROR_BOX)
+
+    def wait_for_alert_text(self) -> str:
+        """ Wait for the success or the error text to appear and return it. """
+        locators = [WebAuthnLocators.SUCCESS_BOX, WebAuthnLocators.ERROR_BOX]
+        if self.scripts is not None and (match := self.scripts.wait_for_first_text(locators)) is not None:
+            return match[1]
+        return self.controller.wait_for_element(Locator.any_of(*locators)).text
 
     def verify_registered_success(self):
         """ Check that the passkey saved successfully text is present. """
-        text = self.wait_for_success_text()
+        # Also stop waiting when an error appears, so a failed registration doesn't wait for the whole timeout
+        text = self.wait_for_alert_text()
         assert text == WebAuthnText.REGISTER_SUCCESS
 
+    def verify_registered(self) -> bool:
+        """
+        Check that the user has a passkey on the authenticator, either because it was saved now or because the
+        authenticator already had one for the user, e.g. from an earlier test run.
+
+        :return: True if the passkey was saved now.
+        """
+        text = self.wait_for_alert_text()
+        assert text in (WebAuthnText.REGISTER_SUCCESS, WebAuthnText.PREVIOUSLY_REGISTERED)
+        return text == WebAuthnText.REGISTER_SUCCESS
+
     def verify_logged_in(self):
         """ Verify that we are logged in. """
         self.controller.wait_for_element(WebAuthnLocators.LOGGED_IN_TEXT)
 
+    def registration_flow(self, authenticator_steps: list[Step], username: str = DEFAULT_USERNAME,
+                          max_resumes: int = MAX_RESUMES) -> Flow:
+        """
+        Get the whole registration as one flow: open the page, register, go through the steps of the authenticator
+        and check the passkey was saved. A step that fails is retried from the screen the device is on.
+
+        :param authenticator_steps: The steps of the authenticator, like HardwarePasskeyUtil.registration_steps().
+        :param username: The user to register.
+        :param max_resumes: How many times the flow may resume, 0 to fail on the first failing step.
+        """
+        def start():
+            self.open_page()
+            self.register(username)
+
+        return Flow(self.controller, [
+            Step('start', start, screen=WebAuthnLocators.USERNAME_BOX),
+            *authenticator_steps,
+            Step('result', self.verify_registered_success),
+        ], max_resumes)
+
+    def authentication_flow(self, authenticator_steps: list[Step], username: str | None = DEFAULT_USERNAME,
+                            max_resumes: int = MAX_RESUMES) -> Flow:
+        """
+        Get the whole authentication as one flow: open the page, authenticate, go through the steps of the
+        authenticator and check the user is logged in. A step that fails is retried from the screen the device is on.
+
+        :param authenticator_steps: The steps of the authenticator, like HardwarePasskeyUtil.authentication_steps().
+        :param username: The user to authenticate, None to authenticate with a discoverable credential.
+        :param max_resumes: How many times the flow may resume, 0 to fail on the first failing step.
+        """
+        def start():
+            self.open_page()
+            if username is None:
+                self.click_authenticate_button()
+            else:
+                self.authenticate(username)
+
+        return Flow(self.controller, [
+            Step('start', start, screen=WebAuthnLocators.USERNAME_BOX),
+            *authenticator_steps,
+            Step('result', self.verify_logged_in),
+        ], max_resumes)
+
     def delete_credentials(self):
-        """ Delete all credentials for the currently logged-in user. """
+        """
+        Delete all credentials for the currently logged-in user.
+
+        :raises NoSuchElementException: If the user has no credentials to delete.
+        """
+        if self.scripts is not None and (clicked := self.scripts.click_all(WebAuthnLocators.DELETE_BUTTON)) is not None:
+            if clicked == 0:
+                raise NoSuchElementException(f'No element found for {WebAuthnLocators.DELETE_BUTTON}')
+            return
+
         button = self.controller.find_element(WebAuthnLocators.DELETE_BUTTON)
         while button is not None:
             button.click()
-            # Small delay to give the site time to update and prevent stale references
-            time.sleep(0.5)
+            # Give the site time to update, to prevent stale references
+            self.controller.wait_until_stable(Context.WEB)
             button = self.controller.find_element_or_none(WebAuthnLocators.DELETE_BUTTON)
 
+    def reset_credentials(self, username: str | None = None) -> bool:
+        """
+        Delete the credentials of a user, of all users if none is given, with a single request to the relying party.
+        Only a LocalRelyingParty supports this, the passkeys on the authenticators themselves are left alone.
+
+        :return: False if the relying party doesn't support it, use delete_credentials instead.
+        """
+        if self.base_url == WEBAUTHN_IO_URL:
+            return False
+        url = self.base_url + 'reset' + (f'?{urllib.parse.urlencode(dict(username=username))}' if username else '')
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, method='POST'), timeout=10):
+                return True
+        except urllib.error.URLError:
+            return False
+
     def log_out(self):
         """ Log out the user. """
-        self.controller.find_element(WebAuthnLocators.LOG_OUT_BUTTON).click()
+        if self.scripts is None or not self.scripts.click(WebAuthnLocators.LOG_OUT_BUTTON):
+            self.controller.click(WebAuthnLocators.LOG_OUT_BUTTON)